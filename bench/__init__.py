@@ -0,0 +1,7 @@
+# the 'bench' package benchmarks ETFGraph on synthetic ETF universes served by a local FMP stand-in.
+from .universe import generate_universe
+from .universe import generate_fmp_details
+from .server import FakeFMPServer
+from .server import use_base_url
+from .run import run_benchmarks
+from .run import compare
\ No newline at end of file
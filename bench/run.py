@@ -0,0 +1,212 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from src import fmp
+from src import graph
+from src import viz
+from src.instrument.tracer import peak_rss_mb
+
+from .server import FakeFMPServer, use_base_url
+from .universe import generate_fmp_details, generate_universe
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), 'baselines')
+DEFAULT_SIZES = (100, 1000, 10000)
+BENCHMARKS = ('fetch_sync', 'fetch_async', 'build', 'louvain', 'label_propagation', 'modularity', 'pagerank', 'plot')
+REGRESSION_THRESHOLD = 0.2  # 20% slower than the baseline
+NOISE_FLOOR = 0.01  # Differences below 10 ms are never reported as regressions
+
+
+def measure(fn, repeat=3):
+    """
+    measure runs a function `repeat` times with its output silenced and returns its timings.
+
+    Returns:
+        tuple: The result of the last run and a dictionary with the median and minimum 'wall' and 'cpu' times in
+            seconds and the process 'peak_rss_mb' after the runs.
+    """
+    walls, cpus = [], []
+    result = None
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fn()
+        walls.append(time.perf_counter() - start_wall)
+        cpus.append(time.process_time() - start_cpu)
+    return result, {
+        'wall': statistics.median(walls),
+        'wall_min': min(walls),
+        'cpu': statistics.median(cpus),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def bench_fetch(size, engine, latency, rate_429, seed):
+    """ Times a full pull of a synthetic universe from a local FMP stand-in with the sync or async engine. """
+    etf_list, holdings = generate_universe(size, seed=seed)
+    with FakeFMPServer(etf_list, holdings, latency=latency, jitter=latency / 2, rate_429=rate_429, retry_after=0.05, seed=seed) as server:
+        with use_base_url(server.base_url):
+            pull = fmp.pull_etf_positions_async if engine == 'async' else fmp.pull_etf_positions
+            # A high rate limit makes the benchmark measure the engine rather than the limiter
+            details, timing = measure(lambda: pull(-1, 'bench', rate_limit=60000), repeat=1)
+        timing['requests'] = server.requests
+        timing['throttled'] = server.throttled
+    timing['etfs_per_second'] = len(details or {}) / timing['wall']
+    return timing
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, benchmarks=BENCHMARKS, repeat=3, seed=0, fetch_max=1000, plot_max=1000, latency=0.02, rate_429=0.02):
+    """
+    run_benchmarks times every benchmark at every universe size.
+
+    Args:
+        sizes (tuple): The numbers of ETFs of the synthetic universes.
+        benchmarks (tuple): The benchmarks to run, see BENCHMARKS.
+        repeat (int): The number of runs per measurement, the median is reported.
+        seed (int): The seed of the synthetic universes.
+        fetch_max (int): The largest universe the fetch benchmarks run on, as they are bound by the simulated latency.
+        plot_max (int): The largest universe plot_graph is benchmarked on.
+        latency (float): The mean latency of the FMP stand-in in seconds.
+        rate_429 (float): The fraction of requests the FMP stand-in rejects with HTTP 429.
+
+    Returns:
+        dict: The 'meta' data of the run and the 'results', keyed by '<benchmark>/<size>'.
+    """
+    results = {}
+    for size in sizes:
+        print(f"[+] Universe of {size} ETFs")
+        details = generate_fmp_details(size, seed=seed)
+        G = partition = None
+
+        def record(name, timing):
+            results[f"{name}/{size}"] = timing
+            print(f"  {name}: {timing['wall']:.3f}s")
+
+        for engine in ('sync', 'async'):
+            if f"fetch_{engine}" in benchmarks and size <= fetch_max:
+                record(f"fetch_{engine}", bench_fetch(size, engine, latency, rate_429, seed))
+
+        G, timing = measure(lambda: graph.create_graph_from_fmp(details), repeat)
+        timing.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
+        if 'build' in benchmarks:
+            record('build', timing)
+        if 'louvain' in benchmarks or 'modularity' in benchmarks:
+            partition, timing = measure(lambda: graph.detect_communities_louvain(G), repeat)
+            if 'louvain' in benchmarks:
+                record('louvain', timing)
+        if 'label_propagation' in benchmarks:
+            record('label_propagation', measure(lambda: graph.detect_communities_overlapping(G), repeat)[1])
+        if 'modularity' in benchmarks:
+            record('modularity', measure(lambda: graph.community_modularity(G, partition), repeat)[1])
+        if 'pagerank' in benchmarks:
+            record('pagerank', measure(lambda: graph.perform_pagerank(G), repeat)[1])
+        if 'plot' in benchmarks and size <= plot_max:
+            # Rendered headlessly, the image is discarded
+            record('plot', measure(lambda: viz.plot_graph(G, partition, output_file=os.devnull), repeat=1)[1])
+
+    return {
+        'meta': {
+            'created': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'sizes': list(sizes),
+            'repeat': repeat,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """
+    compare matches a run against a baseline run.
+
+    Args:
+        current (dict): The run, as returned by run_benchmarks.
+        baseline (dict): The baseline run.
+        threshold (float): The relative slowdown reported as a regression.
+
+    Returns:
+        tuple: A list of (name, baseline wall, current wall, ratio, regressed) rows and the number of regressions.
+    """
+    rows = []
+    for name, timing in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = timing['wall'] / base['wall'] if base['wall'] > 0 else float('inf')
+        regressed = ratio > 1 + threshold and timing['wall'] - base['wall'] > NOISE_FLOOR
+        rows.append((name, base['wall'], timing['wall'], ratio, regressed))
+    return rows, sum(1 for row in rows if row[4])
+
+
+def format_report(rows):
+    """ Formats the rows of compare as a plain-text table. """
+    lines = [f"{'benchmark':<28} {'baseline':>10} {'current':>10} {'change':>8}"]
+    for name, base, current, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        lines.append(f"{name:<28} {base:>9.3f}s {current:>9.3f}s {ratio - 1:>+7.1%}{flag}")
+    return '\n'.join(lines)
+
+
+def _baseline_path(name):
+    """ Returns the path of a named baseline, or the argument itself if it is already a path. """
+    return name if name.endswith('.json') else os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ETFGraph benchmark suite on synthetic ETF universes")
+    parser.add_argument('--sizes', type=str, help='Comma-separated universe sizes in ETFs (default 100,1000,10000)', default=','.join(map(str, DEFAULT_SIZES)))
+    parser.add_argument('--only', type=str, help=f"Comma-separated benchmarks to run, out of {','.join(BENCHMARKS)}")
+    parser.add_argument('--repeat', type=int, help='Runs per measurement, the median is reported', default=3)
+    parser.add_argument('--seed', type=int, help='Seed of the synthetic universes', default=0)
+    parser.add_argument('--fetch_max', type=int, help='Largest universe to benchmark fetching on', default=1000)
+    parser.add_argument('--plot_max', type=int, help='Largest universe to benchmark plotting on', default=1000)
+    parser.add_argument('--latency', type=float, help='Mean latency of the local FMP stand-in in seconds', default=0.02)
+    parser.add_argument('--rate_429', type=float, help='Fraction of requests the FMP stand-in rejects with HTTP 429', default=0.02)
+    parser.add_argument('-o', '--output', type=str, help='Output file path for the results in JSON format')
+    parser.add_argument('--baseline', type=str, help='Baseline to compare against, a name in bench/baselines or a JSON path')
+    parser.add_argument('--save_baseline', type=str, help='Save the results as a named baseline in bench/baselines (or a JSON path)')
+    parser.add_argument('--threshold', type=float, help='Relative slowdown reported as a regression (default 0.2)', default=REGRESSION_THRESHOLD)
+    args = parser.parse_args(argv)
+
+    benchmarks = tuple(args.only.split(',')) if args.only else BENCHMARKS
+    unknown = set(benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    run = run_benchmarks(tuple(int(size) for size in args.sizes.split(',')), benchmarks, args.repeat, args.seed,
+                         args.fetch_max, args.plot_max, args.latency, args.rate_429)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(run, f, indent=4)
+        print(f"[+] Results saved to {args.output}")
+    if args.save_baseline:
+        path = _baseline_path(args.save_baseline)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=4)
+        print(f"[+] Baseline saved to {path}")
+
+    if args.baseline:
+        with open(_baseline_path(args.baseline), 'r') as f:
+            baseline = json.load(f)
+        rows, regressions = compare(run, baseline, args.threshold)
+        print(format_report(rows))
+        if regressions:
+            print(f"[!] {regressions} regression{'s' if regressions != 1 else ''} over {args.threshold:.0%}")
+            return 1
+        print("[+] No regressions")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from src.fmp import async_pull, pull_etfs
+
+from .universe import generate_universe
+
+
+class FakeFMPServer:
+    """
+    FakeFMPServer is a local stand-in for the Financial Modeling Prep API, serving /etf/list and /etf-holder/{symbol}
+    from a synthetic universe so the fetch engines can be benchmarked without an API key or quota.
+
+    Every request waits for a random latency, and a configurable fraction of holdings requests is answered with
+    HTTP 429 and a Retry-After header, as the real API does when the rate limit is exceeded.
+
+    Args:
+        etf_list (list): The /etf/list response.
+        holdings (dict): The /etf-holder response of every ETF symbol.
+        latency (float): The mean response latency in seconds.
+        jitter (float): The latency varies uniformly by up to this many seconds around the mean.
+        rate_429 (float): The fraction of holdings requests rejected with HTTP 429.
+        retry_after (float): The Retry-After value sent with HTTP 429 responses, in seconds.
+        host (str): The interface to listen on.
+        port (int): The port to listen on, 0 picks a free port.
+        seed (int): Seed of the latency and 429 draws.
+    """
+
+    def __init__(self, etf_list, holdings, latency=0.05, jitter=0.02, rate_429=0.0, retry_after=1.0, host='127.0.0.1', port=0, seed=0):
+        self.etf_list = json.dumps(etf_list).encode()
+        self.holdings = {symbol: json.dumps(positions).encode() for symbol, positions in holdings.items()}
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.requests = 0
+        self.throttled = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """ str: The URL to use in place of FMP_BASE_URL. """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v3"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+            def _send(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    delay = max(0.0, server.latency + server._rng.uniform(-server.jitter, server.jitter))
+                    throttle = server._rng.random() < server.rate_429
+                time.sleep(delay)
+
+                path = urlparse(self.path).path
+                if path == '/api/v3/etf/list':
+                    self._send(200, server.etf_list)
+                elif path.startswith('/api/v3/etf-holder/'):
+                    if throttle:
+                        with server._lock:
+                            server.throttled += 1
+                        self._send(429, b'{"Error Message": "Limit Reach"}', {'Retry-After': f"{server.retry_after:g}"})
+                        return
+                    body = server.holdings.get(path.rsplit('/', 1)[-1])
+                    self._send(200, body if body is not None else b'[]')
+                else:
+                    self._send(404, b'{"Error Message": "Not found"}')
+
+        return Handler
+
+    def start(self):
+        """ Serves requests on a background thread. """
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+@contextmanager
+def use_base_url(base_url):
+    """ Points both fetch engines at another API base URL, e.g. a FakeFMPServer, for the duration of the block. """
+    previous = pull_etfs.FMP_BASE_URL, async_pull.FMP_BASE_URL
+    pull_etfs.FMP_BASE_URL = async_pull.FMP_BASE_URL = base_url
+    try:
+        yield base_url
+    finally:
+        pull_etfs.FMP_BASE_URL, async_pull.FMP_BASE_URL = previous
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local Financial Modeling Prep stand-in serving a synthetic ETF universe")
+    parser.add_argument('-n', '--num', type=int, help='The number of ETFs in the universe', default=1000)
+    parser.add_argument('--seed', type=int, help='The seed of the universe', default=0)
+    parser.add_argument('--port', type=int, help='The port to listen on', default=8765)
+    parser.add_argument('--latency', type=float, help='The mean response latency in seconds', default=0.05)
+    parser.add_argument('--rate_429', type=float, help='The fraction of holdings requests answered with HTTP 429', default=0.0)
+    args = parser.parse_args()
+
+    etf_list, holdings = generate_universe(args.num, seed=args.seed)
+    server = FakeFMPServer(etf_list, holdings, latency=args.latency, rate_429=args.rate_429, port=args.port)
+    print(f"[+] Serving {args.num} ETFs at {server.base_url}, run main.py with FMP_BASE_URL={server.base_url} FMPKey=bench")
+    try:
+        server.start()._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
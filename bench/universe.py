@@ -0,0 +1,95 @@
+import random
+
+from src.fmp.pull_etfs import etf_entry
+
+SECTORS = ('Technology', 'Healthcare', 'Financials', 'Energy', 'Industrials', 'Utilities', 'Materials', 'Consumer',
+           'Real Estate', 'Communication', 'Dividend', 'Growth', 'Value', 'Small Cap', 'Emerging Markets', 'Bond')
+ISSUERS = ('iShares', 'Vanguard', 'SPDR', 'Invesco', 'Schwab', 'First Trust', 'Global X', 'WisdomTree', 'ProShares', 'Direxion')
+LEVERAGED_NAMES = ('Daily 2x', '3x Leveraged', 'Ultra Double')
+INVERSE_NAMES = ('Short', 'Bear', 'Inverse')
+
+
+def _symbol(prefix, i):
+    """ Returns a short unique ticker-like symbol, e.g. 'E0A3'. """
+    return f"{prefix}{i:X}"
+
+
+def generate_universe(num_etfs, num_stocks=None, seed=0, leveraged_rate=0.04, inverse_rate=0.03, fund_of_funds_rate=0.02,
+                      min_holdings=10, max_holdings=3000, holdings_exponent=1.6, popularity_exponent=1.1):
+    """
+    generate_universe builds a synthetic but realistic ETF universe in the shape of the FMP API responses.
+
+    Holdings counts follow a power law, so most ETFs hold a few dozen stocks and a handful hold thousands. Stocks
+    are drawn with Zipf popularity, so a small set of mega caps appears in most ETFs and the tail is held by few,
+    which gives the heavily overlapping structure of the real market. Weights decay with the popularity rank of the
+    stock within each ETF and sum to 100. Some ETFs are named like leveraged or inverse products so that
+    analyze_etf_attributes flags them, a few hold other ETFs, and a few have negative (short) positions.
+
+    Args:
+        num_etfs (int): The number of ETFs.
+        num_stocks (int, optional): The number of stocks, defaults to 5 per ETF with a minimum of 500.
+        seed (int): The random seed, the same arguments always give the same universe.
+        leveraged_rate (float): The fraction of leveraged ETFs.
+        inverse_rate (float): The fraction of inverse ETFs.
+        fund_of_funds_rate (float): The fraction of ETFs that also hold other ETFs.
+        min_holdings (int): The minimum number of holdings of an ETF.
+        max_holdings (int): The maximum number of holdings of an ETF.
+        holdings_exponent (float): The Pareto exponent of the holdings counts, lower means heavier tails.
+        popularity_exponent (float): The Zipf exponent of the stock popularity.
+
+    Returns:
+        tuple: The /etf/list response (a list of {'symbol', 'name'} items) and a dictionary mapping every ETF symbol to
+            its /etf-holder response (a list of {'asset', 'weightPercentage'} items).
+    """
+    rng = random.Random(seed)
+    num_stocks = num_stocks or max(500, 5 * num_etfs)
+    stocks = [_symbol('S', i) for i in range(num_stocks)]
+    popularity = [1.0 / (rank + 1) ** popularity_exponent for rank in range(num_stocks)]
+    # Cumulative weights make every rng.choices call O(k log n) instead of O(n)
+    cumulative = []
+    total = 0.0
+    for p in popularity:
+        total += p
+        cumulative.append(total)
+
+    etf_list = []
+    holdings = {}
+    etf_symbols = [_symbol('E', i) for i in range(num_etfs)]
+    for i, symbol in enumerate(etf_symbols):
+        kind = rng.random()
+        name = f"{rng.choice(ISSUERS)} {rng.choice(SECTORS)}"
+        if kind < leveraged_rate:
+            name = f"{name} {rng.choice(LEVERAGED_NAMES)} ETF"
+        elif kind < leveraged_rate + inverse_rate:
+            name = f"{name} {rng.choice(INVERSE_NAMES)} ETF"
+        else:
+            name = f"{name} ETF"
+        etf_list.append({'symbol': symbol, 'name': name})
+
+        count = int(min(max_holdings, min_holdings * rng.paretovariate(holdings_exponent)))
+        count = min(count, num_stocks)
+        chosen = set()
+        while len(chosen) < count:
+            chosen.update(rng.choices(range(num_stocks), cum_weights=cumulative, k=count - len(chosen)))
+        ranked = sorted(chosen)
+
+        raw = [popularity[j] * rng.uniform(0.5, 1.5) for j in ranked]
+        scale = 100.0 / sum(raw)
+        positions = [{'asset': stocks[j], 'weightPercentage': round(w * scale, 4)} for j, w in zip(ranked, raw)]
+        if rng.random() < 0.01 and positions:
+            positions[-1]['weightPercentage'] = -positions[-1]['weightPercentage']
+        if i > 0 and rng.random() < fund_of_funds_rate:
+            for held in rng.sample(etf_symbols[:i], min(3, i)):
+                positions.append({'asset': held, 'weightPercentage': round(rng.uniform(1, 10), 4)})
+        holdings[symbol] = positions
+
+    return etf_list, holdings
+
+
+def generate_fmp_details(num_etfs, seed=0, **kwargs):
+    """
+    generate_fmp_details returns a synthetic universe in the format of fmp.pull_etf_positions, ready for
+    create_graph_from_fmp (see generate_universe for the arguments).
+    """
+    etf_list, holdings = generate_universe(num_etfs, seed=seed, **kwargs)
+    return {etf['symbol']: etf_entry(etf, holdings[etf['symbol']]) for etf in etf_list}
@@ -3,16 +3,18 @@ import os
 import pickle
 import sys
 import argparse
+from datetime import date
 
 from dotenv import load_dotenv # type: ignore
-from cdlib import NodeClustering
 
 from src import fmp
 from src import graph
+from src import instrument
 from src import viz
 
 
-def init_etfgraph(num_etf=-1, display=False, rate_limit=150, output_file=None, graph_file=None):
+def init_etfgraph(num_etf=-1, display=False, rate_limit=150, output_file=None, graph_file=None, cache_file=None, offline=False, refresh_all=False, async_fetch=False, ensemble_runs=0,
+                  previous_communities=None, changed_etfs=None, communities_file=None, update=False, lookthrough=False, results_cache=None, trace_file=None, plot_file=None, seed=None):
     """
     init_etfgraph initializes and analyzes the ETF graph with detailed statistics and community analysis.
     It detects communities, identifies the largest ones, and analyzes the top stocks within these communities.
@@ -24,7 +26,21 @@ def init_etfgraph(num_etf=-1, display=False, rate_limit=150, output_file=None, g
         display (bool): Display the graph visualization.
         rate_limit (int): The rate limit for API requests (default 150/minute).
         output_file (str): Output file path for saving the results in JSON format.
-        graph_file (str): Optional path to a pickled graph file to load instead of pulling data.
+        graph_file (str): Optional path to a graph snapshot (or legacy pickle file) to load instead of pulling data.
+        cache_file (str): Optional path to the on-disk holdings cache.
+        offline (bool): Only use cached holdings and never hit the API.
+        refresh_all (bool): Ignore cached holdings and fetch every ETF again.
+        async_fetch (bool): Use the asyncio fetch engine instead of the thread pool.
+        ensemble_runs (int): If set, use the consensus of this many seeded Louvain and label propagation runs per method.
+        previous_communities (str): Optional path to a saved partition to update incrementally instead of detecting from scratch.
+        changed_etfs (list): ETFs whose holdings changed since the previous partition was saved.
+        communities_file (str): Optional path to save the Louvain partition to for the next incremental run.
+        update (bool): Re-fetch the stale ETFs of the cache and apply their changes to the loaded graph instead of rebuilding it.
+        lookthrough (bool): Also rank stocks by look-through weight, expanding ETFs held by other ETFs into their holdings.
+        results_cache (str): Optional directory of the on-disk cache of analysis results, keyed by the graph contents.
+        trace_file (str): Optional path to write the per-stage spans to as a Chrome trace file.
+        plot_file (str): Optional image path to render the graph visualization to, without a display.
+        seed (int): Pick the `num_etf` ETFs deterministically with this seed instead of at random.
 
     Returns:
         nx.Graph: The ETF graph.
@@ -33,81 +49,141 @@ def init_etfgraph(num_etf=-1, display=False, rate_limit=150, output_file=None, g
         The function prints the analysis results and saves them to a JSON file if specified.
     """
     results = {}
+    bipartite_graph = None
     if graph_file:
         try:
-            with open(graph_file, 'rb') as f:
-                etf_graph = pickle.load(f)
+            with instrument.span('main.load_graph') as attrs:
+                if graph.is_snapshot(graph_file):
+                    # Memory-mapped, the degree and weight analyses below run on it without NetworkX
+                    bipartite_graph = graph.load_snapshot(graph_file)
+                    etf_graph = bipartite_graph.to_networkx()
+                else:
+                    with open(graph_file, 'rb') as f:
+                        etf_graph = pickle.load(f)
+                attrs.update(nodes=etf_graph.number_of_nodes(), edges=etf_graph.number_of_edges())
             print("[+] Loaded graph from file.")
         except Exception as e:
             print(f"Error loading the graph from file: {e}")
             return None
+
+        if update:
+            cache = fmp.HoldingsCache(cache_file) if cache_file else None
+            try:
+                stream = fmp.stream_etf_positions_async if async_fetch else fmp.stream_etf_positions
+                fmp_changes = stream(num_etf, os.getenv("FMPKey"), rate_limit=rate_limit, cache=cache, offline=offline, refresh_all=refresh_all, only_stale=True, seed=seed)
+                if fmp_changes is None:
+                    print("Failed to fetch the changed ETFs. Exiting.")
+                    return None
+                if bipartite_graph is not None:
+                    bipartite_graph, changes = graph.update_graph(bipartite_graph, fmp_changes)
+                    with instrument.span('graph.to_networkx'):
+                        etf_graph = bipartite_graph.to_networkx()
+                else:
+                    etf_graph, changes = graph.update_graph(etf_graph, fmp_changes)
+            finally:
+                if cache is not None:
+                    cache.close()
+            results['changes'] = {key: len(value) for key, value in changes.items()}
+            print(f"[+] Updated {len(changes['etfs'])} ETFs: {len(changes['added_edges'])} holdings added, "
+                  f"{len(changes['removed_edges'])} removed, {len(changes['reweighted_edges'])} reweighted.")
+            if changed_etfs is None:
+                changed_etfs = sorted(changes['etfs'])
     else:
-        etf_graph = graph.create_graph_from_fmp(fmp.pull_etf_positions(num_etf, os.getenv("FMPKey"), rate_limit=rate_limit))
+        cache = fmp.HoldingsCache(cache_file) if cache_file else None
+        try:
+            # Holdings are added to the graph as each response arrives instead of after the whole pull
+            stream = fmp.stream_etf_positions_async if async_fetch else fmp.stream_etf_positions
+            etf_graph = graph.create_graph_from_stream(stream(num_etf, os.getenv("FMPKey"), rate_limit=rate_limit, cache=cache, offline=offline, refresh_all=refresh_all, seed=seed))
+        finally:
+            if cache is not None:
+                cache.close()
         if etf_graph is None:
             print("Failed to create graph. Exiting.")
             return None
 
     print("[+] ETF Graph created successfully.")
-    print("[+] Detecting communities in the graph...")
-    communities = graph.detect_communities_louvain(etf_graph)
-    overlapping_communities = graph.detect_communities_overlapping(etf_graph)
+    # Analyses of a graph whose contents were already analyzed are served from the results cache
+    result_cache = graph.ResultCache(results_cache) if results_cache else None
+    def run(fn, G, *args, **kwargs):
+        return result_cache.call(fn, G, *args, **kwargs) if result_cache else fn(G, *args, **kwargs)
 
-    community_size = {com: len([node for node in communities if communities[node] == com]) for com in set(communities.values())}
-    largest_communities = sorted(community_size.items(), key=lambda x: x[1], reverse=True)[:5]
+    print("[+] Detecting communities in the graph...")
+    if previous_communities:
+        print(f"[+] Updating communities from {previous_communities} ({len(changed_etfs or [])} changed ETFs)...")
+        communities = graph.detect_communities_incremental(etf_graph, graph.load_partition(previous_communities), changed_etfs or [])
+    elif ensemble_runs:
+        print(f"[+] Running community detection ensemble with {ensemble_runs} runs per method...")
+        ensemble = run(graph.detect_communities_ensemble, etf_graph, runs=ensemble_runs)
+        communities = ensemble['partition']
+        mean_stability = sum(ensemble['stability'].values()) / max(len(ensemble['stability']), 1)
+        results['ensemble'] = {
+            'consensus_modularity': ensemble['modularity'],
+            'mean_stability': mean_stability,
+            'run_modularities': ensemble['run_modularities'],
+        }
+        print(f"[+] Consensus modularity: {ensemble['modularity']:.4f}, mean node stability: {mean_stability:.2%}")
+    else:
+        communities = run(graph.detect_communities_louvain, etf_graph)
+    overlapping_communities = run(graph.detect_communities_overlapping, etf_graph)
+    if communities_file:
+        graph.save_partition(communities, communities_file)
+        print(f"[+] Communities saved to {communities_file}")
 
     community_results = {}
     print("[+] Analyzing top 5 largest communities:")
-    for com, size in largest_communities:
-        print(f"  Community {com} with {size} members")
-        community_nodes = [node for node in etf_graph.nodes() if communities[node] == com]
-        stock_weights = {node: sum(data['weight'] for u, v, data in etf_graph.edges(node, data=True) if etf_graph.nodes[u]['type'] == 'Stock' or etf_graph.nodes[v]['type'] == 'Stock') for node in community_nodes if etf_graph.nodes[node]['type'] == 'Stock'}
-        top_stocks = sorted(stock_weights.items(), key=lambda item: item[1], reverse=True)[:10]
-        community_results[com] = top_stocks
+    with instrument.span('graph.summarize_communities'):
+        community_summaries = graph.summarize_communities(etf_graph, communities, top_communities=5)
+    for com, summary in community_summaries.items():
+        print(f"  Community {com} with {summary['size']} members")
+        community_results[com] = summary['top_stocks']
         print(f"  Top 10 stocks in Community {com}:")
-        for stock, weight in top_stocks:
+        for stock, weight in summary['top_stocks']:
             print(f"    {stock}: {weight:.2f}")
     results['community_analysis'] = community_results
 
     # Analyzing overlapping communities (only top 5 largest for consistency)
     if overlapping_communities:
-        overlapping_community_sizes = {i: len(com) for i, com in enumerate(overlapping_communities.communities)}
-        largest_overlapping_communities = sorted(overlapping_community_sizes.items(), key=lambda x: x[1], reverse=True)[:5]
         overlapping_community_results = {}
         print("[+] Analyzing top 5 largest overlapping communities:")
-        for i, size in largest_overlapping_communities:
-            community = overlapping_communities.communities[i]
-            community_nodes = list(community)
-            stock_weights = {node: sum(data['weight'] for u, v, data in etf_graph.edges(node, data=True) if etf_graph.nodes[u]['type'] == 'Stock' or etf_graph.nodes[v]['type'] == 'Stock') for node in community_nodes if etf_graph.nodes[node]['type'] == 'Stock'}
-            top_stocks = sorted(stock_weights.items(), key=lambda item: item[1], reverse=True)[:10]
-            overlapping_community_results[i] = top_stocks
+        for i, summary in graph.summarize_communities(etf_graph, overlapping_communities, top_communities=5).items():
+            overlapping_community_results[i] = summary['top_stocks']
             print(f"  Top 10 stocks in Overlapping Community {i}:")
-            for stock, weight in top_stocks:
+            for stock, weight in summary['top_stocks']:
                 print(f"    {stock}: {weight:.2f}")
         results['overlapping_community_analysis'] = overlapping_community_results
 
     # Deep community analysis (Modularity)
-    modularity_score = graph.community_modularity(etf_graph, communities)
+    modularity_score = run(graph.community_modularity, etf_graph, communities)
     results['modularity_score'] = modularity_score
     print(f"[+] Louvain Modularity Score: {modularity_score}")
 
     # For overlapping communities (already in NodeClustering format):
-    if isinstance(overlapping_communities, NodeClustering):
-        overlapping_modularity_score = graph.community_modularity(etf_graph, overlapping_communities)
+    if hasattr(overlapping_communities, 'communities'):
+        overlapping_modularity_score = run(graph.community_modularity, etf_graph, overlapping_communities)
         results['overlapping_modularity_score'] = overlapping_modularity_score
         print(f"[+] Overlapping Modularity Score: {overlapping_modularity_score}")
 
-    etf_types = graph.analyze_etf_types(etf_graph)
-    sentiment_scores = graph.sentiment_analysis_by_etf_type(etf_types)
+    with instrument.span('graph.rankings'):
+        etf_types = graph.analyze_etf_types(bipartite_graph or etf_graph)
+        sentiment_scores = graph.sentiment_analysis_by_etf_type(etf_types)
+        most_weight = graph.stocks_with_most_weight(bipartite_graph or etf_graph)[:10]
+        most_inclusions = graph.stocks_with_most_inclusions(bipartite_graph or etf_graph)[:10]
     results['sentiment'] = sentiment_scores
 
-    most_weight = graph.stocks_with_most_weight(etf_graph)[:10]
-    most_inclusions = graph.stocks_with_most_inclusions(etf_graph)[:10]
-    pagerank_scores = graph.perform_pagerank(etf_graph)
+    pagerank_scores = run(graph.perform_pagerank, etf_graph)
     top_pagerank = sorted(pagerank_scores.items(), key=lambda item: item[1], reverse=True)[:10]
 
     results['top_stocks_by_weight'] = most_weight
     results['top_stocks_by_inclusion'] = most_inclusions
     results['top_stocks_by_pagerank'] = top_pagerank
+    if lookthrough:
+        try:
+            with instrument.span('graph.lookthrough'):
+                most_exposure = graph.stocks_with_most_exposure(bipartite_graph or etf_graph)[:10]
+            results['top_stocks_by_lookthrough_weight'] = most_exposure
+        except ValueError as e:
+            print(f"[!] Skipping look-through weights: {e}")
+            lookthrough = False
 
     print("Top 10 stocks by weight:")
     for stock, weight in most_weight:
@@ -121,39 +197,423 @@ def init_etfgraph(num_etf=-1, display=False, rate_limit=150, output_file=None, g
     for stock, score in top_pagerank:
         print(f"  {stock}: {score:.4f}")
 
+    if lookthrough:
+        print("Top 10 stocks by look-through weight:")
+        for stock, weight in most_exposure:
+            print(f"  {stock}: {weight:.2f}")
+
+    if result_cache:
+        print(f"[+] Results cache: {result_cache.hits} hits, {result_cache.misses} misses")
+
+    results['instrumentation'] = instrument.TRACER.report()
+    stages = [span for span in results['instrumentation']['spans'] if span['depth'] == 0]
+    print("[+] Stage timings:")
+    for stage in stages:
+        print(f"  {stage['name']}: {stage['wall']:.3f}s wall, {stage['cpu']:.3f}s CPU")
+
     if output_file:
         with open(output_file, 'w') as f:
             json.dump(results, f, indent=4)
         print(f"[+] Results saved to {output_file}")
 
-    if display:
+    if display or plot_file:
         print("[+] Visualizing ETF graph...")
-        viz.plot_graph(etf_graph, communities)
+        with instrument.span('viz.plot'):
+            viz.plot_graph(etf_graph, communities, output_file=plot_file, layout_cache=result_cache)
+        if plot_file:
+            print(f"[+] Graph visualization saved to {plot_file}")
 
-    return etf_graph
+    if trace_file:
+        instrument.TRACER.write_trace(trace_file)
+        print(f"[+] Trace saved to {trace_file}")
 
-if __name__ == '__main__':
-    load_dotenv()
+    return etf_graph
 
-    parser = argparse.ArgumentParser(description="ETF Position Graph Analysis Tool")
+def add_pipeline_arguments(parser):
+    """ Adds the options of the full fetch, build and analyze pipeline, shared by the legacy CLI and `analyze`. """
     parser.add_argument('-n', '--num', type=int, help='The number of ETFs to analyze, if not provided all will be used', default=-1)
     parser.add_argument('-d', '--display', action='store_true', help='Display the graph visualization', default=False)
+    parser.add_argument('--plot_file', type=str, help='Render the graph visualization to an image file instead of a window (works without a display)')
     parser.add_argument('-r', '--rate_limit', type=int, help='The rate limit for API requests (default 150/minute)', default=150)
     parser.add_argument('-o', '--output', type=str, help='Output file path for saving the results in JSON format')
-    parser.add_argument('-s', '--save_graph', type=str, help='Output file path for saving the graph in pickle format')
-    parser.add_argument('-l', '--load_graph', type=str, help='Input file path for loading a pickled graph')
-    args = parser.parse_args()
+    parser.add_argument('-s', '--save_graph', type=str, help='Output path for saving the graph as a memory-mappable snapshot directory (pickle if the path ends in .pkl)')
+    parser.add_argument('-l', '--load_graph', type=str, help='Input path for loading a graph snapshot or a pickled graph')
+    parser.add_argument('-c', '--cache', type=str, help='Path to the on-disk holdings cache (SQLite), only stale or missing ETFs are fetched')
+    parser.add_argument('--offline', action='store_true', help='Only use the holdings cache and never hit the API', default=False)
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached holdings and fetch every ETF again', default=False)
+    parser.add_argument('-a', '--async_fetch', action='store_true', help='Fetch holdings with the asyncio engine (pooled connections, token bucket, 429 retries)', default=False)
+    parser.add_argument('-e', '--ensemble', type=int, help='Detect communities with a consensus of N seeded Louvain and label propagation runs per method, in parallel', default=0)
+    parser.add_argument('-p', '--prev_communities', type=str, help='Update the communities saved by a previous run instead of detecting them from scratch')
+    parser.add_argument('--changed_etfs', type=str, help='Comma-separated ETFs whose holdings changed since --prev_communities was saved')
+    parser.add_argument('--save_communities', type=str, help='Output file path for saving the Louvain communities in JSON format')
+    parser.add_argument('-u', '--update', action='store_true', help='Apply the holdings of the stale ETFs in --cache to the graph loaded with --load_graph instead of rebuilding it', default=False)
+    parser.add_argument('-t', '--lookthrough', action='store_true', help='Also rank stocks by look-through weight, expanding ETFs held by other ETFs into their holdings', default=False)
+    parser.add_argument('--results_cache', type=str, help='Directory of the on-disk cache of analysis results, repeated analyses of the same graph are served from it')
+    parser.add_argument('--trace', type=str, help='Output file path for a Chrome trace (chrome://tracing, Perfetto) of the pipeline stages')
+    parser.add_argument('--trace_memory', action='store_true', help='Record the peak Python allocation of every stage with tracemalloc (slower)', default=False)
+    parser.add_argument('--history', type=str, help="Directory of the holdings history store to record today's graph in")
+    parser.add_argument('--seed', type=int, help='Pick the --num ETFs deterministically with this seed instead of at random')
+
+
+def save_graph(G, path):
+    """ Saves a graph as a snapshot directory, or pickles it as a NetworkX graph if the path ends in .pkl. """
+    print(f"[+] Saving graph to {path}")
+    if path.endswith(('.pkl', '.pickle')):
+        with open(path, 'wb') as f:
+            pickle.dump(G.to_networkx() if isinstance(G, graph.BipartiteGraph) else G, f)
+    else:
+        try:
+            graph.save_snapshot(G, path)
+        except ValueError as e:
+            print(f"[!] Failed to save the graph snapshot: {e}")
+            print("[!] Graphs pickled before holdings recorded their holder must be rebuilt from the holdings (e.g. `build -c <cache> --offline`), or saved as .pkl")
+
+
+def record_history(G, history_dir):
+    """ Records the graph under today's date in a holdings history store. """
+    try:
+        graph.HoldingsHistory(history_dir).add(date.today().isoformat(), G)
+        print(f"[+] Recorded holdings for {date.today().isoformat()} in {history_dir}")
+    except ValueError as e:
+        print(f"[!] Failed to record holdings history: {e}")
+
 
-    FMPKey = os.getenv("FMPKey")
-    if FMPKey is None:
+def load_graph(path):
+    """
+    load_graph loads a graph written by `build` or --save_graph.
+
+    Snapshots are memory-mapped into a BipartiteGraph without importing NetworkX, pickles are returned as the
+    NetworkX graph they hold. Every ranking accepts both.
+
+    Returns:
+        BipartiteGraph or nx.Graph: The graph, or None if it could not be loaded.
+    """
+    try:
+        with instrument.span('main.load_graph'):
+            if graph.is_snapshot(path):
+                return graph.load_snapshot(path)
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    except Exception as e:
+        print(f"Error loading the graph from file: {e}")
+        return None
+
+
+def check_fetch_arguments(args):
+    """ Returns False, after printing why, if the fetch options of the arguments cannot work together. """
+    if getattr(args, 'offline', False) and not args.cache:
+        print("--offline requires --cache. Exiting.")
+        return False
+    if getattr(args, 'update', False) and not args.load_graph:
+        print("--update requires --load_graph. Exiting.")
+        return False
+    if os.getenv("FMPKey") is None and not getattr(args, 'offline', False) and (not getattr(args, 'load_graph', None) or getattr(args, 'update', False)):
         print("FMPKey not found. Exiting.")
-        sys.exit(-1)
+        return False
+    return True
+
+
+def run_pipeline(args):
+    """ Runs the full pipeline of init_etfgraph, the legacy CLI and the `analyze` subcommand. """
+    if not check_fetch_arguments(args):
+        return -1
 
-    G = init_etfgraph(args.num, args.display, args.rate_limit, args.output, args.load_graph)
+    if args.trace_memory:
+        instrument.TRACER.start_memory_tracing()
+
+    G = init_etfgraph(args.num, args.display, args.rate_limit, args.output, args.load_graph, args.cache, args.offline, args.refresh, args.async_fetch, args.ensemble,
+                      args.prev_communities, args.changed_etfs.split(',') if args.changed_etfs else None, args.save_communities, args.update, args.lookthrough, args.results_cache, args.trace, args.plot_file, args.seed)
     print("[+] Analysis complete.")
     if args.save_graph and G is not None:
-        print(f"[+] Saving graph to {args.save_graph}")
-        with open(args.save_graph, 'wb') as f:
-            pickle.dump(G, f)
+        save_graph(G, args.save_graph)
+    if args.history and G is not None:
+        record_history(G, args.history)
+    return 0
+
+
+def run_fetch(args):
+    """ `fetch` pulls the stale or missing holdings into the holdings cache without building a graph. """
+    if not check_fetch_arguments(args):
+        return -1
+    cache = fmp.HoldingsCache(args.cache)
+    try:
+        stream = fmp.stream_etf_positions_async if args.async_fetch else fmp.stream_etf_positions
+        fetched = stream(args.num, os.getenv("FMPKey"), rate_limit=args.rate_limit, cache=cache, refresh_all=args.refresh, only_stale=True, seed=args.seed)
+        if fetched is None:
+            print("Failed to fetch the ETF list. Exiting.")
+            return -1
+        with instrument.span('main.fetch') as attrs:
+            attrs['etfs'] = sum(1 for _ in fetched)
+    finally:
+        cache.close()
+    print(f"[+] Fetched {attrs['etfs']} ETFs into {args.cache}")
+    return 0
+
+
+def run_build(args):
+    """ `build` writes a graph snapshot straight from the holdings stream, or updates a loaded one, without NetworkX. """
+    if not check_fetch_arguments(args):
+        return -1
+    cache = fmp.HoldingsCache(args.cache) if args.cache else None
+    try:
+        stream = fmp.stream_etf_positions_async if args.async_fetch else fmp.stream_etf_positions
+        fmp_details = stream(args.num, os.getenv("FMPKey"), rate_limit=args.rate_limit, cache=cache, offline=args.offline,
+                             refresh_all=args.refresh, only_stale=args.update, seed=args.seed)
+        if fmp_details is None:
+            print("Failed to create graph. Exiting.")
+            return -1
+        if args.update:
+            G = load_graph(args.load_graph)
+            if G is None:
+                return -1
+            G, changes = graph.update_graph(G, fmp_details)
+            print(f"[+] Updated {len(changes['etfs'])} ETFs: {len(changes['added_edges'])} holdings added, "
+                  f"{len(changes['removed_edges'])} removed, {len(changes['reweighted_edges'])} reweighted.")
+        else:
+            with instrument.span('graph.build'):
+                G = graph.BipartiteGraph.from_stream(fmp_details)
+    finally:
+        if cache is not None:
+            cache.close()
+    print(f"[+] Built graph of {G.num_etfs} ETFs and {G.num_stocks} stocks." if isinstance(G, graph.BipartiteGraph) else "[+] Built graph.")
+    save_graph(G, args.save_graph)
+    if args.history:
+        record_history(G, args.history)
+    return 0
+
+
+def run_communities(args):
+    """ `communities` detects the Louvain communities of a saved graph and optionally saves the partition. """
+    G = load_graph(args.load_graph)
+    if G is None:
+        return -1
+    etf_graph = G.to_networkx() if isinstance(G, graph.BipartiteGraph) else G
+    result_cache = graph.ResultCache(args.results_cache) if args.results_cache else None
+    def run(fn, target, *fn_args, **kwargs):
+        return result_cache.call(fn, target, *fn_args, **kwargs) if result_cache else fn(target, *fn_args, **kwargs)
+
+    results = {}
+    if args.prev_communities:
+        changed_etfs = args.changed_etfs.split(',') if args.changed_etfs else []
+        print(f"[+] Updating communities from {args.prev_communities} ({len(changed_etfs)} changed ETFs)...")
+        communities = graph.detect_communities_incremental(etf_graph, graph.load_partition(args.prev_communities), changed_etfs)
+    elif args.ensemble:
+        print(f"[+] Running community detection ensemble with {args.ensemble} runs per method...")
+        ensemble = run(graph.detect_communities_ensemble, etf_graph, runs=args.ensemble)
+        communities = ensemble['partition']
+        results['ensemble'] = {'consensus_modularity': ensemble['modularity'], 'run_modularities': ensemble['run_modularities']}
+    else:
+        communities = run(graph.detect_communities_louvain, etf_graph)
+    if args.save_communities:
+        graph.save_partition(communities, args.save_communities)
+        print(f"[+] Communities saved to {args.save_communities}")
+
+    results['modularity_score'] = run(graph.community_modularity, etf_graph, communities)
+    print(f"[+] Louvain Modularity Score: {results['modularity_score']}")
+    results['community_analysis'] = {}
+    for com, summary in graph.summarize_communities(G, communities, top_communities=args.top).items():
+        print(f"  Community {com} with {summary['size']} members")
+        for stock, weight in summary['top_stocks']:
+            print(f"    {stock}: {weight:.2f}")
+        results['community_analysis'][com] = summary['top_stocks']
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"[+] Results saved to {args.output}")
+    return 0
+
+
+RANKINGS = ('weight', 'inclusions', 'pagerank', 'lookthrough', 'degree', 'weighted_degree', 'closeness', 'eigenvector', 'betweenness')
+CENTRALITY_RANKINGS = ('degree', 'weighted_degree', 'closeness', 'eigenvector', 'betweenness')
+
+
+def run_rank(args):
+    """
+    `rank` ranks the stocks of a saved graph, with numpy and scipy only when the graph is a snapshot. The centrality
+    rankings are computed together in one pass of the centrality engine, with sampled closeness and betweenness.
+    """
+    rankings = args.by.split(',')
+    unknown = set(rankings) - set(RANKINGS)
+    if unknown:
+        print(f"Unknown rankings: {', '.join(sorted(unknown))}, expected {','.join(RANKINGS)}. Exiting.")
+        return -1
+    G = load_graph(args.load_graph)
+    if G is None:
+        return -1
+
+    results = {}
+    centrality = None
+    metrics = tuple(by for by in rankings if by in CENTRALITY_RANKINGS)
+    if metrics:
+        centrality = graph.centrality_rankings(G, metrics, k=args.top, samples=args.samples, workers=args.workers)
+        if 'samples' in centrality:
+            results['centrality_sampling'] = {'samples': centrality['samples'], 'error': centrality['error']}
+            if centrality['error']:
+                print(f"[+] Closeness and betweenness sampled from {centrality['samples']} pivots, error bound {centrality['error']:.4f}")
+
+    for by in rankings:
+        with instrument.span(f"graph.rank.{by}"):
+            if by in CENTRALITY_RANKINGS:
+                ranked = centrality[by]['top']
+            elif by == 'weight':
+                ranked = graph.stocks_with_most_weight(G)[:args.top]
+            elif by == 'inclusions':
+                ranked = graph.stocks_with_most_inclusions(G)[:args.top]
+            elif by == 'pagerank':
+                scores = graph.perform_pagerank(G)
+                ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:args.top]
+            else:
+                try:
+                    ranked = graph.stocks_with_most_exposure(G)[:args.top]
+                except ValueError as e:
+                    print(f"[!] Cannot rank by look-through weight: {e}")
+                    return -1
+        results[f"top_stocks_by_{by}"] = ranked
+        print(f"Top {args.top} stocks by {by}:")
+        for stock, value in ranked:
+            print(f"  {stock}: {value:.4f}" if isinstance(value, float) else f"  {stock}: {value}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+        print(f"[+] Results saved to {args.output}")
+    return 0
+
+
+def run_plot(args):
+    """ `plot` visualizes a saved graph, colored by saved communities or by freshly detected Louvain communities. """
+    G = load_graph(args.load_graph)
+    if G is None:
+        return -1
+    etf_graph = G.to_networkx() if isinstance(G, graph.BipartiteGraph) else G
+    communities = graph.load_partition(args.communities) if args.communities else graph.detect_communities_louvain(etf_graph)
+    with instrument.span('viz.plot'):
+        viz.plot_graph(etf_graph, communities, output_file=args.output, layout_cache=args.layout_cache, supernodes=args.supernodes)
+    if args.output:
+        print(f"[+] Graph visualization saved to {args.output}")
+    return 0
+
+
+def run_shard(args):
+    """ `shard` fetches one hash partition of the ETF universe into a checkpointed partial snapshot. """
+    if not check_fetch_arguments(args):
+        return -1
+    cache = fmp.HoldingsCache(args.cache) if args.cache else None
+    try:
+        snapshot_path = fmp.fetch_shard(args.shard, args.shards, os.getenv("FMPKey"), args.output_dir, args.num, args.rate_limit, cache,
+                                        args.offline, args.refresh, args.async_fetch, args.seed or 0, args.allow_failures)
+    finally:
+        if cache is not None:
+            cache.close()
+    return 0 if snapshot_path else -1
+
+
+def run_merge(args):
+    """ `merge` combines the partial snapshots of every shard into one graph snapshot. """
+    try:
+        G = fmp.merge_shards(args.output_dir, args.shards)
+    except ValueError as e:
+        print(f"[!] {e}")
+        return -1
+    print(f"[+] Merged graph of {G.num_etfs} ETFs and {G.num_stocks} stocks.")
+    save_graph(G, args.save_graph)
+    if args.history:
+        record_history(G, args.history)
+    return 0
+
+
+def add_fetch_arguments(parser, cache_required=False):
+    parser.add_argument('-n', '--num', type=int, help='The number of ETFs to fetch, if not provided all will be used', default=-1)
+    parser.add_argument('-r', '--rate_limit', type=int, help='The rate limit for API requests (default 150/minute)', default=150)
+    parser.add_argument('-c', '--cache', type=str, required=cache_required, help='Path to the on-disk holdings cache (SQLite), only stale or missing ETFs are fetched')
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached holdings and fetch every ETF again', default=False)
+    parser.add_argument('-a', '--async_fetch', action='store_true', help='Fetch holdings with the asyncio engine', default=False)
+    parser.add_argument('--seed', type=int, help='Pick the --num ETFs deterministically with this seed instead of at random')
+
+
+def subcommand_parser():
+    """ Returns the parser of the per-task subcommands, which share graph snapshots through the file system. """
+    parser = argparse.ArgumentParser(description="ETF Position Graph Analysis Tool")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    fetch_parser = subcommands.add_parser('fetch', help='Pull stale or missing holdings into the holdings cache')
+    add_fetch_arguments(fetch_parser, cache_required=True)
+    fetch_parser.set_defaults(run=run_fetch)
+
+    build_parser = subcommands.add_parser('build', help='Build a graph snapshot from the API or the holdings cache')
+    build_parser.add_argument('-s', '--save_graph', type=str, required=True, help='Output path of the snapshot directory (pickle if the path ends in .pkl)')
+    add_fetch_arguments(build_parser)
+    build_parser.add_argument('--offline', action='store_true', help='Only use the holdings cache and never hit the API', default=False)
+    build_parser.add_argument('-l', '--load_graph', type=str, help='The graph to update with --update')
+    build_parser.add_argument('-u', '--update', action='store_true', help='Apply the holdings of the stale ETFs in --cache to --load_graph instead of rebuilding it', default=False)
+    build_parser.add_argument('--history', type=str, help="Directory of the holdings history store to record today's graph in")
+    build_parser.set_defaults(run=run_build)
+
+    analyze_parser = subcommands.add_parser('analyze', help='Run the full analysis pipeline, the same options as without a subcommand')
+    add_pipeline_arguments(analyze_parser)
+    analyze_parser.set_defaults(run=run_pipeline)
+
+    communities_parser = subcommands.add_parser('communities', help='Detect the communities of a saved graph')
+    communities_parser.add_argument('-l', '--load_graph', type=str, required=True, help='The graph snapshot or pickled graph')
+    communities_parser.add_argument('-e', '--ensemble', type=int, help='Use the consensus of N seeded Louvain and label propagation runs per method', default=0)
+    communities_parser.add_argument('-p', '--prev_communities', type=str, help='Update the communities saved by a previous run instead of detecting them from scratch')
+    communities_parser.add_argument('--changed_etfs', type=str, help='Comma-separated ETFs whose holdings changed since --prev_communities was saved')
+    communities_parser.add_argument('--save_communities', type=str, help='Output file path for saving the communities in JSON format')
+    communities_parser.add_argument('-k', '--top', type=int, help='The number of largest communities to summarize (default 5)', default=5)
+    communities_parser.add_argument('-o', '--output', type=str, help='Output file path for saving the results in JSON format')
+    communities_parser.add_argument('--results_cache', type=str, help='Directory of the on-disk cache of analysis results')
+    communities_parser.set_defaults(run=run_communities)
+
+    rank_parser = subcommands.add_parser('rank', help='Rank the stocks of a saved graph')
+    rank_parser.add_argument('-l', '--load_graph', type=str, required=True, help='The graph snapshot or pickled graph')
+    rank_parser.add_argument('--by', type=str, help=f"Comma-separated rankings, out of {','.join(RANKINGS)} (default weight,inclusions,pagerank)", default='weight,inclusions,pagerank')
+    rank_parser.add_argument('-k', '--top', type=int, help='The number of stocks per ranking (default 10)', default=10)
+    rank_parser.add_argument('-o', '--output', type=str, help='Output file path for saving the rankings in JSON format')
+    rank_parser.add_argument('--samples', type=int, help='Pivots sampled for closeness and betweenness, by default enough for a 0.05 error bound')
+    rank_parser.add_argument('--workers', type=int, help='Worker processes for betweenness, defaults to the number of cores')
+    rank_parser.set_defaults(run=run_rank)
+
+    plot_parser = subcommands.add_parser('plot', help='Visualize a saved graph')
+    plot_parser.add_argument('-l', '--load_graph', type=str, required=True, help='The graph snapshot or pickled graph')
+    plot_parser.add_argument('--communities', type=str, help='Communities saved with --save_communities, detected with Louvain if not provided')
+    plot_parser.add_argument('-o', '--output', type=str, help='Render to an image file (e.g. graph.png) instead of a window, works without a display')
+    plot_parser.add_argument('--supernodes', dest='supernodes', action='store_true', help='Draw every community as a single node (default above 5000 nodes)')
+    plot_parser.add_argument('--no-supernodes', dest='supernodes', action='store_false', help='Draw every node, even above 5000 nodes')
+    plot_parser.add_argument('--layout_cache', type=str, help='Directory of the on-disk cache the layout is stored in, plotting the same graph again skips the layout')
+    plot_parser.set_defaults(run=run_plot, supernodes=None)
+
+    shard_parser = subcommands.add_parser('shard', help='Fetch one shard of the ETF universe, e.g. one per API key or machine')
+    shard_parser.add_argument('--shard', type=int, required=True, help='The shard of this worker, from 0 to --shards - 1')
+    shard_parser.add_argument('--shards', type=int, required=True, help='The number of shards')
+    shard_parser.add_argument('-d', '--output_dir', type=str, required=True, help='Directory of the shard checkpoints and partial snapshots, shared by every worker')
+    add_fetch_arguments(shard_parser)
+    shard_parser.add_argument('--offline', action='store_true', help='Only use the holdings cache and never hit the API', default=False)
+    shard_parser.add_argument('--allow_failures', action='store_true', help='Complete the shard even if some ETFs could not be fetched', default=False)
+    shard_parser.set_defaults(run=run_shard)
+
+    merge_parser = subcommands.add_parser('merge', help='Merge the partial snapshots of every shard into one graph')
+    merge_parser.add_argument('-d', '--output_dir', type=str, required=True, help='Directory the shard workers wrote to')
+    merge_parser.add_argument('-s', '--save_graph', type=str, required=True, help='Output path of the merged snapshot directory (pickle if the path ends in .pkl)')
+    merge_parser.add_argument('--shards', type=int, help='The number of shards, inferred from the partial snapshots if not provided')
+    merge_parser.add_argument('--history', type=str, help="Directory of the holdings history store to record today's graph in")
+    merge_parser.set_defaults(run=run_merge)
+    return parser
+
+
+SUBCOMMANDS = ('fetch', 'build', 'analyze', 'communities', 'rank', 'plot', 'shard', 'merge')
+
+if __name__ == '__main__':
+    load_dotenv()
+
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        args = subcommand_parser().parse_args()
+    else:
+        # Without a subcommand every stage runs in one process, as before the subcommands existed
+        parser = argparse.ArgumentParser(description="ETF Position Graph Analysis Tool",
+                                         epilog=f"Subcommands running a single stage: {', '.join(SUBCOMMANDS)} (see main.py <subcommand> -h)")
+        add_pipeline_arguments(parser)
+        args = parser.parse_args()
+        args.run = run_pipeline
 
-    sys.exit(0)
\ No newline at end of file
+    sys.exit(args.run(args))
\ No newline at end of file
@@ -1,2 +1,18 @@
 # the 'fmp' module is used to interact with the Financial Modeling Prep API to pull ETF positions and analyze them.
-from .pull_etfs import pull_etf_positions
\ No newline at end of file
+# Submodules are imported on first use, so reading the cache never imports requests or aiohttp.
+from ..lazy import lazy_exports
+
+# Maps every public name to the submodule defining it
+_EXPORTS = {
+    'pull_etf_positions': 'pull_etfs',
+    'stream_etf_positions': 'pull_etfs',
+    'HoldingsCache': 'cache',
+    'pull_etf_positions_async': 'async_pull',
+    'stream_etf_positions_async': 'async_pull',
+    'fetch_shard': 'shard',
+    'merge_shards': 'shard',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
\ No newline at end of file
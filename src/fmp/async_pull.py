@@ -0,0 +1,340 @@
+import asyncio
+import itertools
+import queue
+import random
+import sys
+import time
+from threading import Thread
+
+import aiohttp
+
+from ..instrument import count, observe
+from .pull_etfs import FMP_BASE_URL, RATE_LIMIT, TIMEOUT, etf_entry, iter_cached_etf_details, plan_etf_pull
+
+MAX_CONNECTIONS = 20  # Size of the keep-alive connection pool
+MAX_RETRIES = 5  # Attempts per ETF before it is reported as failed
+BACKOFF_BASE = 1.0  # Base delay in seconds for the exponential backoff
+BACKOFF_CAP = 60.0  # Upper bound in seconds for a single backoff delay
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    TokenBucket is an asyncio token bucket that refills continuously at a fixed rate.
+
+    The bucket starts with a single token and holds at most `burst` tokens, so requests are spread evenly over
+    the minute instead of being issued all at once. The refill rate adapts to the server: every HTTP 429 pauses
+    the bucket for the Retry-After delay and lowers the rate, and successful requests slowly restore it.
+
+    Args:
+        rate_limit (int): The maximum number of requests per minute.
+        burst (int): The maximum number of tokens that can accumulate while idle.
+    """
+
+    def __init__(self, rate_limit, burst=1):
+        self.max_rate = rate_limit / 60
+        self.rate = self.max_rate
+        self.burst = burst
+        self._tokens = 1.0
+        self._updated = None
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """ Waits until a token is available and takes it. """
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                self._refill(now)
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def throttle(self, delay):
+        """ Pauses the bucket for `delay` seconds and halves the refill rate after a 429 response. """
+        now = asyncio.get_running_loop().time()
+        self._paused_until = max(self._paused_until, now + delay)
+        self._tokens = 0.0
+        self._updated = now
+        self.rate = max(self.max_rate / 10, self.rate / 2)
+
+    def recover(self):
+        """ Gradually restores the refill rate after a successful request. """
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    backoff_delay returns a jittered exponential backoff delay, honoring the server's Retry-After if provided.
+
+    Args:
+        attempt (int): The number of attempts made so far, starting at 1.
+        retry_after (float, optional): The delay requested by the server in seconds.
+
+    Returns:
+        float: The number of seconds to wait before the next attempt.
+    """
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+    if retry_after is not None:
+        delay += retry_after
+    return delay
+
+
+def parse_retry_after(value):
+    """ Parses a Retry-After header given in seconds, returning None if it is absent or not numeric. """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+async def fetch_etf_holdings_async(session, bucket, etf, fmp_key, max_retries=MAX_RETRIES):
+    """
+    Fetches holdings for a specific ETF, retrying rate-limited and failed requests with jittered backoff.
+
+    Args:
+        session (aiohttp.ClientSession): The pooled HTTP session.
+        bucket (TokenBucket): The shared rate limiter.
+        etf (dict): The /etf/list item of the ETF.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        max_retries (int): The maximum number of attempts.
+
+    Returns:
+        tuple: The ETF symbol and its details, or None if every attempt failed.
+    """
+    symbol = etf['symbol']
+    url = f"{FMP_BASE_URL}/etf-holder/{symbol}"
+    for attempt in range(1, max_retries + 1):
+        await bucket.acquire()
+        retry_after = None
+        if attempt > 1:
+            count('fmp.retries')
+        count('fmp.requests')
+        start = time.perf_counter()
+        try:
+            async with session.get(url, params={'apikey': fmp_key}) as response:
+                if response.status == 200:
+                    holdings = await response.json(content_type=None)
+                    observe('fmp.latency', time.perf_counter() - start)
+                    bucket.recover()
+                    return symbol, etf_entry(etf, holdings)
+
+                text = await response.text()
+                observe('fmp.latency', time.perf_counter() - start)
+                count('fmp.errors')
+                if response.status not in RETRY_STATUSES:
+                    print(f"\n[!] Failed to get ETF positions for {symbol} - Status code: {response.status}, Response: {text}")
+                    return symbol, None
+                if response.status == 429:
+                    count('fmp.throttled')
+                    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                    bucket.throttle(retry_after if retry_after is not None else BACKOFF_BASE * 2 ** attempt)
+                error = f"status code {response.status}"
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            count('fmp.errors')
+            error = str(e) or type(e).__name__
+        except ValueError as e:
+            # A 200 with a body that is not JSON fails the ETF, as in the sync engine, instead of the whole pull
+            count('fmp.errors')
+            count('fmp.failed')
+            print(f"\n[!] Invalid ETF positions for {symbol}: {e}")
+            return symbol, None
+
+        if attempt < max_retries:
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+    count('fmp.failed')
+    print(f"\n[!] Request failed for {symbol} after {max_retries} attempts: {error}")
+    return symbol, None
+
+
+async def fetch_etf_details_async(etfs, fmp_key, rate_limit=RATE_LIMIT, cache=None, max_connections=MAX_CONNECTIONS, max_retries=MAX_RETRIES,
+                                  on_result=None):
+    """
+    fetch_etf_details_async fetches the holdings of the given ETFs over a single keep-alive connection pool.
+    The ETFs are queued and fetched by `max_connections` workers, so only as many requests exist at any time.
+    If `on_result` is provided each successful ETF is handed to it as soon as it arrives and is not kept.
+
+    Args:
+        etfs (list): Items of the /etf/list response to fetch.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute.
+        cache (HoldingsCache, optional): Cache that successful responses are written to.
+        max_connections (int): The maximum number of concurrent connections.
+        max_retries (int): The maximum number of attempts per ETF.
+        on_result (callable, optional): Called with the ETF symbol and its details for every successful request.
+
+    Returns:
+        dict: A dictionary with ETF symbols as keys and fetched data as values, empty when `on_result` is provided.
+    """
+    bucket = TokenBucket(rate_limit)
+    connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+
+    etf_details = {}
+    failed = []
+    total_etfs = len(etfs)
+    etfs_processed = 0
+
+    print(f"[+] Starting async ETF analysis at a rate of {rate_limit} requests per minute...")
+
+    pending = asyncio.Queue()
+    for etf in etfs:
+        pending.put_nowait(etf)
+
+    async def worker(session):
+        nonlocal etfs_processed
+        while not pending.empty():
+            etf_symbol, data = await fetch_etf_holdings_async(session, bucket, pending.get_nowait(), fmp_key, max_retries)
+            etfs_processed += 1
+            progress = (etfs_processed / total_etfs) * 100
+            sys.stdout.write(f"\r[?] Progress: {progress:.2f}% ({etfs_processed}/{total_etfs})")
+            sys.stdout.flush()
+            if data:
+                if cache is not None:
+                    cache.put_holdings(etf_symbol, data['holdings'])
+                if on_result is not None:
+                    on_result(etf_symbol, data)
+                else:
+                    etf_details[etf_symbol] = data
+            else:
+                failed.append(etf_symbol)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        workers = [asyncio.ensure_future(worker(session)) for _ in range(min(max_connections, total_etfs))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:  # A failed worker stops the others
+                task.cancel()
+
+    print(f"\n[+] Completed analysis for {etfs_processed} ETF{'s' if etfs_processed != 1 else ''}")
+    if failed:
+        print(f"[!] {len(failed)} ETF{'s' if len(failed) != 1 else ''} failed: {', '.join(sorted(failed))}")
+    return etf_details
+
+
+def iter_etf_details_async(etfs, fmp_key, rate_limit=RATE_LIMIT, cache=None, max_connections=MAX_CONNECTIONS, max_retries=MAX_RETRIES):
+    """
+    iter_etf_details_async runs the asyncio engine on a background thread and yields each ETF as its request completes,
+    so the caller can consume results on the main thread while requests are still in flight. Closing the generator
+    early, e.g. by breaking out of the loop, cancels the requests still pending so no more quota is spent.
+
+    Args:
+        etfs (list): Items of the /etf/list response to fetch.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute.
+        cache (HoldingsCache, optional): Cache that successful responses are written to.
+        max_connections (int): The maximum number of concurrent connections.
+        max_retries (int): The maximum number of attempts per ETF.
+
+    Yields:
+        tuple: The ETF symbol and its details, for every successful request.
+    """
+    if not etfs:
+        return
+
+    results = queue.Queue()
+    done = object()
+    errors = []
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(fetch_etf_details_async(
+        etfs, fmp_key, rate_limit, cache, max_connections, max_retries,
+        on_result=lambda symbol, data: results.put((symbol, data))
+    ))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            results.put(done)
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+    finally:
+        try:
+            loop.call_soon_threadsafe(task.cancel)
+        except RuntimeError:
+            pass  # The loop has already finished
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def stream_etf_positions_async(num, fmp_key, rate_limit=RATE_LIMIT, cache=None, offline=False, refresh_all=False,
+                               max_connections=MAX_CONNECTIONS, max_retries=MAX_RETRIES, only_stale=False, seed=None):
+    """
+    stream_etf_positions_async is the streaming form of pull_etf_positions_async, yielding each ETF as soon as it is available.
+
+    Args:
+        num (int): The number of ETFs to analyze, -1 indicates all available ETFs.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute. Default is 150.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Ignore cached entries and fetch every ETF again.
+        max_connections (int): The maximum number of concurrent connections.
+        max_retries (int): The maximum number of attempts per ETF.
+        only_stale (bool): Only yield the ETFs fetched from the API and skip the ones still fresh in the cache.
+        seed (int, optional): Pick the `num` ETFs deterministically with this seed instead of at random.
+
+    Returns:
+        iterator: An iterator of (ETF symbol, data) pairs, or None if an error occurs.
+    """
+    plan = plan_etf_pull(num, fmp_key, cache, offline, refresh_all, seed)
+    if plan is None:
+        return None
+    cached, pending = plan
+    fetched = iter_etf_details_async(pending, fmp_key, rate_limit, cache, max_connections, max_retries)
+    if only_stale:
+        return fetched
+    return itertools.chain(iter_cached_etf_details(cached, cache), fetched)
+
+
+def pull_etf_positions_async(num, fmp_key, rate_limit=RATE_LIMIT, cache=None, offline=False, refresh_all=False,
+                             max_connections=MAX_CONNECTIONS, max_retries=MAX_RETRIES):
+    """
+    Fetch ETF positions with the asyncio engine, a drop-in alternative to pull_etf_positions.
+
+    Requests share one keep-alive connection pool and a token bucket limiter, HTTP 429 responses honor Retry-After,
+    and failed ETFs are retried with jittered exponential backoff instead of being dropped.
+
+    Args:
+        num (int): The number of ETFs to analyze, -1 indicates all available ETFs.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute. Default is 150.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Ignore cached entries and fetch every ETF again.
+        max_connections (int): The maximum number of concurrent connections.
+        max_retries (int): The maximum number of attempts per ETF.
+
+    Returns:
+        dict: A dictionary with ETF symbols as keys and fetched data as values, or None if an error occurs.
+    """
+    stream = stream_etf_positions_async(num, fmp_key, rate_limit, cache, offline, refresh_all, max_connections, max_retries)
+    if stream is None:
+        return None
+    return dict(stream)
@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import time
+import zlib
+from threading import Lock
+
+HOLDINGS_TTL = 24 * 60 * 60  # Holdings change at most daily
+LIST_TTL = 7 * 24 * 60 * 60  # The ETF universe changes far less often than holdings
+
+ETF_LIST_KEY = "etf/list"
+
+
+def holdings_key(symbol):
+    """ Cache key for the /etf-holder/{symbol} response of an ETF. """
+    return f"etf-holder/{symbol}"
+
+
+class HoldingsCache:
+    """
+    HoldingsCache is an on-disk SQLite cache of Financial Modeling Prep responses.
+
+    Every entry stores the zlib-compressed JSON payload together with the time it was fetched and
+    the time it expires, so each entry carries its own TTL. Expired entries are kept around: they are
+    ignored by default but can still be served when running offline.
+
+    Args:
+        path (str): Path of the SQLite database file, created if it does not exist.
+        ttl (float): Default time-to-live in seconds for holdings entries.
+        list_ttl (float): Default time-to-live in seconds for the ETF list.
+    """
+
+    def __init__(self, path, ttl=HOLDINGS_TTL, list_ttl=LIST_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.list_ttl = list_ttl
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, fetched_at REAL NOT NULL, expires_at REAL NOT NULL, payload BLOB NOT NULL)"
+            )
+
+    def get(self, key, allow_stale=False):
+        """
+        Returns the cached payload for a key, or None if it is missing or expired.
+
+        Args:
+            key (str): The cache key.
+            allow_stale (bool): Return the payload even if the entry has expired.
+
+        Returns:
+            object: The decoded JSON payload, or None.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, payload FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        expires_at, payload = row
+        if not allow_stale and expires_at < time.time():
+            return None
+        return json.loads(zlib.decompress(payload))
+
+    def put(self, key, value, ttl=None):
+        """
+        Stores a payload under a key, replacing any existing entry.
+
+        Args:
+            key (str): The cache key.
+            value (object): A JSON-serializable payload.
+            ttl (float, optional): Time-to-live in seconds, defaults to the holdings TTL.
+        """
+        now = time.time()
+        ttl = self.ttl if ttl is None else ttl
+        payload = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, fetched_at, expires_at, payload) VALUES (?, ?, ?, ?)",
+                (key, now, now + ttl, payload),
+            )
+
+    def get_etf_list(self, allow_stale=False):
+        """ Returns the cached /etf/list response, or None. """
+        return self.get(ETF_LIST_KEY, allow_stale=allow_stale)
+
+    def put_etf_list(self, etf_list):
+        """ Stores the /etf/list response with the list TTL. """
+        self.put(ETF_LIST_KEY, etf_list, ttl=self.list_ttl)
+
+    def get_holdings(self, symbol, allow_stale=False):
+        """ Returns the cached holdings of an ETF, or None. """
+        return self.get(holdings_key(symbol), allow_stale=allow_stale)
+
+    def put_holdings(self, symbol, holdings):
+        """ Stores the holdings of an ETF with the holdings TTL. """
+        self.put(holdings_key(symbol), holdings)
+
+    def stale_symbols(self, symbols, allow_stale=False):
+        """
+        Returns the symbols whose holdings are missing from the cache or have expired.
+
+        Args:
+            symbols (iterable): ETF symbols to check.
+            allow_stale (bool): Treat expired entries as present and only report missing symbols.
+
+        Returns:
+            list: The symbols that need to be fetched again.
+        """
+        now = float('-inf') if allow_stale else time.time()
+        with self._lock:
+            fresh = {
+                key for key, in self._conn.execute(
+                    "SELECT key FROM entries WHERE key LIKE 'etf-holder/%' AND expires_at >= ?", (now,)
+                )
+            }
+        return [symbol for symbol in symbols if holdings_key(symbol) not in fresh]
+
+    def close(self):
+        """ Closes the underlying database connection. """
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
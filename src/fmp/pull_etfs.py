@@ -1,4 +1,4 @@
-import random
+import itertools
 import sys
 import os
 import time
@@ -7,11 +7,13 @@ from threading import Semaphore, Timer
 
 import requests
 
-from .utils import analyze_etf_attributes
+from ..instrument import count, observe, span
+from .utils import analyze_etf_attributes, select_etfs, shard_of
 
 RATE_LIMIT = 150  # Maximum requests per minute
 REQUEST_INTERVAL = 60 / RATE_LIMIT  # Interval between requests in seconds
 TIMEOUT = 10  # Timeout for HTTP requests in seconds
+FMP_BASE_URL = os.getenv("FMP_BASE_URL", "https://financialmodelingprep.com/api/v3")  # Overridable, e.g. for bench.server
 
 # Create a semaphore that will allow a maximum of RATE_LIMIT tokens per minute
 semaphore = Semaphore(RATE_LIMIT)
@@ -29,38 +31,210 @@ def fetch_etf_holdings(etf, fmp_key):
     """
     semaphore.acquire()  # Ensure we don't exceed the rate limit
 
-    holdings_url = f"https://financialmodelingprep.com/api/v3/etf-holder/{etf['symbol']}?apikey={fmp_key}"
+    holdings_url = f"{FMP_BASE_URL}/etf-holder/{etf['symbol']}?apikey={fmp_key}"
+    start = time.perf_counter()
     try:
+        count('fmp.requests')
         response = requests.get(holdings_url, timeout=TIMEOUT)
+        observe('fmp.latency', time.perf_counter() - start)
         if response.status_code == 200:
-            name = etf['name']
-            leveraged, inverse = analyze_etf_attributes(name)
-            return etf['symbol'], {
-                "leveraged": leveraged,
-                "inverse": inverse,
-                "holdings": response.json()
-            }
+            return etf['symbol'], etf_entry(etf, response.json())
 
+        count('fmp.errors')
         error_msg = f"[!] Failed to get ETF positions for {etf['symbol']} - Status code: {response.status_code}, Response: {response.text}"
         print(error_msg)
         return etf['symbol'], None
     except requests.RequestException as e:
+        count('fmp.errors')
         print(f"[!] Request failed for {etf['symbol']}: {e}")
         return etf['symbol'], None
 
-def pull_etf_positions(num, fmp_key, rate_limit=RATE_LIMIT):
+def etf_entry(etf, holdings):
+    """
+    etf_entry builds the per-ETF record used by the graph builders from an /etf/list item and its holdings.
+    """
+    leveraged, inverse = analyze_etf_attributes(etf['name'])
+    return {
+        "leveraged": leveraged,
+        "inverse": inverse,
+        "holdings": holdings
+    }
+
+def fetch_etf_list(fmp_key, cache=None, offline=False, refresh_all=False):
+    """
+    fetch_etf_list returns the /etf/list response, serving it from the cache when possible.
+
+    Args:
+        fmp_key (str): API key for Financial Modeling Prep API.
+        cache (HoldingsCache, optional): Cache to read from and write to.
+        offline (bool): Only use the cache, accepting expired entries.
+        refresh_all (bool): Ignore cached entries and fetch the list again.
+
+    Returns:
+        list: The ETF list, or None if it could not be retrieved.
+    """
+    if cache is not None and not refresh_all:
+        etf_list = cache.get_etf_list(allow_stale=offline)
+        if etf_list is not None:
+            print(f"[+] Loaded ETF list from cache ({len(etf_list)} ETFs)")
+            return etf_list
+
+    if offline:
+        print("[!] ETF list is not cached and offline mode is enabled")
+        return None
+
+    list_url = f"{FMP_BASE_URL}/etf/list?apikey={fmp_key}"
+    with span('fmp.etf_list'):
+        count('fmp.requests')
+        response = requests.get(list_url, timeout=TIMEOUT)
+    if response.status_code != 200:
+        print(f"[!] Failed to retrieve ETF list - Status code: {response.status_code}, Response: {response.text}")
+        return None
+
+    etf_list = response.json()
+    if cache is not None:
+        cache.put_etf_list(etf_list)
+    return etf_list
+
+def pull_etf_positions(num, fmp_key, rate_limit=RATE_LIMIT, cache=None, offline=False, refresh_all=False):
     """
     Fetch ETF positions using a fixed number of threads, displaying progress and adhering to rate limits.
     The function also ensures proper rate-limiting via a semaphore that gets released at a specified interval.
 
+    When a cache is provided only ETFs whose cached holdings are missing or expired are requested from the API,
+    and every fetched response is written back to the cache.
+
     Args:
         num (int): The number of ETFs to analyze, -1 indicates all available ETFs.
         fmp_key (str): API key for Financial Modeling Prep API.
         rate_limit (int): The maximum number of requests per minute. Default is 150.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Ignore cached entries and fetch every ETF again.
 
     Returns:
         dict: A dictionary with ETF symbols as keys and fetched data as values, or None if an error occurs.
     """
+    stream = stream_etf_positions(num, fmp_key, rate_limit, cache, offline, refresh_all)
+    if stream is None:
+        return None
+    return dict(stream)
+
+def stream_etf_positions(num, fmp_key, rate_limit=RATE_LIMIT, cache=None, offline=False, refresh_all=False, only_stale=False, seed=None):
+    """
+    stream_etf_positions is the streaming form of pull_etf_positions: it yields each ETF as soon as it is available
+    instead of collecting every response first, so the caller can build the graph while requests are in flight.
+
+    Args:
+        num (int): The number of ETFs to analyze, -1 indicates all available ETFs.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute. Default is 150.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Ignore cached entries and fetch every ETF again.
+        only_stale (bool): Only yield the ETFs fetched from the API and skip the ones still fresh in the cache, which
+            is what graph.update_graph needs to refresh an existing graph.
+        seed (int, optional): Pick the `num` ETFs deterministically with this seed instead of at random.
+
+    Returns:
+        iterator: An iterator of (ETF symbol, data) pairs, or None if an error occurs.
+    """
+    plan = plan_etf_pull(num, fmp_key, cache, offline, refresh_all, seed)
+    if plan is None:
+        return None
+    cached, pending = plan
+    fetched = iter_etf_details(pending, fmp_key, rate_limit, cache)
+    if only_stale:
+        return fetched
+    return itertools.chain(iter_cached_etf_details(cached, cache), fetched)
+
+def plan_etf_pull(num, fmp_key, cache=None, offline=False, refresh_all=False, seed=None, shard=None):
+    """
+    plan_etf_pull selects the ETFs to analyze and splits them into ETFs served from the cache and ETFs that must be fetched.
+
+    Args:
+        num (int): The number of ETFs to analyze, -1 indicates all available ETFs.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Ignore cached entries and fetch every ETF again.
+        seed (int, optional): Pick the `num` ETFs deterministically with this seed instead of at random.
+        shard (tuple, optional): The (index, count) of a shard: only the picked ETFs hashed to this shard are kept.
+
+    Returns:
+        tuple: Two lists of /etf/list items, the cached ETFs and the ETFs to fetch, or None if an error occurs.
+    """
+    if offline and cache is None:
+        print("[!] Offline mode requires a holdings cache")
+        return None
+
+    etf_list = fetch_etf_list(fmp_key, cache, offline, refresh_all)
+    if etf_list is None:
+        return None
+    etfs_to_analyze = select_etfs(etf_list, num, seed)
+    if shard is not None:
+        index, num_shards = shard
+        etfs_to_analyze = [etf for etf in etfs_to_analyze if shard_of(etf['symbol'], num_shards) == index]
+
+    if cache is None or refresh_all:
+        return [], etfs_to_analyze
+
+    missing = set(cache.stale_symbols([etf['symbol'] for etf in etfs_to_analyze], allow_stale=offline))
+    cached = [etf for etf in etfs_to_analyze if etf['symbol'] not in missing]
+    pending = [] if offline else [etf for etf in etfs_to_analyze if etf['symbol'] in missing]
+    count('fmp.cache_hits', len(cached))
+    count('fmp.cache_misses', len(missing))
+
+    print(f"[+] Loading {len(cached)} ETF{'s' if len(cached) != 1 else ''} from cache, {len(pending)} to fetch")
+    return cached, pending
+
+def iter_cached_etf_details(etfs, cache):
+    """
+    iter_cached_etf_details yields the cached details of the given ETFs one at a time.
+
+    Args:
+        etfs (list): Items of the /etf/list response that plan_etf_pull found in the cache.
+        cache (HoldingsCache): The holdings cache.
+
+    Yields:
+        tuple: The ETF symbol and its details.
+    """
+    for etf in etfs:
+        holdings = cache.get_holdings(etf['symbol'], allow_stale=True)
+        if holdings is not None:
+            yield etf['symbol'], etf_entry(etf, holdings)
+
+def fetch_etf_details(etfs, fmp_key, rate_limit=RATE_LIMIT, cache=None):
+    """
+    fetch_etf_details fetches the holdings of the given ETFs from the API on a thread pool.
+
+    Args:
+        etfs (list): Items of the /etf/list response to fetch.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute.
+        cache (HoldingsCache, optional): Cache that successful responses are written to.
+
+    Returns:
+        dict: A dictionary with ETF symbols as keys and fetched data as values.
+    """
+    return dict(iter_etf_details(etfs, fmp_key, rate_limit, cache))
+
+def iter_etf_details(etfs, fmp_key, rate_limit=RATE_LIMIT, cache=None):
+    """
+    iter_etf_details fetches the holdings of the given ETFs on a thread pool and yields each one as its request completes.
+
+    Args:
+        etfs (list): Items of the /etf/list response to fetch.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        rate_limit (int): The maximum number of requests per minute.
+        cache (HoldingsCache, optional): Cache that successful responses are written to.
+
+    Yields:
+        tuple: The ETF symbol and its details, for every successful request.
+    """
+    if not etfs:
+        return
+
     global exit_flag
     request_interval = 60 / rate_limit  # Recalculate the interval based on the provided rate limit
     exit_flag = False  # Reset the exit flag in case the function is called multiple times
@@ -68,34 +242,26 @@ def pull_etf_positions(num, fmp_key, rate_limit=RATE_LIMIT):
     timer.start()
 
     try:
-        list_url = f"https://financialmodelingprep.com/api/v3/etf/list?apikey={fmp_key}"
-        response = requests.get(list_url, timeout=TIMEOUT)
-        if response.status_code == 200:
-            etf_list = response.json()
-            etfs_to_analyze = random.sample(etf_list, num) if num != -1 else etf_list
-
-            etf_details = {}
-            total_etfs = len(etfs_to_analyze)
-            etfs_processed = 0
-
-            print(f"[+] Starting ETF analysis at a rate of {rate_limit} requests per minute...")
-
-            with ThreadPoolExecutor(max_workers=min(10, os.cpu_count() * 2)) as executor:
-                futures = {executor.submit(fetch_etf_holdings, etf, fmp_key): etf for etf in etfs_to_analyze}
-                for future in as_completed(futures):
-                    etf_symbol, data = future.result()
-                    etfs_processed += 1
-                    progress = (etfs_processed / total_etfs) * 100
-                    sys.stdout.write(f"\r[?] Progress: {progress:.2f}% ({etfs_processed}/{total_etfs})")
-                    sys.stdout.flush()
-                    if data:
-                        etf_details[etf_symbol] = data
-
-            print(f"\n[+] Completed analysis for {etfs_processed} ETF{'s' if etfs_processed != 1 else ''}")
-            return etf_details
-        else:
-            print(f"[!] Failed to retrieve ETF list - Status code: {response.status_code}, Response: {response.text}")
-            return None
+        total_etfs = len(etfs)
+        etfs_processed = 0
+
+        print(f"[+] Starting ETF analysis at a rate of {rate_limit} requests per minute...")
+
+        with ThreadPoolExecutor(max_workers=min(10, os.cpu_count() * 2)) as executor:
+            futures = {executor.submit(fetch_etf_holdings, etf, fmp_key): etf for etf in etfs}
+            for future in as_completed(futures):
+                etf_symbol, data = future.result()
+                del futures[future]  # Drop the reference so the raw response is freed once consumed
+                etfs_processed += 1
+                progress = (etfs_processed / total_etfs) * 100
+                sys.stdout.write(f"\r[?] Progress: {progress:.2f}% ({etfs_processed}/{total_etfs})")
+                sys.stdout.flush()
+                if data:
+                    if cache is not None:
+                        cache.put_holdings(etf_symbol, data['holdings'])
+                    yield etf_symbol, data
+
+        print(f"\n[+] Completed analysis for {etfs_processed} ETF{'s' if etfs_processed != 1 else ''}")
     finally:
         exit_flag = True  # Signal the timer to stop
         timer.cancel()
@@ -0,0 +1,164 @@
+import glob
+import itertools
+import json
+import os
+import re
+
+from ..graph.bipartite import BipartiteGraph
+from ..graph.snapshot import is_snapshot, load_snapshot, save_snapshot
+from ..instrument import count, span
+from .pull_etfs import RATE_LIMIT, iter_cached_etf_details, iter_etf_details, plan_etf_pull
+
+SHARD_NAME = "shard-{index:03d}-of-{num_shards:03d}"
+SHARD_PATTERN = re.compile(r"shard-(\d+)-of-(\d+)\.snap$")
+
+
+def shard_paths(output_dir, index, num_shards):
+    """ Returns the checkpoint file and the partial snapshot directory of a shard. """
+    name = SHARD_NAME.format(index=index, num_shards=num_shards)
+    return os.path.join(output_dir, f"{name}.jsonl"), os.path.join(output_dir, f"{name}.snap")
+
+
+def read_checkpoint(path):
+    """
+    read_checkpoint reads the ETFs a shard worker has already fetched.
+
+    A worker killed mid-write can leave a torn last line, which is cut off so the checkpoint can be appended to. A
+    line only counts once its newline was written, even if the record before it happens to parse.
+
+    Args:
+        path (str): The checkpoint file, one JSON record per fetched ETF.
+
+    Returns:
+        dict: The details of every checkpointed ETF by symbol, empty if the file does not exist.
+    """
+    details = {}
+    if not os.path.exists(path):
+        return details
+    with open(path, 'r+b') as f:
+        valid = 0
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            details[record['symbol']] = {key: record[key] for key in ('leveraged', 'inverse', 'holdings')}
+            valid += len(line)
+        f.truncate(valid)
+    return details
+
+
+def fetch_shard(index, num_shards, fmp_key, output_dir, num=-1, rate_limit=RATE_LIMIT, cache=None, offline=False,
+                refresh_all=False, async_fetch=False, seed=0, allow_failures=False):
+    """
+    fetch_shard fetches one shard of the ETF universe and writes it as a partial graph snapshot.
+
+    ETFs are assigned to shards by a stable hash of their symbol, so independent workers, each with their own API
+    key and rate limit, cover the universe exactly once without coordinating. Every fetched ETF is appended to the
+    shard's checkpoint file as it arrives. A worker that is restarted after a crash skips the checkpointed ETFs and
+    only fetches the rest. Once every ETF of the shard is fetched the checkpoint is turned into a partial snapshot,
+    which merge_shards combines with the others.
+
+    Args:
+        index (int): The shard of this worker, between 0 and num_shards - 1.
+        num_shards (int): The number of shards.
+        fmp_key (str): API key for Financial Modeling Prep API.
+        output_dir (str): The directory shared by the checkpoints and partial snapshots of every shard.
+        num (int): The number of ETFs of the whole universe, -1 for all of them. Every worker must use the same value.
+        rate_limit (int): The maximum number of requests per minute of this worker's key.
+        cache (HoldingsCache, optional): On-disk cache placed in front of the API.
+        offline (bool): Serve everything from the cache, including expired entries, and never hit the API.
+        refresh_all (bool): Discard the checkpoint and cached entries and fetch the whole shard again.
+        async_fetch (bool): Use the asyncio fetch engine instead of the thread pool.
+        seed (int): The seed of the deterministic pick of `num` ETFs. Every worker must use the same value.
+        allow_failures (bool): Write the partial snapshot even if some ETFs could not be fetched.
+
+    Returns:
+        str: The path of the partial snapshot, or None if the shard is incomplete and the worker should be rerun.
+    """
+    if not 0 <= index < num_shards:
+        raise ValueError(f"Shard {index} is out of range for {num_shards} shards")
+    os.makedirs(output_dir, exist_ok=True)
+    checkpoint_path, snapshot_path = shard_paths(output_dir, index, num_shards)
+    if refresh_all and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    elif is_snapshot(snapshot_path):
+        print(f"[+] Shard {index} of {num_shards} is already complete: {snapshot_path}")
+        return snapshot_path
+
+    plan = plan_etf_pull(num, fmp_key, cache, offline, refresh_all, seed=seed, shard=(index, num_shards))
+    if plan is None:
+        return None
+    cached, pending = plan
+    done = read_checkpoint(checkpoint_path)
+    if done:
+        print(f"[+] Resuming shard {index} of {num_shards} from {len(done)} checkpointed ETFs")
+        count('shard.resumed', len(done))
+    cached = [etf for etf in cached if etf['symbol'] not in done]
+    pending = [etf for etf in pending if etf['symbol'] not in done]
+
+    if async_fetch:
+        from .async_pull import iter_etf_details_async
+        fetched = iter_etf_details_async(pending, fmp_key, rate_limit, cache)
+    else:
+        fetched = iter_etf_details(pending, fmp_key, rate_limit, cache)
+
+    with span('fmp.shard') as attrs, open(checkpoint_path, 'a') as f:
+        for symbol, details in itertools.chain(iter_cached_etf_details(cached, cache), fetched):
+            # Only the fields the graph is built from are kept, which keeps the checkpoint compact
+            holdings = [{'asset': stock['asset'], 'weightPercentage': stock['weightPercentage']} for stock in details['holdings']]
+            record = {'symbol': symbol, 'leveraged': details['leveraged'], 'inverse': details['inverse'], 'holdings': holdings}
+            f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            f.flush()
+            done[symbol] = record
+        attrs.update(shard=index, etfs=len(done))
+
+    missing = sorted(etf['symbol'] for etf in cached + pending if etf['symbol'] not in done)
+    if missing and not allow_failures:
+        print(f"[!] Shard {index} of {num_shards} is missing {len(missing)} ETFs, rerun the worker to retry them")
+        return None
+
+    save_snapshot(BipartiteGraph.from_stream(done.items()), snapshot_path)
+    print(f"[+] Shard {index} of {num_shards} complete with {len(done)} ETFs: {snapshot_path}")
+    return snapshot_path
+
+
+def merge_shards(output_dir, num_shards=None):
+    """
+    merge_shards combines the partial snapshots of every shard into one graph.
+
+    The partial snapshots are memory-mapped and their arrays merged with BipartiteGraph.merge, so no holdings JSON is
+    parsed again.
+
+    Args:
+        output_dir (str): The directory the shard workers wrote to.
+        num_shards (int, optional): The number of shards, inferred from the snapshot names if not provided.
+
+    Returns:
+        BipartiteGraph: The merged graph.
+
+    Raises:
+        ValueError: If a shard is missing, or the snapshots come from runs with different numbers of shards.
+    """
+    found = {}
+    for path in glob.glob(os.path.join(output_dir, 'shard-*-of-*.snap')):
+        match = SHARD_PATTERN.search(path)
+        if match and is_snapshot(path):
+            found.setdefault(int(match.group(2)), {})[int(match.group(1))] = path
+    if num_shards is None:
+        if not found:
+            raise ValueError(f"No complete shards in {output_dir}")
+        if len(found) != 1:
+            raise ValueError(f"Expected the shards of a single run in {output_dir}, found runs with {', '.join(map(str, sorted(found)))} shards")
+        num_shards = next(iter(found))
+    shards = found.get(num_shards, {})
+    missing = [index for index in range(num_shards) if index not in shards]
+    if missing:
+        raise ValueError(f"Shards {', '.join(map(str, missing))} of {num_shards} are not complete in {output_dir}")
+
+    with span('fmp.merge_shards') as attrs:
+        G = BipartiteGraph.merge([load_snapshot(shards[index]) for index in range(num_shards)])
+        attrs.update(shards=num_shards, etfs=G.num_etfs, edges=G.num_edges)
+    return G
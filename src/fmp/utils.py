@@ -1,3 +1,5 @@
+import hashlib
+import random
 import re
 
 
@@ -32,4 +34,47 @@ def analyze_etf_attributes(etf_name):
     # Check if any inversed patterns match the ETF name
     is_inversed = any(re.search(pattern, etf_name_lower) for pattern in inversed_patterns)
 
-    return is_leveraged, is_inversed
\ No newline at end of file
+    return is_leveraged, is_inversed
+
+
+def symbol_hash(symbol, salt=''):
+    """
+    symbol_hash returns a stable 64-bit hash of a symbol.
+
+    Unlike hash(), the value is the same in every process and on every machine, so independent workers agree on it.
+
+    Args:
+        symbol (str): The ETF symbol.
+        salt (str): Varies the hash, e.g. to draw a different deterministic sample.
+
+    Returns:
+        int: The hash.
+    """
+    return int.from_bytes(hashlib.blake2b(f"{salt}{symbol}".encode(), digest_size=8).digest(), 'big')
+
+
+def shard_of(symbol, num_shards):
+    """ Returns the shard, between 0 and num_shards - 1, that a symbol is assigned to. """
+    return symbol_hash(symbol) % num_shards
+
+
+def select_etfs(etf_list, num, seed=None):
+    """
+    select_etfs picks `num` ETFs of the /etf/list response.
+
+    Without a seed the pick is random. With a seed it is the `num` ETFs of lowest seeded hash. That pick is the same
+    on every run and every machine, and it does not depend on the order of the list.
+
+    Args:
+        etf_list (list): The /etf/list response.
+        num (int): The number of ETFs, -1 for all of them.
+        seed (int, optional): The seed of a deterministic pick.
+
+    Returns:
+        list: The picked /etf/list items.
+    """
+    if num == -1:
+        return etf_list
+    if seed is None:
+        return random.sample(etf_list, num)
+    return sorted(etf_list, key=lambda etf: symbol_hash(etf['symbol'], f"{seed}:"))[:num]
@@ -1,11 +1,48 @@
 # the 'graph' module is used to analyze the ETF positions and create a graph of the ETFs and their positions.
-from .create import create_graph_from_fmp
-from .community import detect_communities_louvain
-from .community import detect_communities_overlapping
-from .community import community_modularity
-from .analysis import stocks_with_most_inclusions
-from .analysis import stocks_with_most_weight
-from .analysis import analyze_etf_types
-from .analysis import sentiment_analysis_by_etf_type
-from .influence import perform_pagerank
-from .influence import find_influential_stocks
\ No newline at end of file
+# Submodules are imported on first use, so stages that only need numpy never pay for networkx, cdlib or matplotlib.
+from ..lazy import lazy_exports
+
+# Maps every public name to the submodule defining it
+_EXPORTS = {
+    'create_graph_from_fmp': 'create',
+    'create_graph_from_stream': 'create',
+    'add_etf_to_graph': 'create',
+    'BipartiteGraph': 'bipartite',
+    'save_snapshot': 'snapshot',
+    'load_snapshot': 'snapshot',
+    'is_snapshot': 'snapshot',
+    'HoldingsHistory': 'history',
+    'update_graph': 'update',
+    'etf_overlap': 'overlap',
+    'stock_coholding': 'overlap',
+    'SimilarityIndex': 'overlap',
+    'detect_communities_louvain': 'community',
+    'detect_communities_overlapping': 'community',
+    'detect_communities_incremental': 'community',
+    'save_partition': 'community',
+    'load_partition': 'community',
+    'community_modularity': 'community',
+    'modularity': 'community',
+    'modularity_batch': 'community',
+    'summarize_communities': 'community',
+    'detect_communities_ensemble': 'ensemble',
+    'stocks_with_most_inclusions': 'analysis',
+    'stocks_with_most_weight': 'analysis',
+    'analyze_etf_types': 'analysis',
+    'sentiment_analysis_by_etf_type': 'analysis',
+    'LookThrough': 'lookthrough',
+    'stocks_with_most_exposure': 'lookthrough',
+    'propagate_shocks': 'scenario',
+    'iter_shock_impacts': 'scenario',
+    'graph_fingerprint': 'memo',
+    'ResultCache': 'memo',
+    'perform_pagerank': 'influence',
+    'personalized_pagerank': 'pagerank',
+    'find_influential_stocks': 'influence',
+    'stock_centrality': 'centrality',
+    'centrality_rankings': 'centrality',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
\ No newline at end of file
@@ -0,0 +1,309 @@
+from array import array
+from functools import cached_property
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+
+class BipartiteGraph:
+    """
+    BipartiteGraph is a compact, array-backed representation of the ETF–stock graph.
+
+    ETF and stock symbols are interned to integer IDs, holdings are stored in a CSR matrix with one row per ETF and
+    one column per stock, and the leveraged/inverse flags are boolean arrays indexed by ETF ID. ETFs and stocks live
+    in separate symbol tables, so an ETF held by another ETF appears in both.
+
+    Args:
+        etf_symbols (array-like): ETF symbols, the position of a symbol is its ETF ID.
+        stock_symbols (array-like): Stock symbols, the position of a symbol is its stock ID.
+        weights (scipy.sparse matrix): The ETFs × stocks matrix of holding weights.
+        leveraged (array-like): Boolean leveraged flag per ETF.
+        inverse (array-like): Boolean inverse flag per ETF.
+    """
+
+    def __init__(self, etf_symbols, stock_symbols, weights, leveraged, inverse):
+        self.etf_symbols = np.asarray(etf_symbols, dtype=str)
+        self.stock_symbols = np.asarray(stock_symbols, dtype=str)
+        self.weights = sparse.csr_matrix(weights, shape=(len(self.etf_symbols), len(self.stock_symbols)))
+        self.leveraged = np.asarray(leveraged, dtype=bool)
+        self.inverse = np.asarray(inverse, dtype=bool)
+
+    @cached_property
+    def etf_index(self):
+        """ dict: Maps each ETF symbol to its ETF ID. """
+        return {symbol: i for i, symbol in enumerate(self.etf_symbols.tolist())}
+
+    @cached_property
+    def stock_index(self):
+        """ dict: Maps each stock symbol to its stock ID. """
+        return {symbol: i for i, symbol in enumerate(self.stock_symbols.tolist())}
+
+    @cached_property
+    def weights_csc(self):
+        """ scipy.sparse.csc_matrix: The weight matrix in CSC layout for per-stock column access. """
+        return self.weights.tocsc()
+
+    @cached_property
+    def is_stock(self):
+        """ np.ndarray: Whether every held symbol is a stock, i.e. not itself an ETF of the graph, indexed by stock ID. """
+        return ~np.isin(self.stock_symbols, self.etf_symbols)
+
+    @property
+    def num_etfs(self):
+        return self.weights.shape[0]
+
+    @property
+    def num_stocks(self):
+        return self.weights.shape[1]
+
+    @property
+    def num_edges(self):
+        return self.weights.nnz
+
+    @cached_property
+    def num_nodes(self):
+        """ int: The number of distinct symbols, i.e. the node count of the equivalent NetworkX graph. """
+        return len(np.union1d(self.etf_symbols, self.stock_symbols))
+
+    def stock_weights(self):
+        """ np.ndarray: The total holding weight of every stock, indexed by stock ID. """
+        return np.bincount(self.weights.indices, weights=self.weights.data, minlength=self.num_stocks)
+
+    def stock_inclusions(self):
+        """ np.ndarray: The number of ETFs holding every stock, indexed by stock ID. """
+        return np.bincount(self.weights.indices, minlength=self.num_stocks)
+
+    def etf_holdings(self, etf_symbol):
+        """
+        Returns the holdings of an ETF.
+
+        Args:
+            etf_symbol (str): The symbol of the ETF.
+
+        Returns:
+            list: A list of tuples containing the stock symbol and its weight.
+        """
+        i = self.etf_index[etf_symbol]
+        start, end = self.weights.indptr[i], self.weights.indptr[i + 1]
+        stocks = self.stock_symbols[self.weights.indices[start:end]].tolist()
+        return list(zip(stocks, self.weights.data[start:end].tolist()))
+
+    def stock_holders(self, stock_symbol):
+        """
+        Returns the ETFs holding a stock.
+
+        Args:
+            stock_symbol (str): The symbol of the stock.
+
+        Returns:
+            list: A list of tuples containing the ETF symbol and the weight of the stock in it.
+        """
+        j = self.stock_index[stock_symbol]
+        csc = self.weights_csc
+        start, end = csc.indptr[j], csc.indptr[j + 1]
+        etfs = self.etf_symbols[csc.indices[start:end]].tolist()
+        return list(zip(etfs, csc.data[start:end].tolist()))
+
+    @classmethod
+    def from_stream(cls, etf_stream):
+        """
+        Builds the bipartite graph from a stream of ETFs without materializing a NetworkX graph.
+
+        Negative weights are normalized on insert and, as with create_graph_from_fmp, a stock listed twice in the
+        same ETF keeps its last weight.
+
+        Args:
+            etf_stream (iterable): An iterable of (ETF symbol, ETF details) pairs.
+
+        Returns:
+            BipartiteGraph: The bipartite graph.
+        """
+        etf_index, stock_index = {}, {}
+        leveraged, inverse = [], []
+        rows, cols, data = array('q'), array('q'), array('d')
+
+        for etf_symbol, etf_data in etf_stream:
+            if etf_symbol in etf_index:
+                continue
+            row = etf_index[etf_symbol] = len(etf_index)
+            leveraged.append(bool(etf_data['leveraged']))
+            inverse.append(bool(etf_data['inverse']))
+
+            holdings = {}
+            for stock in etf_data['holdings']:
+                col = stock_index.setdefault(stock['asset'], len(stock_index))
+                holdings[col] = abs(stock['weightPercentage'])
+            rows.extend([row] * len(holdings))
+            cols.extend(holdings.keys())
+            data.extend(holdings.values())
+
+        weights = sparse.coo_matrix(
+            (np.frombuffer(data, dtype=np.float64), (np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64))),
+            shape=(len(etf_index), len(stock_index)),
+        )
+        return cls(list(etf_index), list(stock_index), weights.tocsr(), leveraged, inverse)
+
+    @classmethod
+    def from_fmp(cls, fmp_details):
+        """ Builds the bipartite graph from the dictionary returned by fmp.pull_etf_positions. """
+        return cls.from_stream(fmp_details.items())
+
+    @classmethod
+    def from_networkx(cls, G, strict=False):
+        """
+        Converts a NetworkX graph built by create_graph_from_fmp into a bipartite graph.
+
+        Every edge runs from the ETF recorded as its 'holder' to the other endpoint. Graphs pickled before edges were
+        tagged with their holder fall back to the node types: an edge runs from its 'ETF' endpoint to its 'Stock'
+        endpoint, and edges whose endpoints have the same type are oriented from the first endpoint to the second.
+        The fallback is wrong for ETFs held by other ETFs, which keep the 'Stock' type of their first appearance.
+
+        Args:
+            G (nx.Graph): The ETF graph.
+            strict (bool): Raise instead of falling back to the node types for edges without a holder.
+
+        Returns:
+            BipartiteGraph: The bipartite graph.
+
+        Raises:
+            ValueError: If `strict` and an edge has no holder.
+        """
+        etf_index, stock_index = {}, {}
+        leveraged, inverse = [], []
+
+        def etf_id(node):
+            if node not in etf_index:
+                etf_index[node] = len(etf_index)
+                attrs = G.nodes[node]
+                leveraged.append(bool(attrs.get('leveraged', False)))
+                inverse.append(bool(attrs.get('inverse', False)))
+            return etf_index[node]
+
+        for node, node_type in G.nodes(data='type'):
+            if node_type == 'ETF':
+                etf_id(node)
+
+        rows, cols, data = array('q'), array('q'), array('d')
+        for u, v, edge in G.edges(data=True):
+            holder = edge.get('holder')
+            if holder is None:
+                if strict:
+                    raise ValueError(f"The holding {u}-{v} does not record its holder, rebuild the graph from the holdings")
+                if G.nodes[u].get('type') != 'ETF' and G.nodes[v].get('type') == 'ETF':
+                    u, v = v, u
+            elif holder == v:
+                u, v = v, u
+            weight = edge.get('weight', 0.0)
+            rows.append(etf_id(u))
+            cols.append(stock_index.setdefault(v, len(stock_index)))
+            data.append(weight)
+
+        weights = sparse.coo_matrix(
+            (np.frombuffer(data, dtype=np.float64), (np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64))),
+            shape=(len(etf_index), len(stock_index)),
+        )
+        return cls(list(etf_index), list(stock_index), weights.tocsr(), leveraged, inverse)
+
+    @classmethod
+    def merge(cls, graphs):
+        """
+        Merges bipartite graphs over disjoint sets of ETFs, e.g. the partial graphs of sharded fetch workers.
+
+        The stock symbol tables are unioned and every graph's columns are remapped into the union with one vectorized
+        lookup, then the CSR rows are stacked, so merging is linear in the number of holdings.
+
+        Args:
+            graphs (list): The BipartiteGraphs to merge.
+
+        Returns:
+            BipartiteGraph: The merged graph, with the ETFs in the order of the graphs.
+
+        Raises:
+            ValueError: If an ETF appears in more than one graph.
+        """
+        etf_symbols = np.concatenate([G.etf_symbols for G in graphs]) if graphs else np.array([], dtype=str)
+        if len(np.unique(etf_symbols)) != len(etf_symbols):
+            raise ValueError("Cannot merge graphs that share ETFs")
+        stock_symbols = np.unique(np.concatenate([G.stock_symbols for G in graphs])) if graphs else np.array([], dtype=str)
+
+        indptr, indices, data = [np.zeros(1, dtype=np.int64)], [], []
+        for G in graphs:
+            weights = G.weights
+            columns = np.searchsorted(stock_symbols, G.stock_symbols)
+            indptr.append(indptr[-1][-1] + np.asarray(weights.indptr[1:], dtype=np.int64))
+            indices.append(columns[weights.indices])
+            data.append(np.asarray(weights.data))
+        weights = sparse.csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0), np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64), np.concatenate(indptr)),
+            shape=(len(etf_symbols), len(stock_symbols)),
+        )
+        leveraged = np.concatenate([G.leveraged for G in graphs]) if graphs else np.zeros(0, dtype=bool)
+        inverse = np.concatenate([G.inverse for G in graphs]) if graphs else np.zeros(0, dtype=bool)
+        return cls(etf_symbols, stock_symbols, weights, leveraged, inverse)
+
+    def to_networkx(self):
+        """
+        Converts the bipartite graph into a NetworkX graph with the same node and edge attributes as create_graph_from_fmp.
+
+        Returns:
+            nx.Graph: The ETF graph.
+        """
+        import networkx as nx # type: ignore
+        G = nx.Graph()
+        for symbol, leveraged, inverse in zip(self.etf_symbols.tolist(), self.leveraged.tolist(), self.inverse.tolist()):
+            G.add_node(symbol, type='ETF', leveraged=leveraged, inverse=inverse)
+        G.add_nodes_from((symbol for symbol in self.stock_symbols.tolist() if symbol not in G), type='Stock')
+
+        coo = self.weights.tocoo()
+        etfs = self.etf_symbols[coo.row].tolist()
+        stocks = self.stock_symbols[coo.col].tolist()
+        G.add_edges_from((etf, stock, {'weight': weight, 'holder': etf}) for etf, stock, weight in zip(etfs, stocks, coo.data.tolist()))
+        return G
+
+
+def stock_nodes(G):
+    """
+    stock_nodes returns the stocks of the ETF graph: the held symbols that are not themselves ETFs of the graph.
+
+    The same rule applies to both graph types, so rankings do not depend on how the graph was loaded. NetworkX graphs
+    are converted with BipartiteGraph.from_networkx, as their node types keep an ETF first seen as a holding typed
+    'Stock'.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+
+    Returns:
+        np.ndarray: The stock symbols.
+    """
+    bipartite = G if isinstance(G, BipartiteGraph) else BipartiteGraph.from_networkx(G)
+    return bipartite.stock_symbols[bipartite.is_stock]
+
+
+def adjacency_matrix(G, weight='weight'):
+    """
+    adjacency_matrix returns the symmetric weighted adjacency matrix of the ETF graph.
+
+    For a BipartiteGraph the ETF and stock symbol tables are merged, so a symbol that is both an ETF and a holding
+    maps to a single node, exactly as in the NetworkX graph.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+        weight (str): The edge attribute holding the weight (NetworkX graphs only).
+
+    Returns:
+        tuple: The node labels as a numpy array and the adjacency matrix as a CSR matrix.
+    """
+    if isinstance(G, BipartiteGraph):
+        nodes = np.union1d(G.etf_symbols, G.stock_symbols)
+        etf_nodes = np.searchsorted(nodes, G.etf_symbols)
+        stock_nodes = np.searchsorted(nodes, G.stock_symbols)
+        coo = G.weights.tocoo()
+        A = sparse.coo_matrix((coo.data, (etf_nodes[coo.row], stock_nodes[coo.col])), shape=(len(nodes), len(nodes)))
+        return nodes, (A + A.T).tocsr()
+
+    import networkx as nx # type: ignore
+    nodes = list(G)
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=weight, format='csr')
+    labels = np.empty(len(nodes), dtype=object)
+    labels[:] = nodes
+    return labels, sparse.csr_matrix(A)
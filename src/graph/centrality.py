@@ -0,0 +1,222 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np # type: ignore
+from scipy.sparse import csgraph, linalg # type: ignore
+
+from ..instrument import count, traced
+from .bipartite import adjacency_matrix, stock_nodes
+
+METRICS = ('degree', 'weighted_degree', 'closeness', 'eigenvector', 'betweenness')
+SAMPLED_METRICS = ('closeness', 'betweenness')
+CLOSENESS_BLOCK = 64  # Pivots per shortest path block, bounds the memory of the distance matrix
+
+# The graph each worker process runs on, set once per worker by _init_worker
+_worker_graph = None
+
+def _init_worker(A):
+    global _worker_graph
+    import networkx as nx # type: ignore
+    _worker_graph = nx.from_scipy_sparse_array(A)
+
+def _betweenness_chunk(sources):
+    """ Returns the summed betweenness contribution of some source nodes to every node of the worker's graph. """
+    import networkx as nx # type: ignore
+    # Shortest paths count hops, the weights are holdings percentages and not distances
+    contributions = nx.betweenness_centrality_subset(_worker_graph, sources=sources, targets=list(_worker_graph), normalized=False, weight=None)
+    totals = np.zeros(_worker_graph.number_of_nodes())
+    totals[list(contributions)] = list(contributions.values())
+    return totals
+
+def pivot_samples(num_nodes, epsilon=0.05, delta=0.1):
+    """
+    pivot_samples returns the number of pivots for which every sampled betweenness score is within `epsilon` of the
+    exact normalized score with probability at least 1 - `delta`.
+
+    The contribution of a pivot to the normalized betweenness of a node lies in [0, 1], so by Hoeffding's inequality
+    and a union bound over the nodes, k pivots give an error of at most sqrt(ln(2n / delta) / 2k).
+
+    Args:
+        num_nodes (int): The number of nodes of the graph.
+        epsilon (float): The maximum absolute error of a normalized score.
+        delta (float): The probability that any score exceeds the error.
+
+    Returns:
+        int: The number of pivots, at most the number of nodes.
+    """
+    if num_nodes == 0:
+        return 0
+    return min(num_nodes, math.ceil(math.log(2 * num_nodes / delta) / (2 * epsilon ** 2)))
+
+def sampling_error(num_nodes, samples, delta=0.1):
+    """ Returns the Hoeffding error bound of scores sampled from `samples` pivots, 0 if every node is a pivot. """
+    if samples >= num_nodes:
+        return 0.0
+    return math.sqrt(math.log(2 * num_nodes / delta) / (2 * samples))
+
+def _stock_mask(G, nodes):
+    """ Returns a boolean mask of the stock nodes among the adjacency nodes of G. """
+    return np.isin(nodes, stock_nodes(G))
+
+def _eigenvector(A):
+    """ Returns the L2-normalized eigenvector of the largest eigenvalue of the symmetric matrix A. """
+    n = A.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    if n < 3:
+        _, vectors = np.linalg.eigh(A.toarray())
+        vector = vectors[:, -1]
+    else:
+        # Bipartite graphs have eigenvalues ±λ, a power iteration would oscillate between their eigenvectors
+        _, vectors = linalg.eigsh(A.astype(float), k=1, which='LA')
+        vector = vectors[:, 0]
+    vector = vector if vector.sum() >= 0 else -vector
+    vector = np.clip(vector, 0, None)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def _closeness(A, pivots):
+    """
+    Returns the closeness of every node, estimated from the hop distances to the pivots.
+
+    With every node as a pivot this is the exact closeness of networkx, which scales by the fraction of reachable
+    nodes on disconnected graphs (Wasserman and Faust).
+    """
+    n = A.shape[0]
+    reached = np.zeros(n)
+    distances = np.zeros(n)
+    for start in range(0, len(pivots), CLOSENESS_BLOCK):
+        block = csgraph.shortest_path(A, directed=False, unweighted=True, indices=pivots[start:start + CLOSENESS_BLOCK])
+        finite = np.isfinite(block) & (block > 0)
+        reached += finite.sum(axis=0)
+        distances += np.where(finite, block, 0).sum(axis=0)
+    closeness = np.zeros(n)
+    has_path = distances > 0
+    # The sums over the pivots estimate the sums over all nodes up to the factor n / k, which cancels in the ratio
+    closeness[has_path] = (reached[has_path] * n / len(pivots) / max(n - 1, 1)) * (reached[has_path] / distances[has_path])
+    return closeness
+
+def _betweenness(A, pivots, workers):
+    """ Returns the normalized betweenness of every node, estimated from the shortest paths starting at the pivots. """
+    n = A.shape[0]
+    if n < 3:
+        return np.zeros(n)
+    chunks = [chunk.tolist() for chunk in np.array_split(pivots, min(len(pivots), workers * 4)) if len(chunk)]
+    if workers == 1:
+        _init_worker(A)
+        totals = sum(_betweenness_chunk(chunk) for chunk in chunks)
+    else:
+        # The graph is sent to each worker once, when the worker starts, instead of with every chunk of pivots
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(A,)) as executor:
+            totals = sum(executor.map(_betweenness_chunk, chunks))
+    # A subset score counts every path once per source, i.e. half the dependency of the source on the node
+    return 2 * totals * (n / len(pivots)) / ((n - 1) * (n - 2))
+
+@traced('graph.centrality')
+def stock_centrality(G, metrics=METRICS, samples=None, epsilon=0.05, delta=0.1, workers=None, seed=0):
+    """
+    stock_centrality computes several centrality metrics of the stocks in one pass over the graph.
+
+    The degree, weighted degree and eigenvector centralities are exact sparse matrix computations. Closeness and
+    betweenness need the shortest paths from every node, which is out of reach on the full universe, so they are
+    estimated from the shortest paths starting at a uniform sample of pivot nodes (Brandes and Pich). The betweenness
+    work is split across a process pool by pivot. Paths are counted in hops, as the edge weights are holdings and
+    not distances. The scores are normalized as in networkx and are exact when the sample covers every node.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): A graph of stocks and ETFs.
+        metrics (tuple): The metrics to compute, out of METRICS.
+        samples (int, optional): The number of pivots, by default the number for which every sampled score is within
+            `epsilon` of the exact score with probability 1 - `delta` (see pivot_samples).
+        epsilon (float): The error bound used to choose the number of pivots.
+        delta (float): The failure probability used to choose the number of pivots.
+        workers (int, optional): The number of worker processes for betweenness, defaults to the number of cores.
+        seed (int): The seed of the pivot sample.
+
+    Returns:
+        dict: A dictionary with the stock symbols under 'stocks', a numpy array of scores per metric in the same
+            order, and the 'samples' used and the Hoeffding 'error' bound of the sampled metrics.
+    """
+    unknown = set(metrics) - set(METRICS)
+    if unknown:
+        raise ValueError(f"Unknown centrality metrics: {', '.join(sorted(unknown))}, expected {', '.join(METRICS)}")
+
+    nodes, A = adjacency_matrix(G)
+    A = abs(A).tocsr()
+    n = len(nodes)
+    # Stocks in symbol order, so ties rank the same whichever graph type the scores were computed on
+    stocks = np.flatnonzero(_stock_mask(G, nodes))
+    stocks = stocks[np.argsort(nodes[stocks].astype(str), kind='stable')]
+    result = {'stocks': nodes[stocks]}
+
+    if 'degree' in metrics:
+        result['degree'] = np.diff(A.indptr)[stocks] / max(n - 1, 1)
+    if 'weighted_degree' in metrics:
+        result['weighted_degree'] = np.asarray(A.sum(axis=1)).ravel()[stocks]
+    if 'eigenvector' in metrics:
+        result['eigenvector'] = _eigenvector(A)[stocks]
+
+    if any(metric in metrics for metric in SAMPLED_METRICS):
+        samples = min(samples or pivot_samples(n, epsilon, delta), n)
+        pivots = np.arange(n) if samples >= n else np.sort(np.random.default_rng(seed).choice(n, samples, replace=False))
+        count('centrality.pivots', len(pivots))
+        if 'closeness' in metrics:
+            result['closeness'] = _closeness(A, pivots)[stocks]
+        if 'betweenness' in metrics:
+            workers = min(workers or os.cpu_count() or 1, len(pivots))
+            result['betweenness'] = _betweenness(A, pivots, workers)[stocks]
+        result['samples'] = len(pivots)
+        result['error'] = sampling_error(n, len(pivots), delta)
+    return result
+
+def select_stocks(symbols, scores, k=10):
+    """
+    select_stocks selects the k highest and the k lowest scoring stocks without sorting every score.
+
+    Ties are broken as a stable sort from the highest score would break them, so the selection is deterministic.
+
+    Args:
+        symbols (np.ndarray): The stock symbols.
+        scores (np.ndarray): The score of every stock.
+        k (int): The number of stocks to select at each end.
+
+    Returns:
+        tuple: The top k and the bottom k (symbol, score) pairs, both from the highest to the lowest score.
+    """
+    n = len(scores)
+    if k >= n:
+        order = np.argsort(-scores, kind='stable')
+        top, bottom = order[:k], order[-k:] if k else order[:0]
+    else:
+        top_threshold = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= top_threshold)
+        top = candidates[np.argsort(-scores[candidates], kind='stable')][:k]
+        bottom_threshold = np.partition(scores, k - 1)[k - 1] if k else -np.inf
+        candidates = np.flatnonzero(scores <= bottom_threshold)
+        bottom = candidates[np.argsort(-scores[candidates], kind='stable')][-k:] if k else candidates[:0]
+    return list(zip(symbols[top].tolist(), scores[top].tolist())), list(zip(symbols[bottom].tolist(), scores[bottom].tolist()))
+
+def centrality_rankings(G, metrics=METRICS, k=10, **kwargs):
+    """
+    centrality_rankings ranks the stocks by several centrality metrics at once.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): A graph of stocks and ETFs.
+        metrics (tuple): The metrics to rank by, out of METRICS.
+        k (int): The number of most and least central stocks per metric.
+        **kwargs: Options passed to stock_centrality, e.g. samples and workers.
+
+    Returns:
+        dict: A dictionary mapping every metric to its 'top' and 'bottom' k (stock, score) pairs, plus the 'samples'
+            and 'error' of the sampled metrics when any was computed.
+    """
+    centrality = stock_centrality(G, metrics, **kwargs)
+    rankings = {}
+    for metric in metrics:
+        top, bottom = select_stocks(centrality['stocks'], centrality[metric], k)
+        rankings[metric] = {'top': top, 'bottom': bottom}
+    if 'samples' in centrality:
+        rankings['samples'] = centrality['samples']
+        rankings['error'] = centrality['error']
+    return rankings
@@ -1,6 +1,16 @@
+import heapq
+import json
+from collections import Counter, defaultdict
+from operator import itemgetter
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
 import community as community_louvain
-from cdlib import algorithms, evaluation, NodeClustering
 
+from ..instrument import traced
+from .bipartite import BipartiteGraph, adjacency_matrix, stock_nodes
+
+@traced('graph.louvain')
 def detect_communities_louvain(G):
     """
     detect_communities_louvain detects communities in a graph using the Louvain method.
@@ -16,6 +26,92 @@ def detect_communities_louvain(G):
     # Returning the partition dictionary, where keys are node names and values are their community
     return partition
 
+@traced('graph.louvain_incremental')
+def detect_communities_incremental(G, previous_partition, changed_etfs=(), seed=None):
+    """
+    detect_communities_incremental updates a previous Louvain partition after the graph changed, instead of starting
+    from scratch.
+
+    Only the neighbourhoods of the change are re-optimized node by node: the nodes of changed ETFs, their holdings and
+    nodes that are new to the graph. Every other node is frozen with the unaffected members of its previous community
+    into a single node of an aggregated graph, exactly as Louvain aggregates communities between its levels, so the
+    node-level moves only sweep the affected nodes. Louvain then runs on the aggregated graph, where affected nodes
+    can join a frozen community and communities can still merge. Community ids are then matched to the previous ones
+    so that they stay stable from one run to the next.
+
+    Args:
+        G (nx.Graph): The graph to analyze.
+        previous_partition (dict): The partition from the previous run, e.g. loaded with load_partition.
+        changed_etfs (iterable): The ETFs whose holdings changed since the previous run.
+        seed (int, optional): Random seed for the Louvain method.
+
+    Returns:
+        dict: A dictionary where keys are node names and values are their community.
+    """
+    import networkx as nx # type: ignore
+    affected = set()
+    for etf in changed_etfs:
+        if etf in G:
+            affected.add(etf)
+            affected.update(G[etf])
+
+    # Every affected node is its own group, the unaffected members of each previous community share one
+    nodes, A = adjacency_matrix(G)
+    groups, membership = {}, np.empty(len(nodes), dtype=np.int64)
+    for i, node in enumerate(nodes.tolist()):
+        key = ('node', node) if node in affected or node not in previous_partition else ('community', previous_partition[node])
+        membership[i] = groups.setdefault(key, len(groups))
+    C = sparse.csr_matrix((np.ones(len(nodes)), (np.arange(len(nodes)), membership)), shape=(len(nodes), len(groups)))
+    M = sparse.triu(C.T @ A @ C).tocoo()
+
+    # The same aggregated graph as community.induced_graph, internal weights become self-loops
+    H = nx.Graph()
+    H.add_nodes_from(range(len(groups)))
+    H.add_weighted_edges_from(
+        (i, j, w / 2 if i == j else w) for i, j, w in zip(M.row.tolist(), M.col.tolist(), M.data.tolist())
+    )
+    aggregated = community_louvain.best_partition(H, random_state=seed)
+    partition = {node: aggregated[group] for node, group in zip(nodes.tolist(), membership.tolist())}
+    return stabilize_labels(partition, previous_partition)
+
+def stabilize_labels(partition, previous_partition):
+    """
+    stabilize_labels renames the communities of a partition after the previous partition's communities they overlap
+    the most, so that community ids do not change between runs. Communities without a counterpart get new ids.
+
+    Args:
+        partition (dict): The new partition.
+        previous_partition (dict): The partition whose ids should be kept.
+
+    Returns:
+        dict: The new partition with stable community ids.
+    """
+    overlaps = Counter(
+        (community_id, previous_partition[node]) for node, community_id in partition.items() if node in previous_partition
+    )
+    mapping, used = {}, set()
+    for (community_id, previous_id), _ in sorted(overlaps.items(), key=lambda item: item[1], reverse=True):
+        if community_id not in mapping and previous_id not in used:
+            mapping[community_id] = previous_id
+            used.add(previous_id)
+
+    next_id = max(previous_partition.values(), default=-1) + 1
+    for community_id in sorted(set(partition.values()) - set(mapping)):
+        mapping[community_id] = next_id
+        next_id += 1
+    return {node: mapping[community_id] for node, community_id in partition.items()}
+
+def save_partition(partition, path):
+    """ Saves a partition to a JSON file so the next run can start from it. """
+    with open(path, 'w') as f:
+        json.dump(partition, f)
+
+def load_partition(path):
+    """ Loads a partition saved with save_partition. """
+    with open(path, 'r') as f:
+        return json.load(f)
+
+@traced('graph.label_propagation')
 def detect_communities_overlapping(G):
     """
     detect_communities_overlapping detects overlapping communities in a graph using the Label Propagation method.
@@ -26,29 +122,208 @@ def detect_communities_overlapping(G):
     Returns:
         NodeClustering: A NodeClustering object containing the detected communities.
     """
+    from cdlib import algorithms  # cdlib takes seconds to import, so only load it when needed
     communities = algorithms.label_propagation(G)
     return communities
 
-def community_modularity(G, communities):
+def community_modularity(G, communities, weight='weight'):
     """
     Calculate the modularity score of the communities.
 
     Args:
-        G (nx.Graph): The graph to analyze.
+        G (nx.Graph or BipartiteGraph): The graph to analyze.
         communities (dict or NodeClustering): Community data.
+        weight (str): The edge attribute used as weight, None for the unweighted score.
+
+    Returns:
+        float: The modularity score.
+    """
+    return modularity(G, communities, weight=weight)
+
+def partition_labels(nodes, partition):
+    """
+    partition_labels converts a partition into an array of integer community labels aligned with `nodes`.
+
+    Args:
+        nodes (np.ndarray): The node order, as returned by adjacency_matrix.
+        partition (dict or np.ndarray): A dictionary mapping nodes to communities, or an already aligned label array.
+            Nodes missing from the dictionary are placed in singleton communities.
+
+    Returns:
+        np.ndarray: The community label of every node.
+    """
+    if isinstance(partition, np.ndarray):
+        return partition
+    codes = {}
+    return np.fromiter(
+        (codes.setdefault(partition.get(node, (None, node)), len(codes)) for node in nodes.tolist()),
+        dtype=np.int64, count=len(nodes),
+    )
+
+def cover_membership(nodes, cover):
+    """
+    cover_membership converts an overlapping cover into a fractional membership matrix: a node that belongs to
+    k communities belongs to each of them with coefficient 1/k.
+
+    Args:
+        nodes (np.ndarray): The node order, as returned by adjacency_matrix.
+        cover (NodeClustering or list): The overlapping communities.
+
+    Returns:
+        scipy.sparse.csr_matrix: The nodes × communities membership matrix.
+    """
+    index = {node: i for i, node in enumerate(nodes.tolist())}
+    rows, cols = [], []
+    for community_id, members in enumerate(getattr(cover, 'communities', cover)):
+        for node in members:
+            if node in index:
+                rows.append(index[node])
+                cols.append(community_id)
+    num_communities = len(getattr(cover, 'communities', cover))
+    S = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(nodes), num_communities))
+    counts = np.asarray(S.sum(axis=1)).ravel()
+    return sparse.diags(np.divide(1.0, counts, out=np.zeros(len(nodes)), where=counts > 0)) @ S
+
+def _adjacency(G, weight):
+    nodes, A = adjacency_matrix(G, weight=weight or 'weight')
+    if weight is None:
+        A = A.copy()
+        A.data[:] = 1.0
+    return nodes, A
+
+@traced('graph.modularity')
+def modularity(G, communities, weight='weight', resolution=1.0):
+    """
+    modularity computes the weighted Newman modularity of a partition or an overlapping cover directly from the sparse
+    adjacency matrix, without converting it to a NodeClustering.
+
+    For an overlapping cover each node contributes to its communities through fractional membership coefficients, so
+    Q = (tr(SᵀAS) - γ‖Sᵀk‖² / 2m) / 2m, which reduces to the usual definition for a crisp partition.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph to analyze.
+        communities (dict, np.ndarray, NodeClustering or list): A partition mapping nodes to communities, a label array
+            aligned with adjacency_matrix's node order, or an overlapping cover.
+        weight (str): The edge attribute used as weight, None for the unweighted score.
+        resolution (float): The resolution parameter γ.
 
     Returns:
         float: The modularity score.
     """
-    # If communities is a dictionary, convert it to NodeClustering format
+    if isinstance(communities, (dict, np.ndarray)):
+        return float(modularity_batch(G, [communities], weight=weight, resolution=resolution)[0])
+
+    nodes, A = _adjacency(G, weight)
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    total = degrees.sum()
+    if total == 0:
+        return 0.0
+    S = cover_membership(nodes, communities)
+    internal = (A @ S).multiply(S).sum()
+    expected = np.square(S.T @ degrees).sum() / total
+    return float((internal - resolution * expected) / total)
+
+@traced('graph.modularity_batch')
+def modularity_batch(G, partitions, weight='weight', resolution=1.0):
+    """
+    modularity_batch scores many candidate partitions of the same graph in one vectorized pass over its edges,
+    which is how partition ensembles are compared.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph to analyze.
+        partitions (list or np.ndarray): A list of partitions (dictionaries or aligned label arrays), or an
+            (n_nodes, n_partitions) label matrix aligned with adjacency_matrix's node order.
+        weight (str): The edge attribute used as weight, None for the unweighted score.
+        resolution (float): The resolution parameter γ.
+
+    Returns:
+        np.ndarray: The modularity score of every partition.
+    """
+    nodes, A = _adjacency(G, weight)
+    if isinstance(partitions, np.ndarray) and partitions.ndim == 2:
+        labels = partitions
+    else:
+        labels = np.column_stack([partition_labels(nodes, partition) for partition in partitions]) \
+            if len(partitions) else np.zeros((len(nodes), 0), dtype=np.int64)
+
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    total = degrees.sum()
+    if total == 0:
+        return np.zeros(labels.shape[1])
+
+    coo = A.tocoo()
+    internal = (labels[coo.row] == labels[coo.col]).T @ coo.data
+    expected = np.array([
+        np.square(np.bincount(column, weights=degrees)).sum() for column in (labels - labels.min(axis=0)).T
+    ]) / total
+    return (internal - resolution * expected) / total
+
+def stock_weights(G):
+    """
+    stock_weights returns the total weight of the connections of every stock, computed in a single pass over the nodes.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph to analyze.
+
+    Returns:
+        dict: A dictionary with stock names as keys and their total connection weight as values.
+    """
+    if isinstance(G, BipartiteGraph):
+        return dict(zip(G.stock_symbols[G.is_stock].tolist(), G.stock_weights()[G.is_stock].tolist()))
+
+    stocks = set(stock_nodes(G).tolist())
+    return {node: weight for node, weight in G.degree(weight='weight') if node in stocks}
+
+def community_members(communities):
+    """
+    community_members groups the nodes of a partition or cover by community.
+
+    Args:
+        communities (dict or NodeClustering): A Louvain partition mapping nodes to communities, or a NodeClustering
+            (or any list of node lists) whose communities are identified by their position.
+
+    Returns:
+        dict: A dictionary with community ids as keys and lists of member nodes as values.
+    """
     if isinstance(communities, dict):
-        # Create a list of communities from the dictionary
-        community_list = {}
+        members = defaultdict(list)
         for node, community_id in communities.items():
-            if community_id not in community_list:
-                community_list[community_id] = []
-            community_list[community_id].append(node)
-        communities = NodeClustering(list(community_list.values()), G, "Louvain")
+            members[community_id].append(node)
+        return dict(members)
+
+    return dict(enumerate(getattr(communities, 'communities', communities)))
+
+def summarize_communities(G, communities, top_communities=None, top_stocks=10):
+    """
+    summarize_communities computes the size, total stock weight and heaviest stocks of each community.
+
+    Stock weights are computed once for the whole graph and the members of every community are grouped in a single
+    pass over the partition, so the cost is linear in the graph size regardless of the number of communities.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph to analyze.
+        communities (dict or NodeClustering): A Louvain partition or an overlapping cover.
+        top_communities (int, optional): Only summarize the largest communities, all of them if not provided.
+        top_stocks (int): The number of heaviest stocks to report per community.
+
+    Returns:
+        dict: A dictionary, ordered from the largest community to the smallest, with community ids as keys and
+            dictionaries with 'size', 'stock_weight' and 'top_stocks' keys as values.
+    """
+    weights = stock_weights(G)
+    members = community_members(communities)
+
+    if top_communities is None:
+        largest = sorted(members.items(), key=lambda item: len(item[1]), reverse=True)
+    else:
+        largest = heapq.nlargest(top_communities, members.items(), key=lambda item: len(item[1]))
 
-    # Calculate modularity
-    return evaluation.newman_girvan_modularity(G, communities).score
\ No newline at end of file
+    summary = {}
+    for community_id, nodes in largest:
+        community_weights = [(node, weights[node]) for node in nodes if node in weights]
+        summary[community_id] = {
+            'size': len(nodes),
+            'stock_weight': sum(weight for _, weight in community_weights),
+            'top_stocks': heapq.nlargest(top_stocks, community_weights, key=itemgetter(1)),
+        }
+    return summary
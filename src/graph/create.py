@@ -1,50 +1,85 @@
 import networkx as nx # type: ignore
 
-def create_graph_from_fmp(fmp_details):
+from ..instrument import span
+
+def add_etf_to_graph(G, etf_symbol, etf_data):
     """
-    create_graph_from_fmp creates a graph from the ETF positions returned by the Financial Modeling Prep API.
+    add_etf_to_graph adds an ETF and its holdings to the graph, normalizing negative weights as edges are inserted.
+
+    Only the asset symbol and weight of each holding are kept, so the raw API response can be discarded afterwards.
 
     Args:
-        fmp_details (dict): A dictionary containing the ETF positions as returned by the API.
+        G (nx.Graph): The graph to add the ETF to.
+        etf_symbol (str): The symbol of the ETF.
+        etf_data (dict): The ETF details with 'leveraged', 'inverse' and 'holdings' keys.
 
     Returns:
-        nx.Graph: A NetworkX graph representing the ETFs and their positions.
+        nx.Graph: The updated graph.
     """
+    # Add ETF node if it's not already added
+    if not G.has_node(etf_symbol):
+        G.add_node(etf_symbol, type='ETF', leveraged=etf_data['leveraged'], inverse=etf_data['inverse'])
+    else:
+        # An ETF that first appeared as a holding keeps its 'Stock' type, but still gets its flags
+        G.nodes[etf_symbol].setdefault('leveraged', etf_data['leveraged'])
+        G.nodes[etf_symbol].setdefault('inverse', etf_data['inverse'])
 
-    if fmp_details is None:
-        print("[!] Failed to create graph from FMP details: No details provided")
-        return None
+    # Loop through each stock in the holdings
+    for stock in etf_data['holdings']:
+        stock_symbol = stock['asset']
+        weight = stock['weightPercentage']
 
-    G = nx.Graph()
+        # remove negative weights
+        if weight < 0:
+            print(f"Negative weight found: {etf_symbol}-{stock_symbol} with weight {weight}")
+            weight = abs(weight)  # or set it to a default positive value
 
-    # Loop through each ETF and their details
-    for etf_symbol, etf_data in fmp_details.items():
-        # Extract ETF symbol and its holdings
-        leveraged = etf_data['leveraged']
-        inverse = etf_data['inverse']
-        holdings = etf_data['holdings']
+        # Add stock node if it's not already added
+        if not G.has_node(stock_symbol):
+            G.add_node(stock_symbol, type='Stock')
 
-        # Add ETF node if it's not already added
-        if not G.has_node(etf_symbol):
-            G.add_node(etf_symbol, type='ETF', leveraged=leveraged, inverse=inverse)
+        # Add an edge between the ETF and the stock, the holder records its direction in the undirected graph
+        G.add_edge(etf_symbol, stock_symbol, weight=weight, holder=etf_symbol)
 
-        # Loop through each stock in the holdings
-        for stock in holdings:
-            stock_symbol = stock['asset']
-            weight = stock['weightPercentage']
+    return G
 
-            # Add stock node if it's not already added
-            if not G.has_node(stock_symbol):
-                G.add_node(stock_symbol, type='Stock')
+def create_graph_from_stream(etf_stream):
+    """
+    create_graph_from_stream builds the graph incrementally from a stream of ETFs, such as the one returned by
+    fmp.stream_etf_positions, adding each ETF as soon as it arrives.
 
-            # Add an edge between the ETF and the stock
-            G.add_edge(etf_symbol, stock_symbol, weight=weight)
+    Args:
+        etf_stream (iterable): An iterable of (ETF symbol, ETF details) pairs.
 
-    # remove negative weights
-    for u, v, data in G.edges(data=True):
-        if data['weight'] < 0:
-            print(f"Negative weight found: {u}-{v} with weight {data['weight']}")
-            data['weight'] = abs(data['weight'])  # or set it to a default positive value
+    Returns:
+        nx.Graph: A NetworkX graph representing the ETFs and their positions.
+    """
+    if etf_stream is None:
+        print("[!] Failed to create graph from FMP details: No details provided")
+        return None
 
+    # The span includes the time spent waiting on the stream, i.e. the fetch overlapped with the build
+    with span('graph.build') as attrs:
+        G = nx.Graph()
+        for etf_symbol, etf_data in etf_stream:
+            add_etf_to_graph(G, etf_symbol, etf_data)
+        attrs.update(nodes=G.number_of_nodes(), edges=G.number_of_edges())
 
     return G
+
+def create_graph_from_fmp(fmp_details):
+    """
+    create_graph_from_fmp creates a graph from the ETF positions returned by the Financial Modeling Prep API.
+
+    Args:
+        fmp_details (dict): A dictionary containing the ETF positions as returned by the API.
+
+    Returns:
+        nx.Graph: A NetworkX graph representing the ETFs and their positions.
+    """
+
+    if fmp_details is None:
+        print("[!] Failed to create graph from FMP details: No details provided")
+        return None
+
+    return create_graph_from_stream(fmp_details.items())
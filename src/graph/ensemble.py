@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx # type: ignore
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+import community as community_louvain
+
+from ..instrument import traced
+from .community import modularity_batch, partition_labels
+
+METHODS = ('louvain', 'label_propagation')
+
+# The graph each worker process runs on, set once per worker by _init_worker
+_worker_graph = None
+
+def _init_worker(G):
+    global _worker_graph
+    _worker_graph = G
+
+def _run_detection(task):
+    """ Runs one seeded community detection on the worker's graph and returns the partition dictionary. """
+    method, seed = task
+    if method == 'louvain':
+        return community_louvain.best_partition(_worker_graph, random_state=seed)
+    if method == 'label_propagation':
+        communities = nx.community.asyn_lpa_communities(_worker_graph, weight='weight', seed=seed)
+        return {node: i for i, community in enumerate(communities) for node in community}
+    raise ValueError(f"Unknown community detection method: {method}")
+
+def align_labels(labels, reference):
+    """
+    align_labels relabels a partition so that each of its communities takes the label of the reference community
+    it overlaps the most.
+
+    Args:
+        labels (np.ndarray): Integer community labels of every node.
+        reference (np.ndarray): Integer community labels of the reference partition.
+
+    Returns:
+        np.ndarray: The relabeled partition.
+    """
+    contingency = sparse.coo_matrix(
+        (np.ones(len(labels)), (labels, reference)), shape=(labels.max() + 1, reference.max() + 1)
+    ).tocsr()
+    mapping = np.asarray(contingency.argmax(axis=1)).ravel()
+    return mapping[labels]
+
+def consensus_partition(nodes, labels, weights=None, reference=0):
+    """
+    consensus_partition combines several partitions by aligning them to a reference and taking a weighted majority
+    vote per node.
+
+    Args:
+        nodes (list): The node order of the label matrix.
+        labels (np.ndarray): An (n_nodes, n_runs) matrix of integer community labels.
+        weights (np.ndarray, optional): The voting weight of every run, equal weights if not provided.
+        reference (int): The column used as the reference, which also wins ties.
+
+    Returns:
+        tuple: The consensus partition dictionary and a dictionary with the stability of every node, i.e. the
+            weighted fraction of runs that agree with its consensus community.
+    """
+    num_runs = labels.shape[1]
+    weights = np.ones(num_runs) if weights is None else np.asarray(weights, dtype=float)
+    order = [reference] + [run for run in range(num_runs) if run != reference]
+    ref = labels[:, reference]
+    aligned = np.column_stack([ref] + [align_labels(labels[:, run], ref) for run in order[1:]])
+    weights = weights[order]
+
+    agreement = np.column_stack([(aligned == aligned[:, [run]]) @ weights for run in range(num_runs)])
+    winner = agreement.argmax(axis=1)
+    consensus = aligned[np.arange(len(nodes)), winner]
+    stability = agreement[np.arange(len(nodes)), winner] / weights.sum()
+
+    _, consensus = np.unique(consensus, return_inverse=True)
+    return dict(zip(nodes, consensus.tolist())), dict(zip(nodes, stability.tolist()))
+
+@traced('graph.ensemble')
+def detect_communities_ensemble(G, runs=8, methods=METHODS, workers=None, seed=0):
+    """
+    detect_communities_ensemble runs several seeded Louvain and label propagation detections in parallel on a process
+    pool and combines them into a consensus partition.
+
+    The graph is sent to each worker once, when the worker starts, instead of with every task. The best run by
+    modularity is used as the reference that the other runs are aligned to, and every run votes with a weight equal
+    to its modularity so that degenerate runs cannot outvote good ones.
+
+    Args:
+        G (nx.Graph): The graph to analyze.
+        runs (int): The number of seeded runs per method.
+        methods (tuple): The detection methods to run, 'louvain' and/or 'label_propagation'.
+        workers (int, optional): The number of worker processes, defaults to the number of cores.
+        seed (int): The seed of the first run, run i uses seed + i.
+
+    Returns:
+        dict: A dictionary with the consensus 'partition', the per-node 'stability', the consensus 'modularity' and the
+            'run_modularities' of every individual run.
+    """
+    tasks = [(method, seed + i) for method in methods for i in range(runs)]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(G,)) as executor:
+        partitions = list(executor.map(_run_detection, tasks))
+
+    nodes = list(G)
+    node_array = np.empty(len(nodes), dtype=object)
+    node_array[:] = nodes
+    labels = np.column_stack([partition_labels(node_array, partition) for partition in partitions])
+    run_modularities = modularity_batch(G, labels)
+
+    partition, stability = consensus_partition(
+        nodes, labels, weights=np.clip(run_modularities, 1e-9, None), reference=int(np.argmax(run_modularities))
+    )
+    return {
+        'partition': partition,
+        'stability': stability,
+        'modularity': float(modularity_batch(G, [partition])[0]),
+        'run_modularities': dict(zip([f"{method}-{task_seed}" for method, task_seed in tasks], run_modularities.tolist())),
+    }
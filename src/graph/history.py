@@ -0,0 +1,356 @@
+import json
+import os
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from .bipartite import BipartiteGraph
+
+HISTORY_FORMAT = "etfgraph-history"
+HISTORY_VERSION = 2
+KEYFRAME_INTERVAL = 30  # A full snapshot is stored every this many dates, bounding reconstruction to as many deltas
+
+# The holdings on one date. Edges are identified by a single int64 key, (ETF ID << 32) | stock ID, kept sorted
+HoldingsState = namedtuple('HoldingsState', ['keys', 'weights', 'etf_ids', 'leveraged', 'inverse'])
+
+# The edge records of a keyframe or delta file, stored sorted by stock so the records of one stock are contiguous
+EDGE_DTYPE = np.dtype([('key', np.int64), ('weight', np.float64), ('kind', np.int8)])
+EDGE_KINDS = ('added', 'removed', 'reweighted')  # A keyframe is stored as the delta adding every edge to no holdings
+
+
+def _edge_keys(etf_ids, stock_ids):
+    return (np.asarray(etf_ids, dtype=np.int64) << 32) | np.asarray(stock_ids, dtype=np.int64)
+
+
+def _split_keys(keys):
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+def diff_states(previous, current):
+    """
+    diff_states computes the edge delta between two holdings states.
+
+    Args:
+        previous (HoldingsState): The earlier state.
+        current (HoldingsState): The later state.
+
+    Returns:
+        dict: Arrays of 'added_keys'/'added_weights', 'removed_keys' and 'reweighted_keys'/'reweighted_weights',
+            plus the full ETF flag arrays of the later state.
+    """
+    _, previous_index, current_index = np.intersect1d(previous.keys, current.keys, assume_unique=True, return_indices=True)
+    changed = previous.weights[previous_index] != current.weights[current_index]
+    added = ~np.isin(current.keys, previous.keys, assume_unique=True)
+    return {
+        'added_keys': current.keys[added],
+        'added_weights': current.weights[added],
+        'removed_keys': np.setdiff1d(previous.keys, current.keys, assume_unique=True),
+        'reweighted_keys': current.keys[current_index[changed]],
+        'reweighted_weights': current.weights[current_index[changed]],
+        'etf_ids': current.etf_ids,
+        'leveraged': current.leveraged,
+        'inverse': current.inverse,
+    }
+
+
+def _empty_state():
+    return HoldingsState(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64),
+                         np.empty(0, dtype=np.int64), np.empty(0, dtype=bool), np.empty(0, dtype=bool))
+
+
+def _pack_edges(delta):
+    """ Returns the edge records of a delta, sorted by stock ID and then ETF ID. """
+    parts = []
+    for kind, name in enumerate(EDGE_KINDS):
+        keys = delta[f"{name}_keys"]
+        part = np.zeros(len(keys), dtype=EDGE_DTYPE)
+        part['key'], part['kind'] = keys, kind
+        if f"{name}_weights" in delta:
+            part['weight'] = delta[f"{name}_weights"]
+        parts.append(part)
+    edges = np.concatenate(parts)
+    etf_ids, stock_ids = _split_keys(edges['key'])
+    return edges[np.lexsort((etf_ids, stock_ids))]
+
+
+def _unpack_edges(edges, etf_ids, leveraged, inverse):
+    """ Returns the delta of edge records, with the ETF flag arrays of the later state. """
+    delta = {'etf_ids': etf_ids, 'leveraged': leveraged, 'inverse': inverse}
+    for kind, name in enumerate(EDGE_KINDS):
+        part = edges[edges['kind'] == kind]
+        delta[f"{name}_keys"] = part['key']
+        if name != 'removed':
+            delta[f"{name}_weights"] = part['weight']
+    return delta
+
+
+def apply_delta(state, delta):
+    """
+    apply_delta applies an edge delta produced by diff_states to a holdings state.
+
+    Args:
+        state (HoldingsState): The earlier state.
+        delta (dict): The delta.
+
+    Returns:
+        HoldingsState: The later state.
+    """
+    keep = ~np.isin(state.keys, delta['removed_keys'], assume_unique=True)
+    keys, weights = state.keys[keep], state.weights[keep].copy()
+    weights[np.searchsorted(keys, delta['reweighted_keys'])] = delta['reweighted_weights']
+
+    keys = np.concatenate([keys, delta['added_keys']])
+    weights = np.concatenate([weights, delta['added_weights']])
+    order = np.argsort(keys, kind='stable')
+    return HoldingsState(keys[order], weights[order], delta['etf_ids'], delta['leveraged'], delta['inverse'])
+
+
+class HoldingsHistory:
+    """
+    HoldingsHistory stores daily holdings pulls as per-date edge deltas on top of periodic full keyframes.
+
+    ETF and stock symbols are interned in append-only tables shared by every date, so IDs never change. Every date
+    after the first stores the delta (added, removed and reweighted holdings) from the previous date, and every
+    `keyframe_interval` dates a full keyframe is stored as well, so reconstructing any date replays at most that many
+    deltas. The edge records of every file are stored uncompressed and sorted by stock, next to a compressed index of
+    the offsets of each stock's records, so queries about a single stock memory-map each file and read only the
+    records of that stock.
+
+    Args:
+        path (str): The history directory, created if it does not exist.
+        keyframe_interval (int): The number of dates between full keyframes, for a new history.
+    """
+
+    def __init__(self, path, keyframe_interval=KEYFRAME_INTERVAL):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        index_path = os.path.join(path, 'index.json')
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('format') != HISTORY_FORMAT or index.get('version') != HISTORY_VERSION:
+                raise ValueError(f"Unsupported holdings history in {path}")
+            self.keyframe_interval = index['keyframe_interval']
+            self.entries = index['entries']
+            with open(os.path.join(path, 'symbols.json'), 'r') as f:
+                symbols = json.load(f)
+            self.etf_symbols, self.stock_symbols = symbols['etfs'], symbols['stocks']
+        else:
+            self.keyframe_interval = keyframe_interval
+            self.entries = []
+            self.etf_symbols, self.stock_symbols = [], []
+        self.etf_index = {symbol: i for i, symbol in enumerate(self.etf_symbols)}
+        self.stock_index = {symbol: i for i, symbol in enumerate(self.stock_symbols)}
+        self._load = lru_cache(maxsize=64)(self._load_file)
+        self._load_stock = lru_cache(maxsize=256)(self._load_stock_file)
+
+    def dates(self):
+        """ list: The stored dates, in order. """
+        return [entry['date'] for entry in self.entries]
+
+    def _write_json(self, name, value):
+        tmp_path = os.path.join(self.path, f".{name}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def _write_file(self, name, delta):
+        """ Writes a delta as the edge records `<name>.edges.npy` and the index and ETF flags `<name>.npz`. """
+        edges = _pack_edges(delta)
+        stocks, offsets = np.unique(edges['key'] & 0xFFFFFFFF, return_index=True)
+        np.save(os.path.join(self.path, f"{name}.edges.npy"), edges)
+        np.savez_compressed(
+            os.path.join(self.path, f"{name}.npz"),
+            stocks=stocks, offsets=np.append(offsets, len(edges)),
+            etf_ids=delta['etf_ids'], leveraged=delta['leveraged'], inverse=delta['inverse'],
+        )
+
+    def _load_file(self, name):
+        """ Returns the full delta stored under `name`. """
+        edges = np.load(os.path.join(self.path, f"{name}.edges.npy"), allow_pickle=False)
+        with np.load(os.path.join(self.path, f"{name}.npz"), allow_pickle=False) as data:
+            return _unpack_edges(edges, data['etf_ids'], data['leveraged'], data['inverse'])
+
+    def _load_stock_file(self, name, stock_id):
+        """ Returns the delta stored under `name` restricted to one stock, without its ETF flag arrays. """
+        with np.load(os.path.join(self.path, f"{name}.npz"), allow_pickle=False) as data:
+            stocks, offsets = data['stocks'], data['offsets']  # Only these members are decompressed
+        position = np.searchsorted(stocks, stock_id)
+        if position < len(stocks) and stocks[position] == stock_id:
+            edges = np.load(os.path.join(self.path, f"{name}.edges.npy"), mmap_mode='r', allow_pickle=False)
+            edges = np.array(edges[offsets[position]:offsets[position + 1]])
+        else:
+            edges = np.empty(0, dtype=EDGE_DTYPE)
+        empty = _empty_state()
+        return _unpack_edges(edges, empty.etf_ids, empty.leveraged, empty.inverse)
+
+    @staticmethod
+    def _intern(symbols, table, index):
+        ids = np.empty(len(symbols), dtype=np.int64)
+        for i, symbol in enumerate(symbols):
+            if symbol not in index:
+                index[symbol] = len(table)
+                table.append(symbol)
+            ids[i] = index[symbol]
+        return ids
+
+    def _state_of(self, G):
+        bipartite = G if isinstance(G, BipartiteGraph) else BipartiteGraph.from_networkx(G, strict=True)
+        etf_ids = self._intern(bipartite.etf_symbols.tolist(), self.etf_symbols, self.etf_index)
+        stock_ids = self._intern(bipartite.stock_symbols.tolist(), self.stock_symbols, self.stock_index)
+        coo = bipartite.weights.tocoo()
+        keys = _edge_keys(etf_ids[coo.row], stock_ids[coo.col])
+        order = np.argsort(keys, kind='stable')
+        etf_order = np.argsort(etf_ids, kind='stable')
+        return HoldingsState(
+            keys[order], coo.data.astype(np.float64)[order],
+            etf_ids[etf_order], bipartite.leveraged[etf_order], bipartite.inverse[etf_order],
+        )
+
+    def add(self, date, G):
+        """
+        Records the holdings of a date, which must be later than every stored date.
+
+        Args:
+            date (str): The date in ISO format (YYYY-MM-DD).
+            G (nx.Graph or BipartiteGraph): The graph pulled on that date.
+
+        Raises:
+            ValueError: If the date is not after the last stored date, or a NetworkX graph does not record the holder
+                of its edges.
+        """
+        date = str(date)
+        if self.entries and date <= self.entries[-1]['date']:
+            raise ValueError(f"Date {date} is not after the last stored date {self.entries[-1]['date']}")
+
+        previous = self.state_as_of(self.entries[-1]['date']) if self.entries else None
+        state = self._state_of(G)
+        entry = {'date': date}
+        if previous is not None:
+            entry['delta'] = f"{date}.delta"
+            self._write_file(entry['delta'], diff_states(previous, state))
+        if previous is None or len(self.entries) % self.keyframe_interval == 0:
+            entry['keyframe'] = f"{date}.keyframe"
+            self._write_file(entry['keyframe'], diff_states(_empty_state(), state))
+
+        self.entries.append(entry)
+        self._write_json('symbols.json', {'etfs': self.etf_symbols, 'stocks': self.stock_symbols})
+        self._write_json('index.json', {
+            'format': HISTORY_FORMAT, 'version': HISTORY_VERSION,
+            'keyframe_interval': self.keyframe_interval, 'entries': self.entries,
+        })
+
+    def _position(self, date):
+        """ Returns the position of the last stored date on or before `date`. """
+        position = np.searchsorted(self.dates(), str(date), side='right') - 1
+        if position < 0:
+            raise KeyError(f"No holdings stored on or before {date}")
+        return int(position)
+
+    def _replay(self, position, first_position=None, stock_id=None):
+        """
+        Yields (entry, state) for every date from the keyframe preceding `first_position` (defaults to `position`)
+        up to `position`. If `stock_id` is given, only the records of that stock are read and the states hold only its
+        edges, with empty ETF flag arrays.
+        """
+        first_position = position if first_position is None else first_position
+        start = max(i for i in range(first_position + 1) if 'keyframe' in self.entries[i])
+        load = self._load if stock_id is None else (lambda name: self._load_stock(name, stock_id))
+        state = apply_delta(_empty_state(), load(self.entries[start]['keyframe']))
+        yield self.entries[start], state
+        for entry in self.entries[start + 1:position + 1]:
+            state = apply_delta(state, load(entry['delta']))
+            yield entry, state
+
+    def state_as_of(self, date):
+        """ Returns the HoldingsState of the last stored date on or before `date`. """
+        for _, state in self._replay(self._position(date)):
+            pass
+        return state
+
+    def graph_as_of(self, date):
+        """
+        Reconstructs the graph as of a date from the nearest keyframe and the deltas that follow it.
+
+        Args:
+            date (str): The date in ISO format, the last stored date on or before it is used.
+
+        Returns:
+            BipartiteGraph: The graph on that date.
+        """
+        state = self.state_as_of(date)
+        etf_ids, stock_ids = _split_keys(state.keys)
+        stocks, cols = np.unique(stock_ids, return_inverse=True)
+        rows = np.searchsorted(state.etf_ids, etf_ids)
+        weights = sparse.csr_matrix((state.weights, (rows, cols)), shape=(len(state.etf_ids), len(stocks)))
+        etf_table = np.asarray(self.etf_symbols, dtype=str)
+        stock_table = np.asarray(self.stock_symbols, dtype=str)
+        return BipartiteGraph(etf_table[state.etf_ids], stock_table[stocks], weights, state.leveraged, state.inverse)
+
+    def weight_history(self, stock_symbol, start=None, end=None):
+        """
+        Returns the weight of a stock in every ETF holding it, on every stored date in a range.
+
+        Args:
+            stock_symbol (str): The stock.
+            start (str, optional): The first date, the earliest stored date if not provided.
+            end (str, optional): The last date, the latest stored date if not provided.
+
+        Returns:
+            dict: A dictionary with dates as keys and dictionaries of ETF symbol to weight as values.
+        """
+        if stock_symbol not in self.stock_index or not self.entries:
+            return {}
+        start = str(start) if start is not None else self.entries[0]['date']
+        end = str(end) if end is not None else self.entries[-1]['date']
+        first_position = self._position(max(start, self.entries[0]['date']))
+
+        history = {}
+        stock_id = self.stock_index[stock_symbol]
+        for entry, state in self._replay(self._position(end), first_position, stock_id=stock_id):
+            if entry['date'] >= start:
+                etf_ids, _ = _split_keys(state.keys)
+                history[entry['date']] = {self.etf_symbols[i]: w for i, w in zip(etf_ids.tolist(), state.weights.tolist())}
+        return history
+
+    def stock_holders_as_of(self, stock_symbol, date):
+        """
+        Returns the ETFs holding a stock on a date, replaying only the stock's holdings of each file read.
+
+        Args:
+            stock_symbol (str): The stock.
+            date (str): The date in ISO format, the last stored date on or before it is used.
+
+        Returns:
+            dict: A dictionary of ETF symbol to weight.
+        """
+        if stock_symbol not in self.stock_index:
+            return {}
+        for _, state in self._replay(self._position(date), stock_id=self.stock_index[stock_symbol]):
+            pass
+        etf_ids, _ = _split_keys(state.keys)
+        return {self.etf_symbols[i]: w for i, w in zip(etf_ids.tolist(), state.weights.tolist())}
+
+    def etfs_added(self, stock_symbol, start, end):
+        """
+        Returns the ETFs that held a stock on `end` but not on `start`.
+
+        Args:
+            stock_symbol (str): The stock.
+            start (str): The earlier date.
+            end (str): The later date.
+
+        Returns:
+            list: The symbols of the ETFs that added the stock, sorted.
+        """
+        before = self.stock_holders_as_of(stock_symbol, start) if str(start) >= self.dates()[0] else {}
+        after = self.stock_holders_as_of(stock_symbol, end)
+        return sorted(set(after) - set(before))
+
+    def etfs_removed(self, stock_symbol, start, end):
+        """ Returns the ETFs that held a stock on `start` but no longer on `end`, sorted. """
+        before = self.stock_holders_as_of(stock_symbol, start) if str(start) >= self.dates()[0] else {}
+        after = self.stock_holders_as_of(stock_symbol, end)
+        return sorted(set(before) - set(after))
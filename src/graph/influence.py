@@ -1,46 +1,40 @@
-import networkx as nx
+from .bipartite import stock_nodes
+from .centrality import centrality_rankings
+from .pagerank import pagerank
 
-def find_influential_stocks(G):
+def find_influential_stocks(G, metric='degree', **kwargs):
     """
     Find the top 10 most and least influential stocks based on centrality measures.
 
     Args:
-        G (nx.Graph): A NetworkX graph of stocks and ETFs.
+        G (nx.Graph or BipartiteGraph): A graph of stocks and ETFs.
+        metric (str): The centrality metric, out of centrality.METRICS, degree centrality by default.
+        **kwargs: Options passed to stock_centrality, e.g. samples and workers for betweenness and closeness.
 
     Returns:
         tuple: Returns two lists containing the top 10 most and least influential stocks, respectively.
     """
-    # Calculate centrality for the graph
-    centrality = nx.degree_centrality(G)
+    ranking = centrality_rankings(G, (metric,), k=10, **kwargs)[metric]
+    return ranking['top'], ranking['bottom']
 
-    # Filter centrality to include only stock nodes
-    stock_centrality = {node: cent for node, cent in centrality.items() if G.nodes[node]['type'] == 'Stock'}
-
-    # Sort stocks by centrality
-    sorted_stocks = sorted(stock_centrality.items(), key=lambda item: item[1], reverse=True)
-
-    # Top 10 most influential stocks
-    top_most_influential = sorted_stocks[:10]
-
-    # Top 10 least influential stocks
-    top_least_influential = sorted_stocks[-10:]
-
-    return top_most_influential, top_least_influential
-
-def perform_pagerank(G):
+def perform_pagerank(G, warm_start=None, include_etfs=False):
     """
     Perform PageRank analysis to determine the importance of stocks in the graph.
 
     Args:
-        G (nx.Graph): A NetworkX graph of stocks and ETFs.
+        G (nx.Graph or BipartiteGraph): A graph of stocks and ETFs.
+        warm_start (dict, optional): Scores from a previous run, including ETF scores, used as the starting vector.
+        include_etfs (bool): Return the scores of every node instead of only the stocks, e.g. to warm start the next run.
 
     Returns:
         dict: A dictionary containing stocks and their PageRank scores.
     """
     # Compute PageRank
-    pagerank_scores = nx.pagerank(G, weight='weight')
+    pagerank_scores = pagerank(G, warm_start=warm_start)
+    if include_etfs:
+        return pagerank_scores
 
     # Filter PageRank to include only stock nodes
-    stock_pagerank = {node: score for node, score in pagerank_scores.items() if G.nodes[node]['type'] == 'Stock'}
+    stock_pagerank = {node: pagerank_scores[node] for node in stock_nodes(G).tolist()}
 
     return stock_pagerank
@@ -0,0 +1,128 @@
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from .analysis import _ranked
+from .bipartite import BipartiteGraph
+
+
+class LookThrough:
+    """
+    LookThrough resolves ETFs that hold other ETFs into their effective stock-level exposure.
+
+    A holding is nested when its symbol is also an ETF of the graph. Holdings are split into the direct stock matrix
+    D (ETFs × stocks) and the nested matrix N (ETFs × ETFs, as fractions), and the effective exposure is the fixed
+    point of E = D + N · E, found by sparse iteration starting from E = D. Each iteration expands one more level of
+    nesting, so a fund-of-funds chain of depth d is resolved exactly after d iterations. Cycles, such as two ETFs
+    holding each other, are expanded at most `max_depth` levels deep.
+
+    The exposure of every ETF is computed once and kept, so any number of portfolios is resolved with a single sparse
+    product against it. Exposures are in the same percentage units as the holding weights.
+
+    NetworkX graphs are converted with BipartiteGraph.from_networkx, which orients every holding by the ETF recorded
+    as its holder. Graphs pickled before holders were recorded are rejected, as the direction of an edge between two
+    ETFs cannot be recovered from them.
+
+    Args:
+        G (nx.Graph, BipartiteGraph or dict): The graph, or the dictionary returned by fmp.pull_etf_positions.
+        max_depth (int): The maximum number of nesting levels expanded.
+        tol (float): The iteration stops early once no exposure changes by more than this value.
+
+    Raises:
+        ValueError: If a NetworkX graph does not record the holder of its edges.
+    """
+
+    def __init__(self, G, max_depth=10, tol=1e-9):
+        if isinstance(G, dict):
+            G = BipartiteGraph.from_fmp(G)
+        elif not isinstance(G, BipartiteGraph):
+            G = BipartiteGraph.from_networkx(G, strict=True)
+
+        self.etf_symbols = G.etf_symbols
+        self.etf_index = G.etf_index
+        nested_etf = np.array([self.etf_index.get(symbol, -1) for symbol in G.stock_symbols.tolist()], dtype=np.int64)
+        is_nested = nested_etf >= 0
+        self.nested_symbols = G.stock_symbols[is_nested]
+
+        weights = G.weights_csc
+        D = weights[:, np.flatnonzero(~is_nested)].tocsr()
+        nested = weights[:, np.flatnonzero(is_nested)].tocoo()
+        N = sparse.coo_matrix(
+            (nested.data / 100.0, (nested.row, nested_etf[is_nested][nested.col])), shape=(G.num_etfs, G.num_etfs)
+        ).tocsr()
+        self.stock_symbols = G.stock_symbols[~is_nested]
+
+        E = D
+        self.depth = 0
+        if N.nnz:
+            for self.depth in range(1, max_depth + 1):
+                E_next = (D + N @ E).tocsr()
+                delta = abs(E_next - E)
+                E = E_next
+                if delta.nnz == 0 or delta.max() <= tol:
+                    break
+        E.eliminate_zeros()
+        self.exposures = E
+
+    @property
+    def num_nested(self):
+        """ int: The number of holdings that are themselves ETFs of the graph. """
+        return len(self.nested_symbols)
+
+    def etf_exposure(self, etf_symbol, top=None):
+        """
+        Returns the effective stock-level exposure of an ETF.
+
+        Args:
+            etf_symbol (str): The symbol of the ETF.
+            top (int, optional): Only return the largest exposures.
+
+        Returns:
+            list: A list of tuples containing the stock symbol and its effective weight, sorted in descending order.
+        """
+        row = self.exposures.getrow(self.etf_index[etf_symbol])
+        ranked = _ranked(self.stock_symbols[row.indices], row.data)
+        return ranked[:top] if top is not None else ranked
+
+    def stock_exposures(self):
+        """ np.ndarray: The total effective weight of every stock across all ETFs, indexed like stock_symbols. """
+        return np.asarray(self.exposures.sum(axis=0)).ravel()
+
+    def portfolio_exposure(self, portfolios):
+        """
+        portfolio_exposure resolves any number of ETF portfolios to their stock-level exposure in one sparse product.
+
+        Args:
+            portfolios (dict): A dictionary mapping a portfolio label to a dictionary of ETF symbol -> portfolio weight,
+                e.g. {'60/40': {'SPY': 0.6, 'AGG': 0.4}}. Weights are fractions of the portfolio.
+
+        Returns:
+            tuple: The portfolio labels, the stock symbols as a numpy array and a (portfolios × stocks) CSR matrix of
+                effective weights in percent of each portfolio.
+        """
+        labels = list(portfolios)
+        rows, cols, data = [], [], []
+        for i, label in enumerate(labels):
+            for etf_symbol, weight in portfolios[label].items():
+                if etf_symbol not in self.etf_index:
+                    raise KeyError(f"ETF {etf_symbol} of portfolio {label} is not in the graph")
+                rows.append(i)
+                cols.append(self.etf_index[etf_symbol])
+                data.append(weight)
+        P = sparse.coo_matrix((data, (rows, cols)), shape=(len(labels), len(self.etf_symbols))).tocsr()
+        return labels, self.stock_symbols, (P @ self.exposures).tocsr()
+
+
+def stocks_with_most_exposure(G, max_depth=10):
+    """
+    stocks_with_most_exposure ranks stocks by their total look-through weight, so that ETFs held by other ETFs are
+    replaced by their own holdings instead of being ranked as stocks.
+
+    Args:
+        G (nx.Graph, BipartiteGraph or dict): The graph (see LookThrough).
+        max_depth (int): The maximum number of nesting levels expanded.
+
+    Returns:
+        list: A list of tuples containing the stock name and its total effective weight, sorted in descending order.
+    """
+    lookthrough = LookThrough(G, max_depth=max_depth)
+    return _ranked(lookthrough.stock_symbols, lookthrough.stock_exposures())
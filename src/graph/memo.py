@@ -0,0 +1,185 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import weakref
+
+import numpy as np # type: ignore
+
+from ..instrument import count
+from .bipartite import BipartiteGraph
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+# Bump when a cached analysis changes its output, so results of the old code are never served
+CACHE_VERSION = 1
+
+
+def graph_fingerprint(G):
+    """
+    graph_fingerprint returns a stable SHA-256 hash of the graph contents.
+
+    The hash only depends on the nodes, their attributes and the weighted edges, not on insertion order, so the same
+    holdings always give the same fingerprint across runs, pickles and snapshots of the same kind.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+
+    Returns:
+        str: The hexadecimal fingerprint.
+    """
+    h = hashlib.sha256()
+    if isinstance(G, BipartiteGraph):
+        h.update(b'bipartite')
+        etf_order = np.argsort(G.etf_symbols, kind='stable')
+        stock_order = np.argsort(G.stock_symbols, kind='stable')
+        weights = G.weights[etf_order][:, stock_order].tocsr()
+        weights.sort_indices()
+        for array in (G.etf_symbols[etf_order], G.stock_symbols[stock_order], weights.indptr.astype(np.int64),
+                      weights.indices.astype(np.int64), weights.data.astype(np.float64),
+                      G.leveraged[etf_order], G.inverse[etf_order]):
+            h.update(np.ascontiguousarray(array).tobytes())
+            h.update(b'|')
+        return h.hexdigest()
+
+    h.update(b'networkx')
+    for node, attrs in sorted(G.nodes(data=True), key=lambda item: str(item[0])):
+        h.update(repr((node, sorted(attrs.items()))).encode())
+    for edge in sorted((min(u, v), max(u, v), data.get('weight')) for u, v, data in G.edges(data=True)):
+        h.update(repr(edge).encode())
+    return h.hexdigest()
+
+
+def _is_node_clustering(value):
+    """ Returns True for a cdlib NodeClustering, without importing cdlib: one cannot exist before cdlib is imported. """
+    cdlib = sys.modules.get('cdlib')
+    return cdlib is not None and isinstance(value, cdlib.NodeClustering)
+
+
+def _digest(value):
+    """ Returns a deterministic representation of an analysis argument, such as a partition or a NodeClustering. """
+    if _is_node_clustering(value):
+        return ('NodeClustering', sorted(sorted(map(str, community)) for community in value.communities))
+    if isinstance(value, dict):
+        return ('dict', sorted((repr(key), _digest(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__, [_digest(item) for item in value])
+    if isinstance(value, (set, frozenset)):
+        return ('set', sorted(repr(item) for item in value))
+    return repr(value)
+
+
+class ResultCache:
+    """
+    ResultCache is an on-disk cache of analysis results, content-addressed by the graph fingerprint, the analysis
+    name and its parameters.
+
+    Every result is a pickle file named after its key. Reading a result refreshes its modification time, and once the
+    directory grows past `max_bytes` the least recently used results are evicted.
+
+    Args:
+        path (str): The cache directory, created if needed.
+        max_bytes (int): The maximum total size of the cached results.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, G):
+        """ Returns the fingerprint of a graph, computed once per graph object. The graph must not be mutated afterwards. """
+        if G not in self._fingerprints:
+            self._fingerprints[G] = graph_fingerprint(G)
+        return self._fingerprints[G]
+
+    def key(self, fingerprint, name, args=(), kwargs=None):
+        """ Returns the cache key of an analysis of a graph. """
+        params = repr((CACHE_VERSION, name, _digest(list(args)), _digest(kwargs or {})))
+        return hashlib.sha256(f"{fingerprint}:{params}".encode()).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Returns a cached result.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: (True, result) on a hit, (False, None) on a miss.
+        """
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False, None
+        return True, value
+
+    def put(self, key, value):
+        """ Stores a result, then evicts the least recently used results if the cache is over its size limit. """
+        fd, tmp_path = tempfile.mkstemp(prefix='.result-', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._file(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """ Removes the least recently used results until the cache fits in max_bytes. """
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.pkl'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def call(self, fn, G, *args, **kwargs):
+        """
+        call returns fn(G, *args, **kwargs), served from the cache when the same analysis already ran on a graph with
+        the same contents.
+
+        NodeClustering results are stored without their graph and re-attached to G when read back.
+
+        Args:
+            fn (callable): The analysis, e.g. graph.detect_communities_louvain.
+            G (nx.Graph or BipartiteGraph): The graph, passed as the first argument of fn.
+
+        Returns:
+            The result of the analysis.
+        """
+        key = self.key(self.fingerprint(G), f"{fn.__module__}.{fn.__qualname__}", args, kwargs)
+        hit, value = self.get(key)
+        if hit:
+            self.hits += 1
+            count('results_cache.hits')
+            if isinstance(value, tuple) and value and value[0] == 'NodeClustering':
+                from cdlib import NodeClustering
+                _, communities, method_name, method_parameters, overlap = value
+                return NodeClustering(communities, G, method_name, method_parameters, overlap)
+            return value
+
+        self.misses += 1
+        count('results_cache.misses')
+        result = fn(G, *args, **kwargs)
+        if _is_node_clustering(result):
+            self.put(key, ('NodeClustering', result.communities, result.method_name, result.method_parameters, result.overlap))
+        else:
+            self.put(key, result)
+        return result
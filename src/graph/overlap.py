@@ -0,0 +1,180 @@
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from .bipartite import BipartiteGraph
+
+MEASURES = ('overlap', 'cosine', 'dot')
+
+
+def _bipartite(G):
+    return G if isinstance(G, BipartiteGraph) else BipartiteGraph.from_networkx(G)
+
+
+def prune_rows(M, threshold=0.0, top_k=None):
+    """
+    prune_rows keeps, in every row of a sparse matrix, only the entries above a threshold and at most the top_k largest.
+
+    Args:
+        M (scipy.sparse matrix): The matrix to prune.
+        threshold (float): Entries less than or equal to this value are dropped.
+        top_k (int, optional): The maximum number of entries kept per row.
+
+    Returns:
+        scipy.sparse.csr_matrix: The pruned matrix, with the entries of every row sorted by decreasing value.
+    """
+    coo = sparse.coo_matrix(M)
+    keep = coo.data > threshold
+    row, col, data = coo.row[keep], coo.col[keep], coo.data[keep]
+
+    order = np.lexsort((-data, row))
+    row, col, data = row[order], col[order], data[order]
+    if top_k is not None:
+        starts = np.searchsorted(row, np.arange(M.shape[0]))
+        rank = np.arange(len(row)) - starts[row]
+        keep = rank < top_k
+        row, col, data = row[keep], col[keep], data[keep]
+
+    indptr = np.zeros(M.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(row, minlength=M.shape[0]), out=indptr[1:])
+    return sparse.csr_matrix((data, col, indptr), shape=M.shape)
+
+
+def project(X, measure='cosine', threshold=0.0, top_k=None, chunk_size=1024):
+    """
+    project computes the weighted one-mode projection X · Xᵀ of a sparse incidence matrix, row chunk by row chunk.
+
+    Every chunk is pruned as soon as it is computed, so memory is bounded by the pruned result plus one chunk of the
+    dense-ish product rather than by the full n × n projection. Self-similarities are dropped.
+
+    Args:
+        X (scipy.sparse matrix): An entities × features matrix of non-negative weights, e.g. ETFs × stocks.
+        measure (str): 'dot' for the raw weighted co-holding X · Xᵀ, 'cosine' for the cosine similarity of the rows,
+            or 'overlap' for the asymmetric fraction of row i's weight in features that row j also has.
+        threshold (float): Scores less than or equal to this value are dropped.
+        top_k (int, optional): The maximum number of scores kept per row.
+        chunk_size (int): The number of rows computed per sparse product.
+
+    Returns:
+        scipy.sparse.csr_matrix: The pruned n × n similarity matrix.
+    """
+    if measure not in MEASURES:
+        raise ValueError(f"Unknown similarity measure: {measure}, expected one of {MEASURES}")
+
+    X = sparse.csr_matrix(X, dtype=np.float64)
+    totals = np.asarray(X.sum(axis=1)).ravel()
+    if measure == 'cosine':
+        norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+        X = sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ X
+        Y_T = X.T.tocsr()
+    elif measure == 'overlap':
+        Y_T = (X > 0).astype(np.float64).T.tocsr()
+    else:
+        Y_T = X.T.tocsr()
+
+    n = X.shape[0]
+    chunks = []
+    for start in range(0, n, chunk_size):
+        chunk = (X[start:start + chunk_size] @ Y_T).tocoo()
+        if measure == 'overlap':
+            chunk.data /= totals[start + chunk.row]
+        chunk.data[start + chunk.row == chunk.col] = 0
+        chunks.append(prune_rows(chunk, threshold, top_k))
+    if not chunks:
+        return sparse.csr_matrix((n, n))
+    return sparse.vstack(chunks, format='csr')
+
+
+def etf_overlap(G, measure='overlap', threshold=0.0, top_k=None, chunk_size=1024):
+    """
+    etf_overlap computes the weighted ETF × ETF projection of the holdings graph.
+
+    With the default 'overlap' measure, entry (i, j) is the fraction of ETF i's holding weight invested in stocks that
+    ETF j also holds, i.e. "how much of SPY is in QQQ".
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+        measure (str): 'overlap', 'cosine' or 'dot' (see project).
+        threshold (float): Scores less than or equal to this value are dropped.
+        top_k (int, optional): The maximum number of ETFs kept per ETF.
+        chunk_size (int): The number of ETFs computed per sparse product.
+
+    Returns:
+        tuple: The ETF symbols as a numpy array and the ETF × ETF similarity matrix as a CSR matrix.
+    """
+    bipartite = _bipartite(G)
+    return bipartite.etf_symbols, project(bipartite.weights, measure, threshold, top_k, chunk_size)
+
+
+def stock_coholding(G, measure='cosine', threshold=0.0, top_k=None, chunk_size=1024):
+    """
+    stock_coholding computes the weighted stock × stock projection of the holdings graph, i.e. how strongly two
+    stocks are held together by the same ETFs.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+        measure (str): 'cosine', 'dot' or 'overlap' (see project).
+        threshold (float): Scores less than or equal to this value are dropped.
+        top_k (int, optional): The maximum number of stocks kept per stock, recommended for large universes.
+        chunk_size (int): The number of stocks computed per sparse product.
+
+    Returns:
+        tuple: The stock symbols as a numpy array and the stock × stock similarity matrix as a CSR matrix.
+    """
+    bipartite = _bipartite(G)
+    return bipartite.stock_symbols, project(bipartite.weights_csc.T.tocsr(), measure, threshold, top_k, chunk_size)
+
+
+class SimilarityIndex:
+    """
+    SimilarityIndex is a precomputed nearest-neighbour index over a similarity matrix.
+
+    The k most similar entities of every row are stored as sorted (n, k) arrays, so a "most similar to X" query is a
+    dictionary lookup and an array slice.
+
+    Args:
+        symbols (array-like): The symbol of every row of the matrix.
+        similarities (scipy.sparse matrix): The n × n similarity matrix, e.g. from etf_overlap or stock_coholding.
+        k (int): The number of neighbours kept per symbol.
+    """
+
+    def __init__(self, symbols, similarities, k=50):
+        self.symbols = np.asarray(symbols, dtype=str)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols.tolist())}
+        self.k = k
+
+        pruned = prune_rows(similarities, threshold=-np.inf, top_k=k)
+        counts = np.diff(pruned.indptr)
+        rank = np.arange(pruned.nnz) - np.repeat(pruned.indptr[:-1], counts)
+        rows = np.repeat(np.arange(len(self.symbols)), counts)
+        self.neighbours = np.full((len(self.symbols), k), -1, dtype=np.int64)
+        self.scores = np.full((len(self.symbols), k), np.nan)
+        self.neighbours[rows, rank] = pruned.indices
+        self.scores[rows, rank] = pruned.data
+
+    @classmethod
+    def for_etfs(cls, G, measure='overlap', k=50, threshold=0.0):
+        """ Builds the index of the most similar ETFs of every ETF (see etf_overlap). """
+        symbols, similarities = etf_overlap(G, measure, threshold, top_k=k)
+        return cls(symbols, similarities, k)
+
+    @classmethod
+    def for_stocks(cls, G, measure='cosine', k=50, threshold=0.0):
+        """ Builds the index of the most co-held stocks of every stock (see stock_coholding). """
+        symbols, similarities = stock_coholding(G, measure, threshold, top_k=k)
+        return cls(symbols, similarities, k)
+
+    def most_similar(self, symbol, k=10):
+        """
+        Returns the most similar entities of a symbol.
+
+        Args:
+            symbol (str): The ETF or stock symbol.
+            k (int): The number of results, at most the k the index was built with.
+
+        Returns:
+            list: A list of tuples containing the symbol and its similarity score, most similar first.
+        """
+        i = self.index[symbol]
+        neighbours = self.neighbours[i, :k]
+        found = neighbours >= 0
+        return list(zip(self.symbols[neighbours[found]].tolist(), self.scores[i, :k][found].tolist()))
@@ -0,0 +1,104 @@
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from .bipartite import BipartiteGraph
+
+# analyze_etf_attributes only flags ETFs as leveraged, so the leverage factor is an assumption
+DEFAULT_LEVERAGE = 2.0
+
+
+def etf_multipliers(G, leverage=DEFAULT_LEVERAGE):
+    """
+    etf_multipliers returns the return multiplier of every ETF: `leverage` for leveraged ETFs, 1 otherwise, negated
+    for inverse ETFs.
+
+    Args:
+        G (BipartiteGraph): The graph.
+        leverage (float): The multiplier applied to leveraged ETFs.
+
+    Returns:
+        np.ndarray: The multiplier of every ETF, indexed by ETF ID.
+    """
+    return np.where(G.leveraged, leverage, 1.0) * np.where(G.inverse, -1.0, 1.0)
+
+
+def _shock_matrix(G, shocks, labels=None):
+    """ Returns the scenario labels and the stocks × scenarios shock matrix aligned to the stock IDs of G. """
+    if isinstance(shocks, dict):
+        labels = list(shocks)
+        rows, cols, data = [], [], []
+        for j, label in enumerate(labels):
+            for stock, shock in shocks[label].items():
+                # Stocks no ETF holds cannot move any ETF
+                if stock in G.stock_index:
+                    rows.append(G.stock_index[stock])
+                    cols.append(j)
+                    data.append(shock)
+        return labels, sparse.csr_matrix((data, (rows, cols)), shape=(G.num_stocks, len(labels)))
+
+    if shocks.shape[0] != G.num_stocks:
+        raise ValueError(f"The shock matrix has {shocks.shape[0]} rows, expected one per stock ({G.num_stocks})")
+    labels = list(range(shocks.shape[1])) if labels is None else list(labels)
+    return labels, shocks
+
+
+def iter_shock_impacts(G, shocks, labels=None, leverage=DEFAULT_LEVERAGE, chunk_size=1024):
+    """
+    iter_shock_impacts propagates stock shocks to every ETF, yielding the impacts in chunks of scenarios.
+
+    The impact of scenario s on ETF e is multiplier(e) × Σ weight(e, stock) / 100 × shock(stock, s), i.e. a single
+    sparse product of the holdings matrix with each chunk of the shock matrix. Only one chunk of scenarios is held in
+    memory at a time, so the number of scenarios is unbounded.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+        shocks (dict, np.ndarray or scipy.sparse matrix): Either a dictionary mapping a scenario label to a dictionary
+            of stock -> shock, or a stocks × scenarios matrix aligned to G.stock_symbols. Shocks are returns, e.g.
+            -0.2 for a 20% drop.
+        labels (list, optional): The scenario labels of a shock matrix, defaults to the column numbers.
+        leverage (float): The multiplier applied to leveraged ETFs.
+        chunk_size (int): The number of scenarios per chunk.
+
+    Yields:
+        tuple: The scenario labels of the chunk and the dense ETFs × scenarios impact matrix.
+    """
+    if not isinstance(G, BipartiteGraph):
+        G = BipartiteGraph.from_networkx(G)
+    exposure = sparse.diags(etf_multipliers(G, leverage) / 100.0) @ G.weights
+
+    if isinstance(shocks, dict):
+        scenarios = list(shocks)
+        for start in range(0, len(scenarios), chunk_size):
+            chunk_labels, S = _shock_matrix(G, {label: shocks[label] for label in scenarios[start:start + chunk_size]})
+            yield chunk_labels, np.asarray((exposure @ S).todense())
+        return
+
+    labels, shocks = _shock_matrix(G, shocks, labels)
+    shocks = shocks.tocsc() if sparse.issparse(shocks) else shocks
+    for start in range(0, shocks.shape[1], chunk_size):
+        impact = exposure @ shocks[:, start:start + chunk_size]
+        yield labels[start:start + chunk_size], impact.toarray() if sparse.issparse(impact) else np.asarray(impact)
+
+
+def propagate_shocks(G, shocks, labels=None, leverage=DEFAULT_LEVERAGE, chunk_size=1024):
+    """
+    propagate_shocks returns the impact of every scenario on every ETF (see iter_shock_impacts).
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph.
+        shocks (dict, np.ndarray or scipy.sparse matrix): The scenarios, see iter_shock_impacts.
+        labels (list, optional): The scenario labels of a shock matrix.
+        leverage (float): The multiplier applied to leveraged ETFs.
+        chunk_size (int): The number of scenarios computed per sparse product.
+
+    Returns:
+        tuple: The ETF symbols as a numpy array, the scenario labels and the ETFs × scenarios impact matrix.
+    """
+    if not isinstance(G, BipartiteGraph):
+        G = BipartiteGraph.from_networkx(G)
+    all_labels, impacts = [], []
+    for chunk_labels, impact in iter_shock_impacts(G, shocks, labels, leverage, chunk_size):
+        all_labels.extend(chunk_labels)
+        impacts.append(impact)
+    impact = np.hstack(impacts) if impacts else np.zeros((G.num_etfs, 0))
+    return G.etf_symbols, all_labels, impact
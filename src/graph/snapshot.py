@@ -0,0 +1,132 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from ..instrument import traced
+from .bipartite import BipartiteGraph
+
+SNAPSHOT_FORMAT = "etfgraph-snapshot"
+SNAPSHOT_VERSION = 1
+
+# Every array of the snapshot is stored as its own .npy file so it can be memory-mapped independently
+ARRAYS = ('etf_symbols', 'stock_symbols', 'indptr', 'indices', 'weights', 'leveraged', 'inverse')
+
+
+@traced('graph.save_snapshot')
+def save_snapshot(G, path):
+    """
+    save_snapshot writes the graph to a versioned, columnar snapshot directory.
+
+    The snapshot holds the ETF and stock symbol tables, the CSR holdings matrix (indptr, indices and weights) and the
+    leveraged/inverse flag arrays as plain .npy files next to a meta.json header. The directory is written to a
+    temporary location first and then moved into place, so readers never see a partial snapshot.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The graph to save.
+        path (str): The snapshot directory, replaced if it already exists.
+
+    Raises:
+        ValueError: If a NetworkX graph does not record the holder of its edges, which a snapshot cannot do without.
+    """
+    # Guessing the direction of nested ETF holdings would persist stocks as ETFs for every later load
+    bipartite = G if isinstance(G, BipartiteGraph) else BipartiteGraph.from_networkx(G, strict=True)
+    weights = bipartite.weights
+    if not weights.has_canonical_format:
+        weights = weights.copy()
+        weights.sum_duplicates()
+    arrays = {
+        'etf_symbols': bipartite.etf_symbols,
+        'stock_symbols': bipartite.stock_symbols,
+        'indptr': weights.indptr,
+        'indices': weights.indices,
+        'weights': weights.data.astype(np.float64, copy=False),
+        'leveraged': bipartite.leveraged,
+        'inverse': bipartite.inverse,
+    }
+    meta = {
+        'format': SNAPSHOT_FORMAT,
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'num_etfs': bipartite.num_etfs,
+        'num_stocks': bipartite.num_stocks,
+        'num_edges': bipartite.num_edges,
+    }
+
+    path = os.path.abspath(path)
+    tmp_path = tempfile.mkdtemp(prefix='.snapshot-', dir=os.path.dirname(path))
+    try:
+        for name in ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), arrays[name], allow_pickle=False)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=4)
+
+        if os.path.exists(path):
+            old_path = f"{tmp_path}.old"
+            os.rename(path, old_path)
+            os.rename(tmp_path, path)
+            # The path may have held something else, e.g. an older pickled graph
+            if os.path.isdir(old_path) and not os.path.islink(old_path):
+                shutil.rmtree(old_path)
+            else:
+                os.remove(old_path)
+        else:
+            os.rename(tmp_path, path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+
+def read_snapshot_meta(path):
+    """
+    read_snapshot_meta reads and validates the header of a snapshot.
+
+    Args:
+        path (str): The snapshot directory.
+
+    Returns:
+        dict: The snapshot metadata.
+    """
+    with open(os.path.join(path, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    if meta.get('format') != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path} is not an ETF graph snapshot")
+    if meta.get('version') != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {meta.get('version')} in {path}, expected {SNAPSHOT_VERSION}")
+    return meta
+
+
+@traced('graph.load_snapshot')
+def load_snapshot(path, mmap=True):
+    """
+    load_snapshot loads a snapshot written by save_snapshot as a BipartiteGraph.
+
+    With `mmap` the arrays are memory-mapped rather than read, so loading is near-instant regardless of the graph
+    size and only the pages touched by an analysis are ever read from disk. Degree and weight analyses run directly
+    on the result; call to_networkx() only for algorithms that need a NetworkX graph.
+
+    Args:
+        path (str): The snapshot directory.
+        mmap (bool): Memory-map the arrays read-only instead of loading them into memory.
+
+    Returns:
+        BipartiteGraph: The graph.
+    """
+    meta = read_snapshot_meta(path)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r' if mmap else None, allow_pickle=False)
+        for name in ARRAYS
+    }
+    weights = sparse.csr_matrix(
+        (arrays['weights'], arrays['indices'], arrays['indptr']), shape=(meta['num_etfs'], meta['num_stocks'])
+    )
+    return BipartiteGraph(arrays['etf_symbols'], arrays['stock_symbols'], weights, arrays['leveraged'], arrays['inverse'])
+
+
+def is_snapshot(path):
+    """ Returns True if the path is a snapshot directory rather than a pickle file. """
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json'))
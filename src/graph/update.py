@@ -0,0 +1,220 @@
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+from ..instrument import traced
+from .bipartite import BipartiteGraph
+
+
+def empty_change_set():
+    """
+    empty_change_set returns an empty change set, as produced by update_graph.
+
+    Returns:
+        dict: A dictionary with the lists 'added_edges' (etf, stock, weight), 'removed_edges' (etf, stock, weight),
+            'reweighted_edges' (etf, stock, old weight, new weight), 'added_nodes', 'removed_nodes' and 'flag_changes'
+            (etf, leveraged, inverse), and the sets 'etfs' and 'stocks' of every symbol touched by the update.
+    """
+    return {
+        'added_edges': [],
+        'removed_edges': [],
+        'reweighted_edges': [],
+        'added_nodes': [],
+        'removed_nodes': [],
+        'flag_changes': [],
+        'etfs': set(),
+        'stocks': set(),
+    }
+
+
+def _new_holdings(etf_data):
+    """ Returns the holdings of an ETF as a stock -> weight dictionary, normalized like add_etf_to_graph. """
+    return {stock['asset']: abs(stock['weightPercentage']) for stock in etf_data['holdings']}
+
+
+def _held_by(G, etf_symbol, nbr, data, new):
+    """ Returns whether the edge between an ETF and a neighbour of a NetworkX graph is a holding of the ETF. """
+    holder = data.get('holder')
+    if holder is None:
+        # Graphs pickled before holders were recorded: an edge to another ETF is only ours if we still list it
+        return G.nodes[nbr]['type'] != 'ETF' or nbr in new
+    return holder == etf_symbol
+
+
+def _diff_holdings(changes, etf_symbol, old, new):
+    """ Records the edge changes between the old and new holdings of an ETF. """
+    for stock, weight in new.items():
+        if stock not in old:
+            changes['added_edges'].append((etf_symbol, stock, weight))
+        elif old[stock] != weight:
+            changes['reweighted_edges'].append((etf_symbol, stock, old[stock], weight))
+        else:
+            continue
+        changes['stocks'].add(stock)
+    for stock, weight in old.items():
+        if stock not in new:
+            changes['removed_edges'].append((etf_symbol, stock, weight))
+            changes['stocks'].add(stock)
+
+
+def _latest_changes(fmp_changes):
+    """ Returns the (ETF symbol, ETF details) pairs of the changes, keeping only the last details of each ETF. """
+    if isinstance(fmp_changes, dict):
+        return fmp_changes.items()
+    # A stream can list an ETF more than once, its rows must not be added up
+    return dict(fmp_changes).items()
+
+
+@traced('graph.update')
+def update_graph(G, fmp_changes, removed_etfs=()):
+    """
+    update_graph applies re-fetched holdings to an existing graph instead of rebuilding it.
+
+    Only the edges of the changed ETFs are touched: stale holdings are removed, new ones are added, changed weights
+    are updated and ETF flags are refreshed. Stocks left without any holder are removed from the graph. The returned
+    change set lists everything that changed, so caches and analytics can invalidate only what is affected.
+
+    An ETF listed more than once in the changes is updated with its last details.
+
+    A NetworkX graph is updated in place. Only the edges whose recorded holder is the updated ETF are its holdings,
+    so an update never touches the edge of another ETF holding it. In graphs pickled before holders were recorded,
+    an edge between two ETF nodes is only removed when the ETF being updated no longer lists the other one.
+
+    Args:
+        G (nx.Graph or BipartiteGraph): The previous graph, e.g. loaded from a snapshot.
+        fmp_changes (dict or iterable): The new details of the changed ETFs, as a dictionary or a stream of
+            (ETF symbol, ETF details) pairs such as fmp.stream_etf_positions(..., only_stale=True).
+        removed_etfs (iterable): ETFs that no longer exist and must be removed with their holdings.
+
+    Returns:
+        tuple: The updated graph and the change set (see empty_change_set).
+    """
+    if isinstance(G, BipartiteGraph):
+        return _update_bipartite(G, fmp_changes, removed_etfs)
+
+    changes = empty_change_set()
+
+    for etf_symbol, etf_data in _latest_changes(fmp_changes):
+        changes['etfs'].add(etf_symbol)
+        if not G.has_node(etf_symbol):
+            G.add_node(etf_symbol, type='ETF', leveraged=etf_data['leveraged'], inverse=etf_data['inverse'])
+            changes['added_nodes'].append(etf_symbol)
+        else:
+            attrs = G.nodes[etf_symbol]
+            if 'leveraged' not in attrs:
+                # A holding updated as an ETF for the first time keeps its type, as in add_etf_to_graph
+                attrs['leveraged'], attrs['inverse'] = etf_data['leveraged'], etf_data['inverse']
+            elif (attrs['leveraged'], attrs['inverse']) != (etf_data['leveraged'], etf_data['inverse']):
+                attrs['leveraged'], attrs['inverse'] = etf_data['leveraged'], etf_data['inverse']
+                changes['flag_changes'].append((etf_symbol, etf_data['leveraged'], etf_data['inverse']))
+
+        new = _new_holdings(etf_data)
+        old = {nbr: data['weight'] for nbr, data in G[etf_symbol].items() if _held_by(G, etf_symbol, nbr, data, new)}
+        _diff_holdings(changes, etf_symbol, old, new)
+
+        for stock, weight in new.items():
+            if not G.has_node(stock):
+                G.add_node(stock, type='Stock')
+                changes['added_nodes'].append(stock)
+            G.add_edge(etf_symbol, stock, weight=weight, holder=etf_symbol)
+        G.remove_edges_from((etf_symbol, stock) for stock in old if stock not in new)
+
+    for etf_symbol in removed_etfs:
+        if not G.has_node(etf_symbol):
+            continue
+        changes['etfs'].add(etf_symbol)
+        for nbr, data in list(G[etf_symbol].items()):
+            if _held_by(G, etf_symbol, nbr, data, {}):
+                changes['removed_edges'].append((etf_symbol, nbr, data['weight']))
+                changes['stocks'].add(nbr)
+                G.remove_edge(etf_symbol, nbr)
+        if G.degree(etf_symbol) == 0:
+            G.remove_node(etf_symbol)
+            changes['removed_nodes'].append(etf_symbol)
+        else:
+            # Still held by other ETFs, so it only remains as a holding
+            G.nodes[etf_symbol].clear()
+            G.nodes[etf_symbol]['type'] = 'Stock'
+
+    # Garbage-collect stocks that no longer have holders
+    orphans = [stock for stock in changes['stocks'] if G.has_node(stock) and G.nodes[stock]['type'] == 'Stock' and G.degree(stock) == 0]
+    G.remove_nodes_from(orphans)
+    changes['removed_nodes'].extend(orphans)
+    return G, changes
+
+
+def _update_bipartite(B, fmp_changes, removed_etfs):
+    """
+    update_graph for BipartiteGraph, returning a new graph. ETF rows and stock columns keep their order, but removed
+    ETFs and stocks left without holders are dropped, so the IDs after them shift.
+    """
+    changes = empty_change_set()
+    items = _latest_changes(fmp_changes)
+
+    etf_symbols = B.etf_symbols.tolist()
+    stock_symbols = B.stock_symbols.tolist()
+    etf_index, stock_index = dict(B.etf_index), dict(B.stock_index)
+    leveraged, inverse = B.leveraged.tolist(), B.inverse.tolist()
+    rows, cols, data = [], [], []
+    replaced = np.zeros(B.num_etfs, dtype=bool)
+
+    for etf_symbol, etf_data in items:
+        changes['etfs'].add(etf_symbol)
+        if etf_symbol in etf_index:
+            row = etf_index[etf_symbol]
+            replaced[row] = True
+            old = dict(B.etf_holdings(etf_symbol))
+            if (leveraged[row], inverse[row]) != (etf_data['leveraged'], etf_data['inverse']):
+                leveraged[row], inverse[row] = etf_data['leveraged'], etf_data['inverse']
+                changes['flag_changes'].append((etf_symbol, etf_data['leveraged'], etf_data['inverse']))
+        else:
+            row = etf_index[etf_symbol] = len(etf_symbols)
+            etf_symbols.append(etf_symbol)
+            leveraged.append(etf_data['leveraged'])
+            inverse.append(etf_data['inverse'])
+            changes['added_nodes'].append(etf_symbol)
+            old = {}
+
+        new = _new_holdings(etf_data)
+        _diff_holdings(changes, etf_symbol, old, new)
+        for stock, weight in new.items():
+            if stock not in stock_index:
+                stock_index[stock] = len(stock_symbols)
+                stock_symbols.append(stock)
+                changes['added_nodes'].append(stock)
+            rows.append(row)
+            cols.append(stock_index[stock])
+            data.append(weight)
+
+    removed = np.zeros(len(etf_symbols), dtype=bool)
+    for etf_symbol in removed_etfs:
+        if etf_symbol in etf_index:
+            removed[etf_index[etf_symbol]] = True
+            changes['etfs'].add(etf_symbol)
+            changes['removed_nodes'].append(etf_symbol)
+            for stock, weight in B.etf_holdings(etf_symbol) if etf_index[etf_symbol] < B.num_etfs else []:
+                changes['removed_edges'].append((etf_symbol, stock, weight))
+                changes['stocks'].add(stock)
+
+    # Keep the untouched rows of the previous matrix and append the new rows of the changed ETFs
+    coo = B.weights.tocoo()
+    keep = ~replaced[coo.row]
+    weights = sparse.coo_matrix(
+        (np.concatenate([coo.data[keep], np.asarray(data, dtype=np.float64)]),
+         (np.concatenate([coo.row[keep], np.asarray(rows, dtype=np.int64)]),
+          np.concatenate([coo.col[keep], np.asarray(cols, dtype=np.int64)]))),
+        shape=(len(etf_symbols), len(stock_symbols)),
+    ).tocsr()
+
+    # Drop removed ETFs and garbage-collect stocks that no longer have holders
+    weights = weights[~removed]
+    held = np.bincount(weights.indices, minlength=len(stock_symbols)) > 0
+    stock_array = np.asarray(stock_symbols, dtype=str)
+    changes['removed_nodes'].extend(sorted(set(stock_array[~held].tolist()) & changes['stocks']))
+    weights = weights[:, held]
+
+    keep_etfs = ~removed
+    updated = BipartiteGraph(
+        np.asarray(etf_symbols, dtype=str)[keep_etfs], stock_array[held], weights,
+        np.asarray(leveraged, dtype=bool)[keep_etfs], np.asarray(inverse, dtype=bool)[keep_etfs],
+    )
+    return updated, changes
@@ -0,0 +1,7 @@
+# the 'instrument' module records per-stage timings, memory, counters and latency histograms of a pipeline run.
+from .tracer import TRACER
+from .tracer import Tracer
+from .tracer import span
+from .tracer import count
+from .tracer import observe
+from .tracer import traced
\ No newline at end of file
@@ -0,0 +1,235 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def peak_rss_mb():
+    """ Returns the peak resident set size of the process in MB, or None where it is not available. """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if os.uname().sysname == 'Darwin' else peak / 1024
+
+
+class Histogram:
+    """
+    Histogram is a fixed-bucket histogram, cheap enough to record every request latency.
+
+    Args:
+        buckets (tuple): The sorted upper bounds of the buckets.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """ Returns the upper bound of the bucket holding the q-quantile, capped by the largest observed value. """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(((f"le_{bound}", count) for bound, count in zip(self.buckets, self.counts)), inf=self.counts[-1]),
+        }
+
+
+class Tracer:
+    """
+    Tracer records named spans, counters and histograms for a pipeline run.
+
+    A span measures the wall and CPU time of a block, the peak RSS of the process when it ends and, when memory
+    tracing is enabled, the peak traced Python allocation inside it. Before Python 3.9, where tracemalloc cannot
+    reset its peak, the traced allocation when the span ends is recorded instead. Spans nest per thread, and counters
+    and histograms can be updated from any thread.
+
+    Args:
+        trace_memory (bool): Trace Python allocations with tracemalloc, which is accurate but slows the run down.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.spans = []
+        self.counters = {}
+        self.histograms = {}
+        self.trace_memory = trace_memory
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def start_memory_tracing(self):
+        """ Enables the tracemalloc peak of every span started afterwards. """
+        self.trace_memory = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        Measures the enclosed block as a span.
+
+        Args:
+            name (str): The stage name, e.g. 'graph.louvain'.
+            **attrs: Attributes recorded with the span, such as node and edge counts. The yielded dictionary can be
+                updated inside the block to add attributes known only at the end.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        frame = {'child_peak': 0}
+        stack.append(frame)
+        memory = self.trace_memory and tracemalloc.is_tracing()
+        reset_peak = memory and hasattr(tracemalloc, 'reset_peak')
+        if reset_peak:
+            tracemalloc.reset_peak()
+
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield attrs
+        finally:
+            wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+            stack.pop()
+            record = {
+                'name': name,
+                'start': start_wall - self._origin,
+                'wall': wall,
+                'cpu': cpu,
+                'depth': len(stack),
+                'thread': threading.get_ident(),
+                'peak_rss_mb': peak_rss_mb(),
+            }
+            if memory:
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak if reset_peak else current, frame['child_peak'])
+                record['peak_traced_mb'] = peak / (1024 * 1024)
+                if stack:
+                    stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak)
+            if attrs:
+                record['attrs'] = attrs
+            with self._lock:
+                self.spans.append(record)
+
+    def count(self, name, value=1):
+        """ Adds `value` to a counter, e.g. the number of requests or retries. """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """ Records a value, e.g. a request latency in seconds, in a histogram. """
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def reset(self):
+        """ Discards everything recorded so far. """
+        with self._lock:
+            self.spans, self.counters, self.histograms = [], {}, {}
+            self._origin = time.perf_counter()
+
+    def report(self):
+        """
+        Summarizes the run for the results JSON.
+
+        Returns:
+            dict: The 'spans' in the order they ended, the 'counters', the 'histograms' and the overall 'peak_rss_mb'.
+        """
+        with self._lock:
+            return {
+                'spans': [dict(span) for span in self.spans],
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'peak_rss_mb': peak_rss_mb(),
+            }
+
+    def write_trace(self, path):
+        """
+        Writes the spans and counters as a Chrome trace event file, viewable in chrome://tracing or Perfetto.
+
+        Args:
+            path (str): The output file path.
+        """
+        pid = os.getpid()
+        with self._lock:
+            events = [{
+                'name': span['name'],
+                'ph': 'X',
+                'ts': span['start'] * 1e6,
+                'dur': span['wall'] * 1e6,
+                'pid': pid,
+                'tid': span['thread'],
+                'args': {key: value for key, value in span.items() if key not in ('name', 'start', 'wall', 'thread')},
+            } for span in self.spans]
+            end = max((span['start'] + span['wall'] for span in self.spans), default=0.0)
+            events.extend({'name': name, 'ph': 'C', 'ts': end * 1e6, 'pid': pid, 'args': {name: value}}
+                          for name, value in self.counters.items())
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+
+# The process-wide tracer used by the module-level helpers
+TRACER = Tracer()
+
+
+def span(name, **attrs):
+    """ Measures the enclosed block as a span of the process-wide tracer (see Tracer.span). """
+    return TRACER.span(name, **attrs)
+
+
+def count(name, value=1):
+    """ Adds to a counter of the process-wide tracer. """
+    TRACER.count(name, value)
+
+
+def observe(name, value):
+    """ Records a value in a histogram of the process-wide tracer. """
+    TRACER.observe(name, value)
+
+
+def traced(name):
+    """ Decorator measuring every call of the function as a span of the process-wide tracer. """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with TRACER.span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
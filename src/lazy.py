@@ -0,0 +1,28 @@
+import importlib
+import sys
+
+
+def lazy_exports(module_name, exports):
+    """
+    lazy_exports builds the PEP 562 module hooks of a package whose public names are imported on first use.
+
+    Args:
+        module_name (str): The name of the package, i.e. its `__name__`.
+        exports (dict): Maps every public name to the submodule defining it.
+
+    Returns:
+        tuple: The `__getattr__` and `__dir__` functions of the package.
+    """
+    namespace = sys.modules[module_name].__dict__
+
+    def __getattr__(name):
+        if name not in exports:
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(f".{exports[name]}", module_name), name)
+        namespace[name] = value  # Later lookups skip __getattr__
+        return value
+
+    def __dir__():
+        return sorted(set(namespace) | set(exports))
+
+    return __getattr__, __dir__
@@ -0,0 +1,4 @@
+# the 'service' module keeps a loaded ETF graph and its analytics resident and answers queries over HTTP.
+from .state import GraphState
+from .server import QueryService
+from .server import serve
\ No newline at end of file
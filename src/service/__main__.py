@@ -0,0 +1,16 @@
+import argparse
+
+from .server import serve
+
+parser = argparse.ArgumentParser(description="ETF graph query service")
+parser.add_argument('snapshot', type=str, help='The graph snapshot directory to serve')
+parser.add_argument('--host', type=str, help='The interface to listen on (default 127.0.0.1)', default='127.0.0.1')
+parser.add_argument('--port', type=int, help='The TCP port to listen on (default 8000)', default=8000)
+parser.add_argument('--socket', type=str, help='Listen on a Unix domain socket instead of TCP')
+parser.add_argument('--communities', type=str, help='A partition saved with --save_communities, used instead of running Louvain at load')
+parser.add_argument('--snapshot_root', type=str, help='The directory /reload?path= may load snapshots from (default the directory of the snapshot)')
+parser.add_argument('--results_cache', type=str, help='Directory of the on-disk cache of analysis results')
+args = parser.parse_args()
+
+serve(args.snapshot, host=args.host, port=args.port, socket_path=args.socket, partition_path=args.communities, results_cache=args.results_cache,
+      snapshot_root=args.snapshot_root)
@@ -0,0 +1,205 @@
+import json
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from ..instrument import observe
+from .state import GraphState
+
+
+class QueryService:
+    """
+    QueryService keeps a GraphState resident and swaps it for a new snapshot without downtime.
+
+    Queries read the current state through a single reference, so they never block. A reload builds the new state on
+    a background thread while the old one keeps serving, then replaces the reference atomically.
+
+    Args:
+        snapshot_path (str): The snapshot directory to serve.
+        snapshot_root (str, optional): The directory /reload may load snapshots from, by default the one holding
+            `snapshot_path`.
+        **options: Options passed to GraphState, e.g. partition_path, results_cache and overlap_k.
+    """
+
+    def __init__(self, snapshot_path, snapshot_root=None, **options):
+        self.options = options
+        self.snapshot_root = os.path.realpath(snapshot_root or os.path.dirname(os.path.abspath(snapshot_path)))
+        self.state = GraphState(snapshot_path, **options)
+        self.reload_error = None
+        self._reload_lock = threading.Lock()
+
+    def reload(self, snapshot_path=None, wait=False):
+        """
+        Loads a snapshot, the current one by default, and swaps it in once it is fully precomputed.
+
+        Args:
+            snapshot_path (str, optional): The new snapshot directory.
+            wait (bool): Block until the new snapshot is serving.
+
+        Returns:
+            bool: False if a reload is already in progress.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        path = snapshot_path or self.state.snapshot_path
+
+        def swap():
+            try:
+                self.state = GraphState(path, **self.options)
+                self.reload_error = None
+                print(f"[+] Serving {path}")
+            except Exception as e:  # pylint: disable=broad-except
+                self.reload_error = f"{type(e).__name__}: {e}"
+                print(f"[!] Failed to load {path}, still serving {self.state.snapshot_path}: {self.reload_error}")
+            finally:
+                self._reload_lock.release()
+
+        if wait:
+            swap()
+        else:
+            threading.Thread(target=swap, daemon=True).start()
+        return True
+
+    def resolve_snapshot(self, snapshot_path):
+        """
+        Resolves a snapshot path requested over HTTP, relative to the snapshot root.
+
+        Raises:
+            PermissionError: If the path is outside the snapshot root, so callers cannot load arbitrary files.
+        """
+        path = os.path.realpath(os.path.join(self.snapshot_root, snapshot_path))
+        if os.path.commonpath([path, self.snapshot_root]) != self.snapshot_root:
+            raise PermissionError(f"Snapshots can only be loaded from {self.snapshot_root}")
+        return path
+
+    def query(self, path, params):
+        """
+        Answers a query against the current state.
+
+        Args:
+            path (str): The endpoint, e.g. '/top'.
+            params (dict): The query parameters.
+
+        Returns:
+            tuple: The HTTP status code and the JSON-serializable response.
+        """
+        state = self.state
+        try:
+            k = int(params.get('k', 10))
+            if path == '/health':
+                return 200, dict(state.info(), reloading=self._reload_lock.locked(), reload_error=self.reload_error)
+            if path == '/top':
+                return 200, state.top_stocks(params.get('by', 'weight'), k)
+            if path == '/holders':
+                return 200, state.holders(params['stock'])
+            if path == '/holdings':
+                return 200, state.holdings(params['etf'])
+            if path == '/community':
+                if 'id' in params:
+                    return 200, state.community(community_id=int(params['id']))
+                return 200, state.community(symbol=params['symbol'])
+            if path == '/overlap':
+                return 200, state.overlap_with(params['etf'], k)
+            if path == '/reload':
+                started = self.reload(self.resolve_snapshot(params['path']) if params.get('path') else None)
+                return (202, {'reloading': True}) if started else (409, {'error': 'A reload is already in progress'})
+        except KeyError as e:
+            return 404, {'error': str(e.args[0]) if e.args else 'Not found'}
+        except PermissionError as e:
+            return 403, {'error': str(e)}
+        except (TypeError, ValueError) as e:
+            # e.g. a JSON body with a list where a symbol or a number is expected
+            return 400, {'error': str(e)}
+        return 404, {'error': f"Unknown endpoint: {path}"}
+
+
+def _handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+        def _respond(self):
+            start = time.perf_counter()
+            url = urlparse(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                if self.command == 'POST' and int(self.headers.get('Content-Length') or 0):
+                    data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    if not isinstance(data, dict):
+                        raise ValueError(f"Expected a JSON object, got {type(data).__name__}")
+                    params.update(data)
+            except ValueError as e:
+                status, body = 400, {'error': f"Invalid request body: {e}"}
+            else:
+                status, body = service.query(url.path, params)
+
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            observe(f"service{url.path}", time.perf_counter() - start)
+
+        do_GET = _respond
+        do_POST = _respond
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ A threaded HTTP server listening on a Unix domain socket. """
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ('local', 0)
+
+
+def serve(snapshot_path, host='127.0.0.1', port=8000, socket_path=None, **options):
+    """
+    serve loads a snapshot and answers JSON queries over HTTP until interrupted.
+
+    Endpoints: /health, /top?by=weight|inclusions|pagerank&k=10, /holders?stock=X, /holdings?etf=X,
+    /community?symbol=X or /community?id=N, /overlap?etf=X&k=10 and /reload?path=... to hot-swap the snapshot for one
+    under the snapshot root.
+    A SIGHUP also reloads the current snapshot path, e.g. after it was overwritten with save_snapshot.
+
+    Args:
+        snapshot_path (str): The snapshot directory to serve.
+        host (str): The interface to listen on.
+        port (int): The TCP port to listen on.
+        socket_path (str, optional): Listen on this Unix domain socket instead of TCP.
+        **options: Options passed to QueryService, e.g. snapshot_root, and to GraphState.
+    """
+    service = QueryService(snapshot_path, **options)
+    print(f"[+] Loaded {snapshot_path} in {service.state.load_seconds:.2f}s")
+
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, _handler(service))
+        print(f"[+] Serving on unix socket {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), _handler(service))
+        server.daemon_threads = True
+        print(f"[+] Serving on http://{host}:{server.server_address[1]}")
+
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: service.reload())
+    # Exit through the finally block below so the Unix socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,114 @@
+import os
+import time
+
+import numpy as np # type: ignore
+
+from .. import graph
+from ..instrument import span
+from ..graph.community import community_members, summarize_communities
+
+
+class GraphState:
+    """
+    GraphState is the immutable, fully precomputed view of one snapshot that the query service answers from.
+
+    Everything expensive happens here, once per snapshot: the snapshot is memory-mapped, the stock rankings are
+    sorted, PageRank and the Louvain communities are computed (or read from a results cache or a saved partition)
+    and the ETF overlap index is built. Queries then only index into these structures.
+
+    Args:
+        snapshot_path (str): The snapshot directory written by graph.save_snapshot.
+        partition_path (str, optional): A partition saved with graph.save_partition, used instead of running Louvain.
+        results_cache (str, optional): A ResultCache directory for the PageRank and community results.
+        overlap_k (int): The number of most similar ETFs kept per ETF.
+    """
+
+    def __init__(self, snapshot_path, partition_path=None, results_cache=None, overlap_k=50):
+        self.snapshot_path = os.path.abspath(snapshot_path)
+        self.loaded_at = time.time()
+
+        with span('service.load') as attrs:
+            self.graph = graph.load_snapshot(snapshot_path)
+            G = self.graph
+            cache = graph.ResultCache(results_cache) if results_cache else None
+
+            def run(fn, target, *args, **kwargs):
+                return cache.call(fn, target, *args, **kwargs) if cache else fn(target, *args, **kwargs)
+
+            self.stock_weights = G.stock_weights()
+            self.stock_inclusions = G.stock_inclusions()
+            scores = run(graph.perform_pagerank, G)
+            self.stock_pagerank = np.array([scores.get(symbol, 0.0) for symbol in G.stock_symbols.tolist()])
+            # ETFs held by other ETFs are not ranked as stocks, as in graph.stocks_with_most_weight
+            stocks = np.flatnonzero(G.is_stock)
+            self.rankings = {
+                'weight': stocks[np.argsort(-self.stock_weights[stocks], kind='stable')],
+                'inclusions': stocks[np.argsort(-self.stock_inclusions[stocks], kind='stable')],
+                'pagerank': stocks[np.argsort(-self.stock_pagerank[stocks], kind='stable')],
+            }
+
+            if partition_path:
+                self.partition = graph.load_partition(partition_path)
+            else:
+                self.partition = run(graph.detect_communities_louvain, G.to_networkx())
+            self.communities = community_members(self.partition)
+            self.community_summary = summarize_communities(G, self.partition)
+
+            self.overlap = graph.SimilarityIndex.for_etfs(G, k=overlap_k)
+            attrs.update(etfs=G.num_etfs, stocks=G.num_stocks, edges=G.num_edges)
+        self.load_seconds = time.time() - self.loaded_at
+
+    def info(self):
+        """ Returns the description of the loaded snapshot. """
+        return {
+            'snapshot': self.snapshot_path,
+            'loaded_at': self.loaded_at,
+            'load_seconds': self.load_seconds,
+            'num_etfs': self.graph.num_etfs,
+            'num_stocks': self.graph.num_stocks,
+            'num_edges': self.graph.num_edges,
+            'num_communities': len(self.communities),
+        }
+
+    def top_stocks(self, by='weight', k=10):
+        """ Returns the top k stocks by 'weight', 'inclusions' or 'pagerank'. """
+        if by not in self.rankings:
+            raise ValueError(f"Unknown ranking: {by}, expected one of {', '.join(self.rankings)}")
+        values = {'weight': self.stock_weights, 'inclusions': self.stock_inclusions, 'pagerank': self.stock_pagerank}[by]
+        order = self.rankings[by][:k]
+        return list(zip(self.graph.stock_symbols[order].tolist(), values[order].tolist()))
+
+    def holders(self, stock):
+        """ Returns the ETFs holding a stock, heaviest first. """
+        if stock not in self.graph.stock_index:
+            raise KeyError(f"Unknown stock: {stock}")
+        return sorted(self.graph.stock_holders(stock), key=lambda item: item[1], reverse=True)
+
+    def holdings(self, etf):
+        """ Returns the holdings of an ETF, heaviest first. """
+        if etf not in self.graph.etf_index:
+            raise KeyError(f"Unknown ETF: {etf}")
+        return sorted(self.graph.etf_holdings(etf), key=lambda item: item[1], reverse=True)
+
+    def community(self, symbol=None, community_id=None):
+        """ Returns the community of a symbol, or the community with the given id, with its summary and members. """
+        if symbol is not None:
+            if symbol not in self.partition:
+                raise KeyError(f"Unknown symbol: {symbol}")
+            community_id = self.partition[symbol]
+        if community_id not in self.communities:
+            raise KeyError(f"Unknown community: {community_id}")
+        summary = self.community_summary[community_id]
+        return {
+            'community': community_id,
+            'size': summary['size'],
+            'stock_weight': summary['stock_weight'],
+            'top_stocks': summary['top_stocks'],
+            'members': self.communities[community_id],
+        }
+
+    def overlap_with(self, etf, k=10):
+        """ Returns the ETFs whose holdings overlap the most with an ETF's. """
+        if etf not in self.overlap.index:
+            raise KeyError(f"Unknown ETF: {etf}")
+        return self.overlap.most_similar(etf, k)
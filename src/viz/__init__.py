@@ -1,2 +1,14 @@
 # The 'viz' package is used to visualize the ETF graph and its communities.
-from .visualize_graph import plot_graph
\ No newline at end of file
+# matplotlib is imported on first use.
+from ..lazy import lazy_exports
+
+# Maps every public name to the submodule defining it
+_EXPORTS = {
+    'plot_graph': 'visualize_graph',
+    'community_layout': 'layout',
+    'community_graph': 'layout',
+}
+
+__all__ = list(_EXPORTS)
+
+__getattr__, __dir__ = lazy_exports(__name__, _EXPORTS)
\ No newline at end of file
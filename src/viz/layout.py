@@ -0,0 +1,130 @@
+import networkx as nx # type: ignore
+import numpy as np # type: ignore
+from scipy import sparse # type: ignore
+
+MAX_SPRING_NODES = 300  # Larger communities only run the spring layout on their best connected nodes
+SPRING_ITERATIONS = 50
+
+
+def _groups(G, partition):
+    """ Returns the community ids and the members of every community, nodes missing from the partition in their own. """
+    members = {}
+    for node in G:
+        members.setdefault(partition.get(node, None) if partition else 0, []).append(node)
+    return list(members), list(members.values())
+
+
+def community_graph(G, partition, weight='weight'):
+    """
+    community_graph collapses every community of the partition into a supernode.
+
+    Args:
+        G (nx.Graph): The graph.
+        partition (dict): A dictionary mapping every node to its community.
+        weight (str): The edge attribute summed into the weight of the edges between communities.
+
+    Returns:
+        nx.Graph: A graph of the communities, with the number of members as the 'size' attribute and the summed
+            weight of the edges between two communities as the 'weight' of their edge. The 'strength' of an edge is
+            the logarithm of its weight, a spring strength under which weakly tied communities are not pushed away.
+    """
+    communities, members = _groups(G, partition)
+    nodes = [node for group in members for node in group]
+    membership = np.repeat(np.arange(len(communities)), [len(group) for group in members])
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=weight, format='csr')
+    C = sparse.csr_matrix((np.ones(len(nodes)), (np.arange(len(nodes)), membership)), shape=(len(nodes), len(communities)))
+    between = sparse.triu(C.T @ A @ C, k=1).tocoo()
+
+    H = nx.Graph()
+    for community, group in zip(communities, members):
+        H.add_node(community, size=len(group))
+    for i, j, w in zip(between.row, between.col, between.data):
+        H.add_edge(communities[i], communities[j], weight=w, strength=np.log1p(abs(w)))
+    return H
+
+
+def _spring(G, seed, weight='weight'):
+    """ Lays out a small graph with the spring layout, centered on the origin and scaled to the unit disk. """
+    if G.number_of_nodes() == 1:
+        return {next(iter(G)): np.zeros(2)}
+    k = 3 / np.sqrt(G.number_of_nodes())
+    return nx.spring_layout(G, k=k, iterations=SPRING_ITERATIONS, seed=seed, weight=weight)
+
+
+def _anchored_layout(G, seed, weight='weight', max_spring_nodes=MAX_SPRING_NODES):
+    """
+    Lays out a large graph in O(edges) beyond its `max_spring_nodes` best connected nodes.
+
+    The anchors are laid out with the spring layout, then every other node is placed at the weighted mean of its
+    already placed neighbours, breadth first from the anchors, with a small jitter so that nodes with the same
+    neighbours do not overlap.
+    """
+    nodes = list(G)
+    rng = np.random.default_rng(seed)
+    A = nx.to_scipy_sparse_array(G, nodelist=nodes, weight=weight, format='csr')
+    A.data = np.abs(A.data) + 1e-12  # Zero weights still pull their endpoints together
+    degrees = np.diff(A.indptr)
+    anchors = np.argsort(-degrees, kind='stable')[:max_spring_nodes]
+
+    xy = rng.uniform(-1, 1, size=(len(nodes), 2))
+    placed = np.zeros(len(nodes), dtype=bool)
+    anchor_pos = _spring(G.subgraph([nodes[i] for i in anchors]), seed, weight)
+    xy[anchors] = [anchor_pos[nodes[i]] for i in anchors]
+    placed[anchors] = True
+
+    while not placed.all():
+        pending = np.flatnonzero(~placed)
+        # The weighted mean of the placed neighbours of every pending node, in one sparse product
+        to_placed = A[pending][:, placed]
+        totals = np.asarray(to_placed.sum(axis=1)).ravel()
+        reachable = totals > 0
+        if not reachable.any():
+            # Whatever is left is not connected to the placed nodes and keeps its random position
+            break
+        targets = pending[reachable]
+        xy[targets] = (to_placed[reachable] @ xy[placed]) / totals[reachable, None]
+        xy[targets] += rng.normal(scale=0.05, size=(len(targets), 2))
+        placed[targets] = True
+
+    return dict(zip(nodes, xy))
+
+
+def community_layout(G, partition=None, seed=42, weight='weight', max_spring_nodes=MAX_SPRING_NODES):
+    """
+    community_layout positions the nodes of a graph community by community, which scales to graphs where a spring
+    layout of every node (O(N²) per iteration) is out of reach.
+
+    The communities are first laid out as supernodes with the spring layout, spaced by the weight between them.
+    Each community is then laid out on its own, in a disk proportional to the square root of its size around its
+    supernode. Communities of more than `max_spring_nodes` nodes only run the spring layout on their best connected
+    nodes and place the rest at the weighted mean of their neighbours.
+
+    Args:
+        G (nx.Graph): The graph.
+        partition (dict, optional): A dictionary mapping every node to its community, the whole graph is one community
+            if not provided.
+        seed (int): The seed of the layout, the same graph and seed always give the same positions.
+        weight (str): The edge attribute used as the spring strength.
+        max_spring_nodes (int): The largest number of nodes a spring layout runs on.
+
+    Returns:
+        dict: A dictionary mapping every node to its (x, y) position as a numpy array.
+    """
+    communities, members = _groups(G, partition)
+    sizes = np.array([len(group) for group in members], dtype=float)
+    if len(communities) > 1:
+        centers = _spring(community_graph(G, partition, weight), seed, 'strength')
+        centers = np.array([centers[community] for community in communities])
+    else:
+        centers = np.zeros((1, 2))
+    radii = 0.5 * np.sqrt(sizes / sizes.sum()) if len(communities) > 1 else np.ones(1)
+
+    pos = {}
+    for center, radius, group in zip(centers, radii, members):
+        subgraph = G.subgraph(group)
+        local = _spring(subgraph, seed, weight) if len(group) <= max_spring_nodes else _anchored_layout(subgraph, seed, weight, max_spring_nodes)
+        local_xy = np.array(list(local.values()))
+        extent = np.abs(local_xy).max() or 1.0
+        for node, xy in zip(local, local_xy):
+            pos[node] = center + radius * xy / extent
+    return pos
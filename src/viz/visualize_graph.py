@@ -1,43 +1,110 @@
-import matplotlib.pyplot as plt # type: ignore
-import networkx as nx # type: ignore
 import numpy as np # type: ignore
+from matplotlib import colormaps # type: ignore
+from matplotlib.backends.backend_agg import FigureCanvasAgg # type: ignore
+from matplotlib.collections import LineCollection # type: ignore
+from matplotlib.figure import Figure # type: ignore
 
-def plot_graph(G, partition=None):
+from .layout import community_graph, community_layout
+
+SUPERNODE_THRESHOLD = 5000  # Graphs with more nodes are drawn as communities by default
+MAX_LABELS = 30
+MAX_NODE_SIZE = 2000
+
+
+def _layout(G, partition, layout_cache, **kwargs):
+    """ Returns the community layout of a graph, reading and writing the layout cache if given. """
+    if layout_cache is None:
+        return community_layout(G, partition, **kwargs)
+    from ..graph.memo import ResultCache
+    cache = layout_cache if isinstance(layout_cache, ResultCache) else ResultCache(layout_cache)
+    return cache.call(community_layout, G, partition, **kwargs)
+
+
+def _draw(ax, nodes, pos, sizes, colors, edges, edge_weights, labels, max_width):
+    """ Draws the nodes with a single scatter call and the edges with a single line collection, as wide as their weight. """
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array([pos[node] for node in nodes]).reshape(-1, 2)
+    if edges:
+        segments = np.stack([xy[[index[u] for u, _ in edges]], xy[[index[v] for _, v in edges]]], axis=1)
+        edge_weights = np.abs(np.asarray(edge_weights, dtype=float))
+        widths = 0.1 + max_width * edge_weights / (edge_weights.max() or 1)
+        # Thousands of overlapping edges would otherwise paint whole regions black
+        alpha = min(0.5, max(0.02, 1000 / len(edges)))
+        ax.add_collection(LineCollection(segments, linewidths=widths, colors='k', alpha=alpha, zorder=1))
+    ax.scatter(xy[:, 0], xy[:, 1], s=sizes, c=colors, zorder=2)
+    for node in labels:
+        ax.annotate(str(node), xy[index[node]], fontsize=8, fontfamily='sans-serif', ha='center', va='center', zorder=3)
+
+
+def _community_colors(communities):
+    """ Returns a viridis color per community id, in the order given. """
+    _, dense = np.unique([str(community) for community in communities], return_inverse=True)
+    return colormaps['viridis'](dense / max(dense.max(), 1)) if len(dense) else 'blue'
+
+
+def plot_graph(G, partition=None, output_file=None, layout_cache=None, supernodes=None, seed=42, max_labels=MAX_LABELS, dpi=150):
     """
     plot_graph plots the provided NetworkX graph with optional partitioning.
-    
+
+    Nodes are positioned with community_layout, community by community, and drawn in a single call, sized by degree
+    and colored by community, with the edges as a single line collection. Only the `max_labels` best connected nodes
+    are labeled. In supernode mode every community is drawn as one node sized by its number of members, with edges
+    as wide as the weight between the communities, which keeps graphs of any size readable.
+
     Args:
-        G (nx.Graph): The NetworkX graph to plot.
+        G (nx.Graph or BipartiteGraph): The graph to plot.
         partition (dict, optional): A dictionary containing node names as keys and their community as values.
-        
+        output_file (str, optional): Render to this image file, without a display, instead of opening a window.
+        layout_cache (str or ResultCache, optional): A results cache directory the layout is stored in, keyed by the
+            graph contents, so plotting the same graph again skips the layout.
+        supernodes (bool, optional): Draw each community as a single node, by default when a partition is given and
+            the graph has more than SUPERNODE_THRESHOLD nodes.
+        seed (int): The seed of the layout.
+        max_labels (int): The number of nodes labeled, by degree.
+        dpi (int): The resolution of the output file.
+
     Returns:
         None: The function plots the graph but does not return anything.
     """
-    k_value = 1 / np.sqrt(G.number_of_nodes()) * 3  # Scale k with the inverse square root of the number of nodes, multiplied for more spacing
-
-    # Position nodes using an improved spring layout
-    pos = nx.spring_layout(G, k=k_value, iterations=100, seed=42)  # Increased k for spacing, more iterations for better positioning
-
-    # Draw the graph
-    plt.figure(figsize=(16, 12))  # Increased figure size for better visibility
-
-    # If a partition is provided, color nodes according to their partition
-    if partition:
-        cmap = plt.get_cmap('viridis')  # Color map
-        num_communities = len(set(partition.values()))
-        colors = [cmap(i / num_communities) for i in range(num_communities)]
-        
-        for node, community in partition.items():
-            node_size = G.degree(node) * 10  # Scale node size by degree to highlight more connected nodes
-            nx.draw_networkx_nodes(G, pos, [node], node_size=node_size, node_color=[colors[community]])
+    if hasattr(G, 'to_networkx'):
+        G = G.to_networkx()
+    if supernodes is None:
+        supernodes = bool(partition) and G.number_of_nodes() > SUPERNODE_THRESHOLD
+
+    if output_file:
+        # A bare Agg figure renders without pyplot, so it works on servers without a display
+        fig = Figure(figsize=(16, 12))
+        FigureCanvasAgg(fig)
+    else:
+        import matplotlib.pyplot as plt # type: ignore
+        fig = plt.figure(figsize=(16, 12))
+    ax = fig.add_subplot()
+
+    if supernodes:
+        H = community_graph(G, partition)
+        pos = _layout(H, None, layout_cache, seed=seed, weight='strength')
+        nodes = list(H)
+        sizes = np.array([H.nodes[community]['size'] for community in nodes], dtype=float)
+        edges = list(H.edges())
+        weights = [H.edges[edge]['weight'] for edge in edges]
+        labels = [nodes[i] for i in np.argsort(-sizes, kind='stable')[:max_labels]]
+        _draw(ax, nodes, pos, MAX_NODE_SIZE * sizes / sizes.max(), _community_colors(nodes), edges, weights, labels, max_width=10)
+        ax.set_title(f'Communities of the Network Graph of ETFs and Stocks ({len(nodes)} communities)')
+    else:
+        pos = _layout(G, partition, layout_cache, seed=seed)
+        nodes = list(G)
+        degrees = np.array([G.degree(node) for node in nodes], dtype=float)
+        colors = _community_colors([partition.get(node) for node in nodes]) if partition else 'blue'
+        edges = list(G.edges())
+        weights = [data['weight'] for _, _, data in G.edges(data=True)]
+        labels = [nodes[i] for i in np.argsort(-degrees, kind='stable')[:max_labels]]
+        # Scale node sizes by degree to highlight more connected nodes
+        _draw(ax, nodes, pos, np.clip(degrees * 10, 1, MAX_NODE_SIZE / 4), colors, edges, weights, labels, max_width=2)
+        ax.set_title('Network Graph of ETFs and Stocks')
+
+    ax.autoscale_view()
+    ax.axis('off')  # Turn off the axis
+    if output_file:
+        fig.savefig(output_file, dpi=dpi)
     else:
-        node_sizes = [G.degree(node) * 10 for node in G]  # Scale node sizes by degree
-        nx.draw_networkx_nodes(G, pos, node_size=node_sizes, node_color='blue')
-
-    edge_widths = [0.1 + 0.5 * data['weight'] for _, _, data in G.edges(data=True)]  # Scale edge widths by weight
-    nx.draw_networkx_edges(G, pos, width=edge_widths, alpha=0.5)
-    nx.draw_networkx_labels(G, pos, font_size=8, font_family='sans-serif')
-    
-    plt.title('Network Graph of ETFs and Stocks')
-    plt.axis('off')  # Turn off the axis
-    plt.show()
\ No newline at end of file
+        plt.show()
@@ -0,0 +1,20 @@
+import time
+
+from bench.server import FakeFMPServer, generate_universe, use_base_url
+from src.fmp import async_pull
+
+
+def test_closing_the_stream_early_stops_fetching():
+    etf_list, holdings = generate_universe(200, seed=0)
+    with FakeFMPServer(etf_list, holdings, latency=0.02, jitter=0.0) as server, use_base_url(server.base_url):
+        stream = async_pull.iter_etf_details_async(etf_list, 'bench', rate_limit=10 ** 6, max_connections=5)
+        for i, _ in enumerate(stream):
+            if i == 10:
+                break
+        stream.close()
+        requests = server.requests
+        time.sleep(0.2)
+
+        # Only the requests in flight when the stream was closed were made on top of the ETFs consumed
+        assert requests <= 11 + 5
+        assert server.requests == requests
@@ -0,0 +1,32 @@
+import numpy as np # type: ignore
+
+from src import graph
+
+
+def random_graph(rng, n_etfs=8, n_stocks=30):
+    details = {}
+    for i in rng.choice(n_etfs + 2, size=n_etfs, replace=False):
+        stocks = rng.choice(n_stocks, size=rng.integers(1, 10), replace=False)
+        details[f"E{i}"] = {
+            'leveraged': False, 'inverse': False,
+            'holdings': [{'asset': f"S{s}", 'weightPercentage': float(rng.integers(1, 5))} for s in stocks],
+        }
+    return graph.BipartiteGraph.from_fmp(details)
+
+
+def test_single_stock_queries_match_the_reconstructed_graphs(tmp_path):
+    rng = np.random.default_rng(0)
+    history = graph.HoldingsHistory(str(tmp_path), keyframe_interval=3)
+    dates = [f"2024-01-{day:02d}" for day in range(1, 11)]
+    for date in dates:
+        history.add(date, random_graph(rng))
+
+    reopened = graph.HoldingsHistory(str(tmp_path))
+    for stock in ('S0', 'S7', 'S29'):
+        expected = {}
+        for date in dates:
+            G = reopened.graph_as_of(date)
+            holders = {etf: weight for etf in G.etf_symbols.tolist() for s, weight in G.etf_holdings(etf) if s == stock}
+            expected[date] = holders
+            assert reopened.stock_holders_as_of(stock, date) == holders
+        assert reopened.weight_history(stock) == expected
@@ -0,0 +1,30 @@
+from src import graph
+
+
+def holdings(*pairs):
+    return {'leveraged': False, 'inverse': False, 'holdings': [{'asset': asset, 'weightPercentage': weight} for asset, weight in pairs]}
+
+
+def test_update_keeps_the_holding_of_an_etf_first_seen_as_a_holding():
+    # B is held by X before its own holdings arrive, so its node keeps the 'Stock' type
+    G = graph.create_graph_from_fmp({
+        'Y': holdings(('X', 3.0)),
+        'X': holdings(('B', 5.0), ('S1', 2.0)),
+        'B': holdings(('S2', 1.0)),
+    })
+    G, changes = graph.update_graph(G, {'B': holdings(('S3', 4.0))})
+
+    assert G.edges['X', 'B'] == {'weight': 5.0, 'holder': 'X'}
+    assert changes['removed_edges'] == [('B', 'S2', 1.0)]
+    assert changes['added_edges'] == [('B', 'S3', 4.0)]
+
+    G, changes = graph.update_graph(G, {}, removed_etfs=['B'])
+    assert G.has_edge('X', 'B')
+    assert changes['removed_edges'] == [('B', 'S3', 4.0)]
+
+
+def test_update_applies_the_last_details_of_an_etf_listed_twice():
+    B = graph.BipartiteGraph.from_fmp({'A': holdings(('S', 4.0))})
+    B, _ = graph.update_graph(B, [('A', holdings(('S', 4.0))), ('A', holdings(('S', 6.0)))])
+
+    assert B.etf_holdings('A') == [('S', 6.0)]